@@ -0,0 +1,65 @@
+"""Accuracy parity and throughput/latency of the classifier backends on the held-out split.
+
+Export the ONNX models first (python export_onnx.py), then from the repository root:
+
+    python -m benchmarks.classifier_backends --limit 2000
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+from sklearn.metrics import accuracy_score, precision_recall_fscore_support
+
+import classifier
+import trainer
+
+# torch-int8 runs last because quantizing replaces the fp32 model in place
+BACKEND_ORDER = ["torch", "onnx", "torch-int8"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare classifier backends against the fp32 model')
+    parser.add_argument('--data', type=str, default=trainer.DATA_PATH)
+    parser.add_argument('--limit', type=int, default=None, help='Only use the first N held-out statements.')
+    parser.add_argument('--batch-size', type=int, default=classifier.DEFAULT_BATCH_SIZE)
+    parser.add_argument('--latency-samples', type=int, default=200,
+                       help='Number of single-statement calls used for the latency percentiles.')
+    args = parser.parse_args()
+
+    held_out = trainer.load_held_out_split(args.data)
+    if args.limit:
+        held_out = held_out.select(range(min(args.limit, len(held_out))))
+    texts, gold = held_out["text"], held_out.features["label"].int2str(held_out["label"])
+    print(f"Held-out split: {len(texts)} statements from {args.data}\n")
+
+    reference = None
+    print(f"{'backend':<11} {'accuracy':>8} {'f1':>6} {'agree':>6} {'stmts/sec':>10} {'p50 ms':>7} {'p99 ms':>7}")
+    for name in BACKEND_ORDER:
+        if name == "onnx" and not os.path.exists(classifier.ONNX_INT8_MODEL_PATH):
+            print(f"{name:<11} skipped: {classifier.ONNX_INT8_MODEL_PATH} missing, run export_onnx.py")
+            continue
+        classifier.set_backend(name)
+        classifier.predict_batch(texts[:args.batch_size], batch_size=args.batch_size)
+
+        start = time.perf_counter()
+        predictions = [p["label"] for p in classifier.predict_batch(texts, batch_size=args.batch_size)]
+        throughput = len(texts) / (time.perf_counter() - start)
+
+        latencies = []
+        for text in texts[:args.latency_samples]:
+            start = time.perf_counter()
+            classifier.predict_single(text)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        if reference is None:
+            reference = predictions
+        accuracy = accuracy_score(gold, predictions)
+        _, _, f1, _ = precision_recall_fscore_support(gold, predictions, average='weighted', zero_division=0)
+        agreement = np.mean([a == b for a, b in zip(predictions, reference)])
+        print(f"{name:<11} {accuracy:8.4f} {f1:6.4f} {agreement:6.1%} {throughput:10.1f} "
+              f"{np.percentile(latencies, 50):7.2f} {np.percentile(latencies, 99):7.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""Compare per-statement classification against length-bucketed batching.
+
+Run from the repository root so the classifier finds its model directory:
+
+    python -m benchmarks.classifier_batching --repeat 10 --batch-sizes 8 32 64
+"""
+import argparse
+import json
+import time
+
+import classifier
+
+CORPORA = ["examples/long_statements.json", "examples/short_statements.json"]
+
+
+def load_corpus(path, repeat):
+    with open(path) as f:
+        texts = json.load(f)
+    return texts * repeat
+
+
+def measure(fn, texts):
+    start = time.perf_counter()
+    fn(texts)
+    elapsed = time.perf_counter() - start
+    return len(texts) / elapsed, elapsed
+
+
+def loop_baseline(texts):
+    return [classifier.predict_single(text) for text in texts]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark classifier batching throughput')
+    parser.add_argument('--repeat', type=int, default=5,
+                       help='Repeat each corpus this many times to get stable timings.')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[8, 32, 64])
+    args = parser.parse_args()
+
+    # Warm up kernels and allocator before timing anything
+    classifier.predict_batch(load_corpus(CORPORA[0], 1))
+
+    for path in CORPORA:
+        texts = load_corpus(path, args.repeat)
+        baseline_rate, baseline_elapsed = measure(loop_baseline, texts)
+        print(f"{path} ({len(texts)} statements)")
+        print(f"  loop (predict_single)  {baseline_rate:8.1f} statements/sec  {baseline_elapsed:7.2f}s")
+        for batch_size in args.batch_sizes:
+            rate, elapsed = measure(lambda t: classifier.predict_batch(t, batch_size=batch_size), texts)
+            print(f"  batched (size={batch_size:<3})    {rate:8.1f} statements/sec  {elapsed:7.2f}s"
+                  f"  x{rate / baseline_rate:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""Statements/sec of multi-process classification at 1, 2, 4, 8, ... workers.
+
+Each worker gets cpu_count / workers torch threads and its own set of cores.
+
+    python -m benchmarks.classifier_scaling --statements 20000
+"""
+import argparse
+import json
+import os
+import time
+
+import classifier
+
+CORPORA = ["examples/long_statements.json", "examples/short_statements.json"]
+
+
+def build_corpus(size):
+    texts = []
+    for path in CORPORA:
+        with open(path) as f:
+            texts.extend(json.load(f))
+    return (texts * (size // len(texts) + 1))[:size]
+
+
+def main():
+    cpus = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description='Benchmark classifier scaling across worker processes')
+    parser.add_argument('--statements', type=int, default=5000)
+    parser.add_argument('--batch-size', type=int, default=classifier.DEFAULT_BATCH_SIZE)
+    parser.add_argument('--max-workers', type=int, default=cpus)
+    args = parser.parse_args()
+
+    texts = build_corpus(args.statements)
+    worker_counts = [1]
+    while worker_counts[-1] * 2 <= args.max_workers:
+        worker_counts.append(worker_counts[-1] * 2)
+
+    print(f"{len(texts)} statements, batch size {args.batch_size}, {cpus} CPUs")
+    baseline = None
+    for workers in worker_counts:
+        batches = classifier.iter_batches(texts, args.batch_size)
+        start = time.perf_counter()
+        count = sum(len(p) for p in classifier.predict_parallel(batches, workers, args.batch_size))
+        rate = count / (time.perf_counter() - start)
+        baseline = baseline or rate
+        print(f"  {workers:3d} workers x {max(1, cpus // workers):3d} threads  "
+              f"{rate:9.1f} statements/sec  x{rate / baseline:.2f}")
+
+
+if __name__ == "__main__":
+    main()
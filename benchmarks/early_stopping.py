@@ -0,0 +1,70 @@
+"""Measure the tokens and time saved by stopping recommendations early.
+
+Every classified statement's recommendation is generated twice from the same
+seed, once to max_new_tokens or end of text and once with the section
+stopping criterion. Both runs sample the same tokens until the criterion
+fires, so the difference in length is exactly the number of tokens saved.
+The stopped output must be a prefix of the full one.
+
+    python -m benchmarks.early_stopping --limit 20
+"""
+import argparse
+import json
+import time
+
+import torch
+
+import statement_generator
+from benchmarks.prefix_cache import CORPUS
+
+
+def generate(engine, segments, params, seed):
+    torch.manual_seed(seed)
+    start = time.perf_counter()
+    [(_, generated_ids)] = list(engine.run([(0, segments, params)]))
+    return list(generated_ids), time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark early stopping of recommendations')
+    parser.add_argument('--limit', type=int, default=20, help='Number of classified statements to use.')
+    parser.add_argument('--section-tokens', type=int, default=statement_generator.section_tokens)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with open(CORPUS) as f:
+        records = json.load(f)[:args.limit]
+
+    statement_generator.load_generator()
+    statement_generator.section_tokens = args.section_tokens
+    engine = statement_generator.create_engine(max_batch_size=1)
+    params = statement_generator.get_generation_params('rec')
+
+    full_tokens, stopped_tokens, full_seconds, stopped_seconds, mismatches = [], [], [], [], 0
+    for index, record in enumerate(records):
+        segments = statement_generator.encode_prompt_segments(record['text'], record['label'], 'rec')
+        prompt_length = sum(len(segment) for segment in segments)
+        full, elapsed = generate(engine, segments, params, args.seed + index)
+        full_tokens.append(len(full))
+        full_seconds.append(elapsed)
+        stopped, elapsed = generate(
+            engine, segments, statement_generator.with_stopping_criteria(params, 'rec', prompt_length), args.seed + index)
+        stopped_tokens.append(len(stopped))
+        stopped_seconds.append(elapsed)
+        mismatches += full[:len(stopped)] != stopped
+
+    values = statement_generator.metrics.snapshot()
+    count = len(records)
+    saved = sum(full_tokens) - sum(stopped_tokens)
+    print(f"rec: {count} calls, max_new_tokens {params['max_new_tokens']}, section budget {args.section_tokens} tokens")
+    print(f"  full      {sum(full_tokens) / count:7.1f} tokens/call  {1000 * sum(full_seconds) / count:8.1f} ms/call")
+    print(f"  stopped   {sum(stopped_tokens) / count:7.1f} tokens/call  {1000 * sum(stopped_seconds) / count:8.1f} ms/call")
+    print(f"  saved     {saved / count:7.1f} tokens/call  "
+          f"{1000 * (sum(full_seconds) - sum(stopped_seconds)) / count:8.1f} ms/call")
+    print(f"  stopped early: {values.get('early_stops_structure', 0)} with the structure complete, "
+          f"{values.get('early_stops_budget', 0)} over the section budget")
+    print(f"  stopped output a prefix of the full output: {count - mismatches}/{count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""Load time, memory and throughput of the generator in each --dtype mode.
+
+Each mode runs in a fresh interpreter, so its peak RSS is not inflated by the
+others. A mode loads the generator, then greedily generates responses for the
+first --statements example statements through the batched engine. Greedy
+outputs are compared with fp32 to show how much quantization changes them.
+
+    python -m benchmarks.generator_memory --dtypes fp32 bf16 int8
+
+The configured generator (DIPLOMATE_GENERATOR_MODEL, default Qwen/Qwen2-1.5B)
+is used unless --generator-model is given.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+OUTPUT_DIR = "output/benchmarks"
+
+
+def measure(dtype, args):
+    import psutil
+    import torch
+    import statement_generator
+    from benchmarks.suite import capped_params, example_statements
+    from label_registry import LABELS
+    from metrics import peak_rss_bytes
+
+    start = time.perf_counter()
+    statement_generator.load_generator(args.generator_model, dtype)
+    load_seconds = time.perf_counter() - start
+    loaded_rss = psutil.Process().memory_info().rss
+
+    params = {**capped_params(statement_generator, 'res', args.max_new_tokens), "do_sample": False}
+    for name in ("temperature", "top_p"):
+        params.pop(name)
+    requests = [
+        (index, statement_generator.encode_prompt_segments(text, LABELS[index % len(LABELS)], 'res'), params)
+        for index, text in enumerate(example_statements()[:args.statements])
+    ]
+    engine = statement_generator.create_engine(max_batch_size=args.batch_size)
+    with torch.inference_mode():
+        start = time.perf_counter()
+        outputs = dict(engine.run(requests))
+        elapsed = time.perf_counter() - start
+    tokens = sum(len(ids) for ids in outputs.values())
+    return {
+        "dtype": dtype,
+        "load_seconds": round(load_seconds, 3),
+        "loaded_rss_bytes": loaded_rss,
+        "peak_rss_bytes": peak_rss_bytes(),
+        "tokens_per_second": round(tokens / elapsed, 2) if elapsed else 0.0,
+        "outputs": [outputs[index] for index in range(len(requests))],
+    }
+
+
+def agreement(outputs, reference):
+    """Share of outputs identical to the reference, and mean share of each output matching before they diverge."""
+    identical, prefix = 0, 0.0
+    for ids, expected in zip(outputs, reference):
+        common = next((i for i, (a, b) in enumerate(zip(ids, expected)) if a != b), min(len(ids), len(expected)))
+        identical += ids == expected
+        prefix += common / max(len(expected), 1)
+    return round(identical / len(reference), 4), round(prefix / len(reference), 4)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark generator memory and throughput per dtype')
+    parser.add_argument('--dtypes', nargs='+', default=["fp32", "bf16", "int8"], choices=["fp32", "bf16", "int8"])
+    parser.add_argument('--generator-model', type=str, default=None)
+    parser.add_argument('--statements', type=int, default=16)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--max-new-tokens', type=int, default=64)
+    parser.add_argument('--output', type=str, default=None,
+                       help='Report path (default: output/benchmarks/generator_memory_<timestamp>.json).')
+    parser.add_argument('--worker', type=str, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(measure(args.worker, args)))
+        return
+
+    results = []
+    for dtype in args.dtypes:
+        print(f"Measuring {dtype}...", file=sys.stderr)
+        command = [sys.executable, "-m", "benchmarks.generator_memory", "--worker", dtype,
+                   "--statements", str(args.statements), "--batch-size", str(args.batch_size),
+                   "--max-new-tokens", str(args.max_new_tokens)]
+        if args.generator_model:
+            command += ["--generator-model", args.generator_model]
+        completed = subprocess.run(command, stdout=subprocess.PIPE, text=True, check=True)
+        results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+    reference = next((result["outputs"] for result in results if result["dtype"] == "fp32"), None)
+    for result in results:
+        outputs = result.pop("outputs")
+        if reference is not None:
+            result["identical_to_fp32"], result["prefix_match_to_fp32"] = agreement(outputs, reference)
+        print(f"{result['dtype']:<5} load {result['load_seconds']:6.1f}s  loaded RSS {result['loaded_rss_bytes'] / 2**20:7.0f} MiB  "
+              f"peak RSS {result['peak_rss_bytes'] / 2**20:7.0f} MiB  {result['tokens_per_second']:8.1f} tokens/sec"
+              + (f"  identical to fp32 {result['identical_to_fp32']:.0%}" if reference is not None else ""))
+
+    output = args.output or os.path.join(OUTPUT_DIR, f"generator_memory_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "args": vars(args), "results": results}, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""False-match rate and recall of near-duplicate lookup at a range of similarity thresholds.
+
+Negatives are the distinct statements in examples/*.json, leaving out pairs
+where one statement contains the other. A false match is a statement whose
+nearest unrelated statement is at least threshold similar. Positives are
+each statement after one small edit: a change of case or punctuation, a
+dropped or replaced word, or a short phrase appended. Recall is the share of
+edited statements still matched to their original.
+
+    python -m benchmarks.near_duplicates
+    python -m benchmarks.near_duplicates --classifier-model output/diplomatic_text_classifier_model
+
+By default the hashed n-gram vectors of embedding_index.text_vector are
+measured; --classifier-model measures mean-pooled DistilBERT embeddings of
+that checkpoint instead, for comparison.
+"""
+import argparse
+import random
+
+import numpy as np
+
+from benchmarks.suite import example_statements
+from embedding_index import TEXT_VECTOR_DIMENSION, text_vector
+
+THRESHOLDS = [0.8, 0.85, 0.9, 0.95, 0.98]
+
+
+def edit(text, rng):
+    words = text.split()
+    kind = rng.randrange(4)
+    if kind == 0:
+        return text.upper() if rng.random() < 0.5 else text.replace(",", "").replace(".", "!")
+    if kind == 1 and len(words) > 3:
+        del words[rng.randrange(len(words))]
+        return " ".join(words)
+    if kind == 2 and len(words) > 3:
+        words[rng.randrange(len(words))] = "very"
+        return " ".join(words)
+    return text + " Thank you."
+
+
+def pooled_embeddings(model_path):
+    def embed(texts):
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(model_path)
+        model = AutoModel.from_pretrained(model_path).eval()
+        vectors = []
+        with torch.inference_mode():
+            for start in range(0, len(texts), 32):
+                inputs = tokenizer(texts[start:start + 32], return_tensors="pt", padding=True, truncation=True,
+                                   max_length=512)
+                hidden = model(**inputs).last_hidden_state
+                mask = inputs["attention_mask"].unsqueeze(-1)
+                vectors.append(torch.nn.functional.normalize((hidden * mask).sum(dim=1) / mask.sum(dim=1), dim=-1))
+        return torch.cat(vectors).numpy()
+    return embed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure near-duplicate false matches and recall per threshold')
+    parser.add_argument('--classifier-model', type=str, default=None,
+                       help='Measure mean-pooled embeddings of this checkpoint instead of hashed n-grams.')
+    parser.add_argument('--dimension', type=int, default=TEXT_VECTOR_DIMENSION)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    texts = list(dict.fromkeys(" ".join(text.split()) for text in example_statements()))
+    rng = random.Random(args.seed)
+    edited = [edit(text, rng) for text in texts]
+    if args.classifier_model:
+        embed = pooled_embeddings(args.classifier_model)
+    else:
+        embed = lambda batch: np.stack([text_vector(text, args.dimension) for text in batch])
+    vectors, edited_vectors = embed(texts), embed(edited)
+
+    lowered = [text.lower() for text in texts]
+    similarities = vectors @ vectors.T
+    for row, text in enumerate(lowered):
+        for column, other in enumerate(lowered):
+            if text in other or other in text:
+                similarities[row, column] = -1.0
+    nearest = similarities.max(axis=1)
+    recall = (vectors * edited_vectors).sum(axis=1)
+
+    print(f"{len(texts)} statements, {'pooled ' + args.classifier_model if args.classifier_model else 'hashed n-grams'}")
+    for threshold in THRESHOLDS:
+        print(f"  threshold {threshold:.2f}  false matches {(nearest >= threshold).mean():6.1%}  "
+              f"recall on edits {(recall >= threshold).mean():6.1%}")
+    print(f"  nearest unrelated statement: p99 {np.quantile(nearest, 0.99):.3f}, max {nearest.max():.3f}")
+
+
+if __name__ == "__main__":
+    main()
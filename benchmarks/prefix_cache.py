@@ -0,0 +1,66 @@
+"""Measure the prefill time saved by reusing prompt-prefix KV caches.
+
+For every classified statement and mode, the prompt is prefilled once from
+scratch and once on top of the cached mode preamble and label context.
+
+    python -m benchmarks.prefix_cache --limit 20
+"""
+import argparse
+import json
+import time
+
+import torch
+
+import statement_generator
+from generation_engine import GenerationEngine
+
+CORPUS = "results/trump_zelensky_classified_statements.json"
+
+
+def time_prefill(engine, segments):
+    start = time.perf_counter()
+    with torch.inference_mode():
+        logits, _, _ = engine.prefill(segments)
+    return time.perf_counter() - start, logits
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark prompt-prefix KV caching')
+    parser.add_argument('--limit', type=int, default=20, help='Number of classified statements to use.')
+    args = parser.parse_args()
+
+    with open(CORPUS) as f:
+        records = json.load(f)[:args.limit]
+
+    model, tokenizer = statement_generator.load_generator()
+    full = GenerationEngine(model, tokenizer, prefix_cache_size=0)
+    cached = GenerationEngine(model, tokenizer, prefix_cache_size=256)
+
+    for mode in ['res', 'rec']:
+        prompts = [statement_generator.encode_prompt_segments(r['text'], r['label'], mode) for r in records]
+        # Warm both paths, and fill the prefix cache for every label seen in the corpus
+        for segments in prompts:
+            time_prefill(full, segments)
+            time_prefill(cached, segments)
+
+        full_seconds, cached_seconds, max_diff = [], [], 0.0
+        for segments in prompts:
+            elapsed, full_logits = time_prefill(full, segments)
+            full_seconds.append(elapsed)
+            elapsed, cached_logits = time_prefill(cached, segments)
+            cached_seconds.append(elapsed)
+            max_diff = max(max_diff, (full_logits - cached_logits).abs().max().item())
+
+        prompt_tokens = sum(len(token) for segments in prompts for token in segments) / len(prompts)
+        prefix_tokens = sum(len(token) for segments in prompts for token in segments[:-1]) / len(prompts)
+        full_ms = 1000 * sum(full_seconds) / len(prompts)
+        cached_ms = 1000 * sum(cached_seconds) / len(prompts)
+        print(f"{mode}: {len(prompts)} prompts, {prompt_tokens:.0f} tokens on average, {prefix_tokens:.0f} from cached prefix")
+        print(f"  full prefill    {full_ms:8.1f} ms/call")
+        print(f"  cached prefill  {cached_ms:8.1f} ms/call")
+        print(f"  saved           {full_ms - cached_ms:8.1f} ms/call ({1 - cached_ms / full_ms:.0%}), "
+              f"max |logit difference| {max_diff:.2e}")
+
+
+if __name__ == "__main__":
+    main()
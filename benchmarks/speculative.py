@@ -0,0 +1,173 @@
+"""Speed and output parity of speculative decoding against the generator alone.
+
+Every prompt (statement x mode) is generated twice, by the generator alone and
+with the draft model proposing tokens:
+
+- greedy: the two outputs must be token-for-token identical, since the target
+  model verifies every drafted token. Mismatches are listed and make the
+  benchmark exit non-zero.
+- sampled, with the generator's own temperature/top_p/repetition_penalty:
+  tokens/sec of both paths, the draft acceptance rate, and the mean per-token
+  negative log-likelihood of each output under the generator. Speculative
+  sampling leaves the output distribution unchanged, so the two NLLs should
+  agree up to sampling noise.
+
+    python -m benchmarks.speculative --generator-model Qwen/Qwen2-1.5B --draft-model Qwen/Qwen2-0.5B
+
+Without --generator-model/--draft-model the tiny stand-ins from
+benchmarks.tiny_generator are used; their weights are random, so expect a
+near-zero acceptance rate, but the parity check is still meaningful.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import torch
+
+import statement_generator
+from benchmarks import tiny_generator
+from benchmarks.suite import OUTPUT_DIR, capped_params, environment, example_statements
+from generation_engine import AssistedEngine
+from label_registry import LABELS
+
+MODES = ['res', 'rec']
+
+
+def prompts(count):
+    for index, text in enumerate(example_statements()[:count]):
+        label = LABELS[index % len(LABELS)]
+        for mode in MODES:
+            yield (index, mode), statement_generator.encode_prompt(text, label, mode)
+
+
+def generate_alone(prompt_ids, params):
+    model, tokenizer = statement_generator.generator_model, statement_generator.generator_tokenizer
+    with torch.inference_mode():
+        output = model.generate(
+            torch.tensor([prompt_ids]),
+            attention_mask=torch.ones(1, len(prompt_ids), dtype=torch.long),
+            pad_token_id=tokenizer.pad_token_id,
+            eos_token_id=tokenizer.eos_token_id,
+            **params,
+        )
+    return output[0, len(prompt_ids):].tolist()
+
+
+def mean_nll(prompt_ids, generated_ids):
+    """Mean negative log-likelihood of generated_ids given the prompt, under the generator."""
+    if not generated_ids:
+        return None
+    with torch.inference_mode():
+        logits = statement_generator.generator_model(torch.tensor([prompt_ids + generated_ids])).logits[0].float()
+    log_probs = torch.log_softmax(logits[len(prompt_ids) - 1:-1], dim=-1)
+    return -log_probs.gather(1, torch.tensor(generated_ids).unsqueeze(1)).mean().item()
+
+
+def run(cases, engine, params_for, seed=None):
+    """Generate every case with and without the draft model; returns per-path outputs and seconds."""
+    results = {"alone": {}, "assisted": {}}
+    seconds = {"alone": 0.0, "assisted": 0.0}
+    for case_id, prompt_ids in cases:
+        params = params_for(case_id[1])
+        for path, generate in (("alone", generate_alone), ("assisted", engine.generate)):
+            if seed is not None:
+                # The same seed for both paths, though speculative sampling consumes random numbers differently
+                torch.manual_seed(seed + case_id[0])
+            start = time.perf_counter()
+            results[path][case_id] = generate(prompt_ids, params)
+            seconds[path] += time.perf_counter() - start
+    return results, seconds
+
+
+def throughput(results, seconds):
+    tokens = sum(len(ids) for ids in results.values())
+    return round(tokens / seconds, 2) if seconds else 0.0
+
+
+def acceptance(stats):
+    return round(stats["accepted_draft_tokens"] / stats["draft_tokens"], 4) if stats["draft_tokens"] else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check speculative decoding against the generator alone')
+    parser.add_argument('--generator-model', type=str, default=None,
+                       help='Generator checkpoint (default: the tiny stand-in).')
+    parser.add_argument('--draft-model', type=str, default=None,
+                       help='Draft checkpoint sharing the generator\'s tokenizer (default: the tiny stand-in draft).')
+    parser.add_argument('--draft-tokens', type=int, default=5)
+    parser.add_argument('--statements', type=int, default=8,
+                       help='Example statements to generate for, in both modes.')
+    parser.add_argument('--max-new-tokens', type=int, default=64)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=str, default=None,
+                       help='Report path (default: output/benchmarks/speculative_<timestamp>.json).')
+    args = parser.parse_args()
+
+    statement_generator.load_generator(args.generator_model or tiny_generator.build())
+    statement_generator.load_draft(args.draft_model or tiny_generator.build_draft(), args.draft_tokens)
+    cases = list(prompts(args.statements))
+
+    def greedy_params(mode):
+        params = capped_params(statement_generator, mode, args.max_new_tokens)
+        for name in ("temperature", "top_p"):
+            params.pop(name)
+        return {**params, "do_sample": False}
+
+    print(f"Greedy parity on {len(cases)} prompts...", file=sys.stderr)
+    greedy_engine = AssistedEngine(statement_generator.generator_model, statement_generator.generator_tokenizer,
+                                   statement_generator.draft_model, args.draft_tokens)
+    greedy, greedy_seconds = run(cases, greedy_engine, greedy_params)
+    mismatches = [case_id for case_id, _ in cases if greedy["alone"][case_id] != greedy["assisted"][case_id]]
+
+    print(f"Sampling {len(cases)} prompts with the generator's settings...", file=sys.stderr)
+    sampled_engine = AssistedEngine(statement_generator.generator_model, statement_generator.generator_tokenizer,
+                                    statement_generator.draft_model, args.draft_tokens)
+    sampled, sampled_seconds = run(
+        cases, sampled_engine, lambda mode: capped_params(statement_generator, mode, args.max_new_tokens), args.seed)
+    nll = {}
+    for path in sampled:
+        values = [mean_nll(prompt_ids, sampled[path][case_id]) for case_id, prompt_ids in cases]
+        values = [value for value in values if value is not None]
+        nll[path] = round(sum(values) / len(values), 4) if values else None
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": environment(),
+        "args": vars(args),
+        "greedy": {
+            "prompts": len(cases),
+            "identical": len(cases) - len(mismatches),
+            "mismatches": [{"statement": index, "mode": mode} for index, mode in mismatches],
+            "tokens_per_second": {path: throughput(greedy[path], greedy_seconds[path]) for path in greedy},
+            "acceptance_rate": acceptance(greedy_engine.stats),
+        },
+        "sampled": {
+            "prompts": len(cases),
+            "tokens_per_second": {path: throughput(sampled[path], sampled_seconds[path]) for path in sampled},
+            "acceptance_rate": acceptance(sampled_engine.stats),
+            "mean_output_tokens": {path: round(sum(map(len, sampled[path].values())) / len(cases), 1) for path in sampled},
+            "mean_nll": nll,
+        },
+    }
+    for name in ("greedy", "sampled"):
+        section = report[name]
+        speed = section["tokens_per_second"]
+        speedup = speed["assisted"] / speed["alone"] if speed["alone"] else 0.0
+        print(f"{name:<8} {speed['alone']:8.1f} -> {speed['assisted']:8.1f} tokens/sec (x{speedup:.2f})  "
+              f"acceptance {section['acceptance_rate']:.1%}")
+    print(f"greedy parity: {report['greedy']['identical']}/{len(cases)} outputs identical")
+    print(f"sampled mean NLL under the generator: alone {nll['alone']}, assisted {nll['assisted']}")
+
+    output = args.output or os.path.join(OUTPUT_DIR, f"speculative_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Time from process exec to first output for classifier.py and statement_generator.py.
+
+Each case starts a fresh interpreter, so import, model load and first-call
+costs are all included. "first prediction" feeds one statement and stops the
+clock when its output line arrives; "--help" and "bad input" should return
+without importing torch or loading a model.
+
+    python -m benchmarks.startup --repeat 5
+
+The generator cases use the tiny model from benchmarks.tiny_generator unless
+--generator-model is given.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import tiny_generator
+
+STATEMENT = "We propose a comprehensive trade agreement to strengthen our economic ties."
+
+
+def time_to_first_line(command, stdin_data, env):
+    start = time.perf_counter()
+    process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                               env=env, text=True)
+    process.stdin.write(stdin_data)
+    process.stdin.close()
+    process.stdout.readline()
+    elapsed = time.perf_counter() - start
+    process.stdout.close()
+    process.wait()
+    return elapsed
+
+
+def cases(generator_model, output_dir):
+    classified = json.dumps({"text": STATEMENT, "label": "trade_proposal", "confidence": 0.9}) + "\n"
+    generator_env = {"DIPLOMATE_GENERATOR_MODEL": generator_model}
+    return [
+        ("classifier --help", ["classifier.py", "--help"], "", {}),
+        ("classifier bad input", ["classifier.py", "--no-cache"], "not json", {}),
+        ("classifier first prediction", ["classifier.py", "--jsonl", "--no-cache"], json.dumps(STATEMENT) + "\n", {}),
+        ("generator --help", ["statement_generator.py", "--help"], "", generator_env),
+        ("generator first output", ["statement_generator.py", "--mode", "res", "--no-cache",
+                                    "--output-dir", output_dir], classified, generator_env),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark CLI startup time')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--generator-model', type=str, default=None,
+                       help='Generator checkpoint to start instead of the tiny stand-in.')
+    args = parser.parse_args()
+
+    generator_model = args.generator_model or tiny_generator.build()
+    # The generator writes a results file per run; keep those out of the working tree
+    with tempfile.TemporaryDirectory() as output_dir:
+        for name, command, stdin_data, extra_env in cases(generator_model, output_dir):
+            env = {**os.environ, **extra_env}
+            timings = [time_to_first_line([sys.executable] + command, stdin_data, env) for _ in range(args.repeat)]
+            print(f"{name:<30} median {statistics.median(timings):6.2f}s  min {min(timings):6.2f}s")
+
+
+if __name__ == "__main__":
+    main()
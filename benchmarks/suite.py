@@ -0,0 +1,296 @@
+"""Throughput, latency and memory of the classifier, the generator and the whole pipeline.
+
+Each stage runs on fixed corpora: every statement in examples/*.json, the
+request bodies in requests.jsonl, and seeded synthetic scale-ups to 10k or
+100k statements built from the example sentences. Results are written as
+JSON, and --compare reports the change against an earlier run:
+
+    python -m benchmarks.suite --corpora examples requests synthetic-10k
+    python -m benchmarks.suite --compare output/benchmarks/suite_20250101_120000.json
+
+The generator and pipeline stages use the tiny local model from
+benchmarks.tiny_generator unless --generator-model is given, so the suite runs
+offline. They process the first --generation-statements statements of each
+corpus, with at most --max-new-tokens tokens per output.
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import psutil
+import torch
+
+import classifier
+import statement_generator
+from benchmarks import tiny_generator
+from label_registry import LABELS
+from pipeline import Pipeline, percentile
+
+OUTPUT_DIR = "output/benchmarks"
+STAGES = ["classifier", "generator", "pipeline"]
+SYNTHETIC_SIZES = {"synthetic-10k": 10000, "synthetic-100k": 100000}
+CORPORA = ["examples", "requests"] + list(SYNTHETIC_SIZES)
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+")
+
+
+def example_statements():
+    texts = []
+    for path in sorted(glob.glob("examples/*.json")):
+        with open(path) as f:
+            texts.extend(json.load(f))
+    return texts
+
+
+def request_statements(path="requests.jsonl"):
+    with open(path) as f:
+        return [json.loads(line)["body"] for line in f if line.strip()]
+
+
+def synthetic_statements(size, seed=0):
+    # Statements of 1-6 sentences drawn from the examples, so the length mix resembles real traffic
+    sentences = [sentence for text in example_statements() for sentence in SENTENCE_BOUNDARY.split(text.strip())]
+    rng = random.Random(seed)
+    return [" ".join(rng.choices(sentences, k=rng.randint(1, 6))) for _ in range(size)]
+
+
+def load_corpus(name):
+    if name == "examples":
+        return example_statements()
+    if name == "requests":
+        return request_statements()
+    return synthetic_statements(SYNTHETIC_SIZES[name])
+
+
+class PeakMemory:
+    """Samples this process's RSS in a background thread while the block runs."""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.process = psutil.Process()
+        self.peak = 0
+        self.stopped = threading.Event()
+
+    def sample(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, self.process.memory_info().rss)
+
+    def __enter__(self):
+        self.peak = self.process.memory_info().rss
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+        self.peak = max(self.peak, self.process.memory_info().rss)
+
+
+def summarize(stage, corpus, statements, seconds, latencies, tokens, peak_rss):
+    return {
+        "stage": stage,
+        "corpus": corpus,
+        "statements": statements,
+        "seconds": round(seconds, 4),
+        "statements_per_second": round(statements / seconds, 2) if seconds else 0.0,
+        "tokens_per_second": round(tokens / seconds, 2) if seconds else 0.0,
+        "latency_ms": {f"p{pct}": round(percentile(latencies, pct) * 1000, 3) for pct in (50, 95, 99)},
+        "peak_rss_bytes": peak_rss,
+    }
+
+
+def bench_classifier(corpus, texts, batch_size):
+    """Latency is per predict_batch call; tokens are padded input tokens through the model."""
+    classifier.predict_batch(texts[:batch_size], batch_size)
+    classifier.metrics.drain()
+    latencies = []
+    with PeakMemory() as memory:
+        start = time.perf_counter()
+        for batch in classifier.iter_batches(texts, batch_size):
+            batch_start = time.perf_counter()
+            classifier.predict_batch(batch, batch_size)
+            latencies.append(time.perf_counter() - batch_start)
+        elapsed = time.perf_counter() - start
+    tokens = classifier.metrics.drain().get("forward_batch_tokens", 0)
+    return summarize("classifier", corpus, len(texts), elapsed, latencies, tokens, memory.peak)
+
+
+def capped_params(generator, mode, max_new_tokens):
+    params = dict(generator.get_generation_params(mode))
+    params["max_new_tokens"] = min(params["max_new_tokens"], max_new_tokens)
+    return params
+
+
+class CappedGenerator:
+    """statement_generator with generation lengths capped, for the pipeline stage."""
+
+    def __init__(self, generator, max_new_tokens):
+        self.generator = generator
+        self.max_new_tokens = max_new_tokens
+
+    def get_generation_params(self, mode):
+        return capped_params(self.generator, mode, self.max_new_tokens)
+
+    def __getattr__(self, name):
+        return getattr(self.generator, name)
+
+
+def bench_generator(corpus, texts, args):
+    """Latency is per output, from submission to the engine until its last token."""
+    modes = ['res', 'rec']
+    submitted = {}
+
+    def requests():
+        for index, text in enumerate(texts):
+            # Generation cost does not depend on the label, so labels are assigned round-robin
+            label = LABELS[index % len(LABELS)]
+            for mode in modes:
+                segments = statement_generator.encode_prompt_segments(text, label, mode)
+                submitted[(index, mode)] = time.perf_counter()
+                params = capped_params(statement_generator, mode, args.max_new_tokens)
+                prompt_length = sum(len(segment) for segment in segments)
+                yield (index, mode), segments, statement_generator.with_stopping_criteria(params, mode, prompt_length)
+
+    engine = statement_generator.create_engine(max_batch_size=args.generation_batch_size, prefix_cache_size=args.prefix_cache_size)
+    latencies = []
+    torch.manual_seed(0)
+    with PeakMemory() as memory:
+        start = time.perf_counter()
+        for request_id, _ in engine.run(requests()):
+            latencies.append(time.perf_counter() - submitted[request_id])
+        elapsed = time.perf_counter() - start
+    return summarize("generator", corpus, len(texts), elapsed, latencies,
+                     engine.stats["generated_tokens"], memory.peak)
+
+
+def bench_pipeline(corpus, texts, args):
+    """Latency is per statement, from being read to its final record being written."""
+    with tempfile.TemporaryDirectory() as tmp:
+        input_path = os.path.join(tmp, "input.json")
+        with open(input_path, "w") as f:
+            json.dump(texts, f)
+        pipeline_args = argparse.Namespace(
+            input=input_path, mode='both', classify_workers=1, generate_workers=1,
+            batch_size=args.batch_size, generation_batch_size=args.generation_batch_size,
+            prefix_cache_size=args.prefix_cache_size, queue_size=64, min_confidence=0.0, skip_label=[],
+        )
+        log_paths = {"classifier": os.path.join(tmp, "classifier.json"), "final": os.path.join(tmp, "final.json")}
+        pipeline = Pipeline(pipeline_args, classifier, CappedGenerator(statement_generator, args.max_new_tokens), log_paths)
+        pipeline.final_log.echo = False
+        statement_generator.metrics.drain()
+        torch.manual_seed(0)
+        with PeakMemory() as memory:
+            elapsed = asyncio.run(pipeline.run())
+    completed = [t for t in pipeline.timings.values() if "emitted" in t]
+    latencies = [t["emitted"] - t["queued"] for t in completed]
+    # The pipeline adds each engine's token counts to the generator's metrics when it finishes
+    tokens = statement_generator.metrics.drain().get("generated_tokens", 0)
+    return summarize("pipeline", corpus, len(completed), elapsed, latencies, tokens, memory.peak)
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "cpu_count": os.cpu_count(),
+        "torch_threads": torch.get_num_threads(),
+        "platform": platform.platform(),
+    }
+
+
+def compare(report, previous_path, tolerance):
+    """Print each result's change against a previous report and return the number of regressions."""
+    with open(previous_path) as f:
+        previous = {(r["stage"], r["corpus"]): r for r in json.load(f)["results"]}
+    regressions = 0
+    print(f"Compared with {previous_path}:")
+    for result in report["results"]:
+        before = previous.get((result["stage"], result["corpus"]))
+        if before is None or not before["statements_per_second"]:
+            continue
+        throughput = result["statements_per_second"] / before["statements_per_second"]
+        p99 = result["latency_ms"]["p99"] / before["latency_ms"]["p99"] if before["latency_ms"]["p99"] else 1.0
+        memory = result["peak_rss_bytes"] / before["peak_rss_bytes"] if before["peak_rss_bytes"] else 1.0
+        regressed = throughput < 1 - tolerance or p99 > 1 + tolerance or memory > 1 + tolerance
+        regressions += regressed
+        print(f"  {result['stage']:<10} {result['corpus']:<15} throughput x{throughput:.2f}  "
+              f"p99 latency x{p99:.2f}  peak memory x{memory:.2f}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the classifier, generator and pipeline on fixed corpora')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--corpora', nargs='+', choices=CORPORA, default=["examples", "synthetic-10k"],
+                       help='"requests" reads requests.jsonl, which is not part of the repository.')
+    parser.add_argument('--batch-size', type=int, default=32,
+                       help='Classifier batch size.')
+    parser.add_argument('--generation-statements', type=int, default=16,
+                       help='Statements per corpus run through the generator and pipeline stages.')
+    parser.add_argument('--generation-batch-size', type=int, default=8)
+    parser.add_argument('--prefix-cache-size', type=int, default=32)
+    parser.add_argument('--max-new-tokens', type=int, default=64,
+                       help='Cap on tokens generated per output, so runs take the same time whatever the model samples.')
+    parser.add_argument('--generator-model', type=str, default=None,
+                       help='Generator checkpoint to benchmark instead of the tiny stand-in.')
+    parser.add_argument('--output', type=str, default=None,
+                       help='Report path (default: output/benchmarks/suite_<timestamp>.json).')
+    parser.add_argument('--compare', type=str, default=None, metavar='REPORT',
+                       help='Earlier report to compare against; exits non-zero if anything regressed.')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                       help='Relative change in throughput, p99 latency or peak memory counted as a regression.')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if "generator" in args.stages or "pipeline" in args.stages:
+        statement_generator.load_generator(args.generator_model or tiny_generator.build())
+
+    report = {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "environment": environment(), "args": vars(args),
+              "results": []}
+    for corpus in args.corpora:
+        if corpus == "requests" and not os.path.exists("requests.jsonl"):
+            print("Skipping the requests corpus: requests.jsonl not found", file=sys.stderr)
+            continue
+        texts = load_corpus(corpus)
+        for stage in args.stages:
+            print(f"Running {stage} on {corpus}...", file=sys.stderr)
+            if stage == "classifier":
+                result = bench_classifier(corpus, texts, args.batch_size)
+            elif stage == "generator":
+                result = bench_generator(corpus, texts[:args.generation_statements], args)
+            else:
+                result = bench_pipeline(corpus, texts[:args.generation_statements], args)
+            report["results"].append(result)
+            print(f"  {stage:<10} {corpus:<15} {result['statements']:7d} statements  "
+                  f"{result['statements_per_second']:9.1f} statements/sec  {result['tokens_per_second']:10.1f} tokens/sec  "
+                  f"p50/p95/p99 {result['latency_ms']['p50']:.1f}/{result['latency_ms']['p95']:.1f}/"
+                  f"{result['latency_ms']['p99']:.1f} ms  peak RSS {result['peak_rss_bytes'] / 2**20:.0f} MiB")
+
+    output = args.output or os.path.join(OUTPUT_DIR, f"suite_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+    if args.compare and compare(report, args.compare, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Build a tiny, randomly initialised Qwen2-architecture model for offline generator benchmarks.
+
+The tokenizer is a byte-level BPE trained on examples/*.json and the prompt
+templates in statement_generator.py, so prompts have realistic token counts.
+The model's output is noise, but it exercises the same prefill, KV-cache and
+decode code paths as Qwen2-1.5B. build_draft() makes a smaller model with the
+same tokenizer, as a stand-in draft model for speculative decoding.
+
+    python -m benchmarks.tiny_generator --output output/benchmarks/tiny_generator
+    python -m benchmarks.tiny_generator --draft --output output/benchmarks/tiny_draft --hidden-size 64 --layers 1
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+
+import torch
+from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+from transformers import PreTrainedTokenizerFast, Qwen2Config, Qwen2ForCausalLM
+
+DEFAULT_PATH = "output/benchmarks/tiny_generator"
+DEFAULT_DRAFT_PATH = "output/benchmarks/tiny_draft"
+SPECIAL_TOKENS = ["<|endoftext|>", "<|im_start|>", "<|im_end|>"]
+# The ChatML layout Qwen2's own template produces
+CHAT_TEMPLATE = (
+    "{% for message in messages %}"
+    "{{ '<|im_start|>' + message['role'] + '\n' + message['content'] + '<|im_end|>' + '\n' }}"
+    "{% endfor %}"
+    "{% if add_generation_prompt %}{{ '<|im_start|>assistant\n' }}{% endif %}"
+)
+
+
+def training_texts():
+    texts = []
+    for path in sorted(glob.glob("examples/*.json")):
+        with open(path) as f:
+            texts.extend(json.load(f))
+    with open("statement_generator.py") as f:
+        texts.append(f.read())
+    return texts
+
+
+def texts_fingerprint(texts):
+    return hashlib.sha256(json.dumps(texts).encode("utf-8")).hexdigest()
+
+
+def build(path=DEFAULT_PATH, vocab_size=4000, hidden_size=128, num_layers=2, seed=0):
+    """Create the stand-in model at path unless it exists for the current training texts, and return path."""
+    texts = training_texts()
+    fingerprint_path = os.path.join(path, "training_texts.sha256")
+    if os.path.exists(os.path.join(path, "config.json")) and os.path.exists(fingerprint_path):
+        with open(fingerprint_path) as f:
+            if f.read() == texts_fingerprint(texts):
+                return path
+    torch.manual_seed(seed)
+    bpe = Tokenizer(models.BPE())
+    bpe.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    bpe.decoder = decoders.ByteLevel()
+    trainer = trainers.BpeTrainer(vocab_size=vocab_size, special_tokens=SPECIAL_TOKENS,
+                                  initial_alphabet=pre_tokenizers.ByteLevel.alphabet())
+    bpe.train_from_iterator(texts, trainer)
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=bpe, eos_token="<|endoftext|>", pad_token="<|endoftext|>")
+    tokenizer.chat_template = CHAT_TEMPLATE
+    save_model(path, tokenizer, hidden_size, num_layers)
+    # The prompt templates in statement_generator.py are part of the training texts
+    with open(fingerprint_path, "w") as f:
+        f.write(texts_fingerprint(texts))
+    return path
+
+
+def same_tokenizer(path, other):
+    contents = []
+    for directory in (path, other):
+        with open(os.path.join(directory, "tokenizer.json"), "rb") as f:
+            contents.append(f.read())
+    return contents[0] == contents[1]
+
+
+def build_draft(path=DEFAULT_DRAFT_PATH, target=DEFAULT_PATH, hidden_size=64, num_layers=1, seed=1):
+    """Create a smaller model sharing the tokenizer of the model at target, and return path.
+
+    An existing draft is reused only while its tokenizer still matches the target's.
+    """
+    target = build(target)
+    if os.path.exists(os.path.join(path, "config.json")) and same_tokenizer(path, target):
+        return path
+    torch.manual_seed(seed)
+    tokenizer = PreTrainedTokenizerFast.from_pretrained(target)
+    save_model(path, tokenizer, hidden_size, num_layers)
+    return path
+
+
+def save_model(path, tokenizer, hidden_size, num_layers):
+    config = Qwen2Config(
+        vocab_size=len(tokenizer),
+        hidden_size=hidden_size,
+        intermediate_size=2 * hidden_size,
+        num_hidden_layers=num_layers,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        max_position_embeddings=4096,
+        eos_token_id=tokenizer.eos_token_id,
+        pad_token_id=tokenizer.pad_token_id,
+        tie_word_embeddings=False,
+    )
+    os.makedirs(path, exist_ok=True)
+    tokenizer.save_pretrained(path)
+    Qwen2ForCausalLM(config).save_pretrained(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the tiny offline stand-in for the Qwen2 generator')
+    parser.add_argument('--output', type=str, default=None)
+    parser.add_argument('--hidden-size', type=int, default=None)
+    parser.add_argument('--layers', type=int, default=None)
+    parser.add_argument('--draft', action='store_true',
+                       help='Build a draft model sharing the tokenizer of the default stand-in generator.')
+    args = parser.parse_args()
+    if args.draft:
+        print(build_draft(args.output or DEFAULT_DRAFT_PATH, hidden_size=args.hidden_size or 64, num_layers=args.layers or 1))
+    else:
+        print(build(args.output or DEFAULT_PATH, hidden_size=args.hidden_size or 128, num_layers=args.layers or 2))
+
+
+if __name__ == "__main__":
+    main()
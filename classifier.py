@@ -1,8 +1,18 @@
+import re
 import sys
 import json
-import torch
 import os
-from transformers import DistilBertTokenizer, DistilBertForSequenceClassification
+import argparse
+import itertools
+import threading
+import collections
+import multiprocessing
+from result_cache import DEFAULT_CACHE_PATH, ResultCache, model_identity
+from label_registry import LABEL_ARRAY, LABELS, check_model_labels
+from embedding_index import DEFAULT_INDEX_DIR, DEFAULT_SIMILARITY_THRESHOLD, EmbeddingIndex, text_vector
+from metrics import Metrics, default_trace_path, profiled
+
+metrics = Metrics("classifier")
 
 # Load the saved model and tokenizer
 # MODEL_PATH = "/app/model/game_text_classifier_model"
@@ -10,125 +20,581 @@ from transformers import DistilBertTokenizer, DistilBertForSequenceClassificatio
 
 MODEL_PATH = "output/diplomatic_text_classifier_model"
 TOKENIZER_PATH = "output/diplomatic_text_classifier_model"
+ONNX_MODEL_PATH = os.path.join(MODEL_PATH, "onnx", "model.onnx")
+ONNX_INT8_MODEL_PATH = os.path.join(MODEL_PATH, "onnx", "model.int8.onnx")
+BACKENDS = ["torch", "onnx", "torch-int8"]
+# Written next to the model by trainer.py: {"temperature": T} fitted on the eval split
+CALIBRATION_PATH = os.path.join(MODEL_PATH, "calibration.json")
 
+# Set by load_model(), which runs on first use so --help and bad input never wait for torch
+model = None
+tokenizer = None
+classifier_model_id = None
+model_lock = threading.Lock()
 
-# Check if the model and tokenizer files exist
-if not os.path.exists(MODEL_PATH):
-    raise FileNotFoundError(f"Model directory not found at {MODEL_PATH}")
-if not os.path.exists(os.path.join(MODEL_PATH, "config.json")):
-    raise FileNotFoundError(f"Model config file not found in {MODEL_PATH}")
-if not os.path.exists(os.path.join(TOKENIZER_PATH, "tokenizer_config.json")):
-    raise FileNotFoundError(f"Tokenizer config file not found in {TOKENIZER_PATH}")
-
-# Load model and tokenizer
-try:
-    model = DistilBertForSequenceClassification.from_pretrained(MODEL_PATH, local_files_only=True, ignore_mismatched_sizes=True)
-    tokenizer = DistilBertTokenizer.from_pretrained(TOKENIZER_PATH, local_files_only=True)
-except Exception as e:
-    print(f"Error loading model or tokenizer: {e}")
-    sys.exit(1)
-
-# Define label mapping
-
-id_to_label = {
-    0: "cooperation",
-    1: "negotiation",
-    2: "alliance_proposal",
-    3: "threat",
-    4: "intimidation",
-    5: "compromise",
-    6: "peace_offer",
-    7: "declaration_of_war",
-    8: "ceasefire_request",
-    9: "trade_proposal",
-    10: "intelligence_sharing",
-    11: "diplomatic_pressure",
-    12: "sanctions_threat",
-    13: "mediation_offer",
-    14: "neutrality_declaration",
-    15: "territorial_claim",
-    16: "diplomatic_protest",
-    17: "apology",
-    18: "praise_or_commendation",
-    19: "criticism",
-    20: "request_for_aid",
-    21: "offer_of_assistance",
-    22: "ultimatum",
-    23: "non_aggression_pact",
-    24: "treaty_proposal",
-    25: "diplomatic_recognition",
-    26: "severance_of_relations",
-    27: "espionage_accusation",
-    28: "denial_of_accusations",
-    29: "call_for_unity",
-    30: "appeal_to_international_law",
-    31: "economic_cooperation",
-    32: "cultural_exchange",
-    33: "military_cooperation",
-    34: "humanitarian_aid_offer",
-    35: "request_for_mediation",
-    36: "diplomatic_immunity_invocation",
-    37: "extradition_request",
-    38: "asylum_offer",
-    39: "propaganda",
-    40: "disinformation",
-    41: "confidence_building_measure",
-    42: "arms_control_proposal",
-    43: "environmental_cooperation",
-    44: "technology_transfer",
-    45: "diplomatic_demarche",
-    46: "formal_complaint",
-    47: "request_for_clarification",
-    48: "expression_of_concern",
-    49: "congratulatory_message",
-    50: "condolences",
-    51: "neutral_statement",
-    52: "procedural_communication",
-    53: "information_request",
-    54: "summit_proposal",
-    55: "arbitration_request",
-    56: "border_dispute_resolution",
-    57: "diplomatic_crisis_management",
-    58: "economic_sanctions_announcement",
-    59: "humanitarian_corridor_request",
-    60: "peacekeeping_mission_proposal",
-    61: "condemnation",
-}
-def predict_single(text):
-    inputs = tokenizer(text, return_tensors="pt", truncation=True, padding=True)
-    with torch.no_grad():
-        outputs = model(**inputs)
-        predicted_class_id = outputs.logits.argmax().item()
-    return id_to_label[predicted_class_id]
+# Set by enable_cache(); None means every prediction runs the model
+result_cache = None
+
+# Changed by set_backend(); onnx_session is only populated for the "onnx" backend
+backend = "torch"
+onnx_session = None
+onnx_model_path = None
+
+# Changed by configure_scores(); a temperature of 1.0 leaves the softmax uncalibrated
+top_k = 1
+temperature = 1.0
+
+# Set by enable_long_documents(); None classifies each statement as a single, possibly truncated, sequence
+window_tokens = None
+
+# Set by enable_embeddings(); embeddings are computed when they are emitted, and an index is searched before the model
+emit_embeddings = False
+embedding_index = None
+
+DEFAULT_BATCH_SIZE = 32
+# The classifier is fine-tuned on sequences of at most 128 tokens (trainer.MAX_LENGTH)
+DEFAULT_WINDOW_TOKENS = 128
+DEFAULT_CLASSIFIER_INDEX_PATH = os.path.join(DEFAULT_INDEX_DIR, "classifier")
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+")
+
+def load_model(model_path=MODEL_PATH, tokenizer_path=TOKENIZER_PATH):
+    """Check the model directory, then load the classifier and its tokenizer into this module.
+
+    Weights are loaded with low_cpu_mem_usage, which reads safetensors checkpoints
+    through a memory map instead of first building a randomly initialised model.
+    """
+    global model, tokenizer, classifier_model_id
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(f"Model directory not found at {model_path}")
+    if not os.path.exists(os.path.join(model_path, "config.json")):
+        raise FileNotFoundError(f"Model config file not found in {model_path}")
+    if not os.path.exists(os.path.join(tokenizer_path, "tokenizer_config.json")):
+        raise FileNotFoundError(f"Tokenizer config file not found in {tokenizer_path}")
+    with metrics.timer("model_load"):
+        from transformers import DistilBertTokenizer, DistilBertForSequenceClassification
+        loaded = DistilBertForSequenceClassification.from_pretrained(model_path, local_files_only=True,
+                                                                     low_cpu_mem_usage=True)
+        tokenizer = DistilBertTokenizer.from_pretrained(tokenizer_path, local_files_only=True)
+    check_model_labels(loaded.config, model_path)
+    classifier_model_id = model_identity(loaded)
+    model = loaded
+    return model, tokenizer
+
+def ensure_model():
+    if model is None:
+        with model_lock:
+            if model is None:
+                load_model()
+
+def enable_cache(path=DEFAULT_CACHE_PATH, max_entries=100000):
+    global result_cache
+    result_cache = ResultCache(path, max_entries=max_entries)
+    return result_cache
+
+def cache_metrics():
+    if result_cache is None:
+        return {}
+    return {"cache_hits": result_cache.hits, "cache_misses": result_cache.misses}
+
+metrics.register(cache_metrics)
+
+def set_backend(name, onnx_path=ONNX_INT8_MODEL_PATH, num_threads=None):
+    """Switch inference to eager fp32 torch, dynamically quantized int8 torch, or ONNX Runtime."""
+    global backend, model, onnx_session, onnx_model_path
+    if name == "torch-int8":
+        import torch
+        ensure_model()
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    elif name == "onnx":
+        try:
+            import onnxruntime
+        except ImportError:
+            raise ImportError("The onnx backend requires onnxruntime: pip install onnxruntime")
+        if not os.path.exists(onnx_path):
+            raise FileNotFoundError(f"ONNX model not found at {onnx_path}; run export_onnx.py first")
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        onnx_model_path = onnx_path
+        onnx_session = onnxruntime.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+    elif name != "torch":
+        raise ValueError(f"Unknown backend {name!r}; expected one of {BACKENDS}")
+    backend = name
+
+def load_temperature(path=CALIBRATION_PATH):
+    if not os.path.exists(path):
+        return 1.0
+    with open(path) as f:
+        return float(json.load(f)["temperature"])
 
-def predict_batch(texts):
+def configure_scores(k=1, calibrated=True):
+    """Set how many labels each prediction carries and whether to apply the fitted temperature."""
+    global top_k, temperature
+    if not 1 <= k <= len(LABELS):
+        raise ValueError(f"top-k must be between 1 and {len(LABELS)}, got {k}")
+    top_k = k
+    temperature = load_temperature() if calibrated else 1.0
+
+def enable_long_documents(max_tokens=DEFAULT_WINDOW_TOKENS):
+    global window_tokens
+    window_tokens = max_tokens
+
+def enable_embeddings(emit=True, index_path=None, threshold=DEFAULT_SIMILARITY_THRESHOLD):
+    """Emit pooled embeddings and/or reuse predictions of near-duplicates stored in an embedding index.
+
+    The index holds text_vector()s, so a near-duplicate is found before the
+    model runs and its forward pass is skipped. With emit=True every statement
+    needs its own embedding, so all of them still go through the model.
+    """
+    global emit_embeddings, embedding_index
+    if emit and backend == "onnx":
+        raise ValueError("Embeddings need hidden states, which the ONNX export does not output; use a torch backend")
+    ensure_model()
+    emit_embeddings = emit
+    if index_path is not None:
+        # Stored predictions depend on the checkpoint and on how scores are computed
+        namespace = ResultCache.make_key(classifier_model_id, "", "near_duplicates", backend=backend, top_k=top_k,
+                                         temperature=temperature, window_tokens=window_tokens)
+        embedding_index = EmbeddingIndex(index_path, threshold, namespace=namespace)
+    return embedding_index
+
+def embeddings_needed():
+    return emit_embeddings
+
+def probabilities_from_logits(logits):
+    import torch
+    return torch.softmax(logits.float() / temperature, dim=-1)
+
+def scores_from_probabilities(probabilities, k=None):
+    """Turn a (batch, num_labels) probability tensor into per-row label, confidence and top-k alternatives."""
+    # One topk over the whole batch; only the k winners are turned into Python objects
+    k = k or top_k
+    values, indices = probabilities.topk(k, dim=-1)
+    names = LABEL_ARRAY[indices.numpy()].tolist()
     results = []
-    for text in texts:
-        label = predict_single(text)
-        results.append({"text": text, "label": label})
+    for row_names, row_values in zip(names, values.tolist()):
+        result = {"label": row_names[0], "confidence": round(row_values[0], 4)}
+        if k > 1:
+            result["top_k"] = [{"label": name, "probability": round(value, 4)}
+                               for name, value in zip(row_names, row_values)]
+        results.append(result)
+    return results
+
+def scores_from_logits(logits):
+    return scores_from_probabilities(probabilities_from_logits(logits))
+
+def compute_outputs(inputs):
+    """Return the logits and, if embeddings_needed(), the mean-pooled last hidden state (else None)."""
+    import torch
+    rows, length = inputs["input_ids"].shape
+    metrics.add("forward_batches")
+    metrics.add("forward_batch_rows", rows)
+    metrics.add("forward_batch_tokens", rows * length)
+    metrics.maximum("max_forward_batch_rows", rows)
+    if backend == "onnx":
+        feeds = {"input_ids": inputs["input_ids"].numpy(), "attention_mask": inputs["attention_mask"].numpy()}
+        with metrics.timer("forward"):
+            return torch.from_numpy(onnx_session.run(["logits"], feeds)[0]), None
+    with torch.inference_mode(), metrics.timer("forward"):
+        outputs = model(input_ids=inputs["input_ids"], attention_mask=inputs["attention_mask"],
+                        output_hidden_states=embeddings_needed())
+    if not embeddings_needed():
+        return outputs.logits, None
+    mask = inputs["attention_mask"].unsqueeze(-1).float()
+    embeddings = (outputs.hidden_states[-1] * mask).sum(dim=1) / mask.sum(dim=1)
+    return outputs.logits, embeddings
+
+def attach_embeddings(results, embeddings):
+    if embeddings is not None:
+        for result, embedding in zip(results, embeddings.tolist()):
+            result["embedding"] = [round(value, 5) for value in embedding]
+    return results
+
+def cache_key(text):
+    return ResultCache.make_key(classifier_model_id, text, "classify", backend=backend,
+                                top_k=top_k, temperature=temperature, window_tokens=window_tokens,
+                                embeddings=embeddings_needed())
+
+def predict_single(text):
+    ensure_model()
+    [result] = lookup_cached_results([text])
+    if result is not None:
+        return finish_predictions([text], [result])[0]
+    if window_tokens is not None:
+        result = classify_documents([text])[0]
+    else:
+        with metrics.timer("tokenize"):
+            inputs = tokenizer(text, return_tensors="pt", truncation=True, padding=True)
+        logits, embeddings = compute_outputs(inputs)
+        result = attach_embeddings(scores_from_logits(logits), embeddings)[0]
+    store_results([text], [result])
+    return finish_predictions([text], [result])[0]
+
+def iter_length_buckets(encodings, batch_size):
+    # Sort by token length so each bucket is only padded to its own longest entry
+    order = sorted(range(len(encodings["input_ids"])), key=lambda i: len(encodings["input_ids"][i]))
+    for start in range(0, len(order), batch_size):
+        indices = order[start:start + batch_size]
+        with metrics.timer("pad"):
+            batch = tokenizer.pad(
+                {key: [encodings[key][i] for i in indices] for key in encodings.keys()},
+                padding=True,
+                return_tensors="pt",
+            )
+        yield indices, batch
+
+def pack_runs(pieces, piece_ids, budget):
+    """Group consecutive pieces into runs of at most budget tokens, yielding (text, ids)."""
+    run, ids = [], []
+    for piece, tokens in zip(pieces, piece_ids):
+        if run and len(ids) + len(tokens) > budget:
+            yield " ".join(run), ids
+            run, ids = [], []
+        run.append(piece)
+        ids.extend(tokens)
+    if run:
+        yield " ".join(run), ids
+
+def sentence_windows(text):
+    """Split a statement into runs of whole sentences that each fit in window_tokens tokens.
+
+    Yields (window_text, input_ids) with special tokens added. A sentence longer
+    than the window is split between words across several windows.
+    """
+    sentences = [sentence for sentence in SENTENCE_BOUNDARY.split(text.strip()) if sentence] or [text]
+    # WordPiece splits on whitespace first, so sentence encodings concatenate to the window's encoding
+    sentence_ids = tokenizer(sentences, add_special_tokens=False)["input_ids"]
+    budget = window_tokens - tokenizer.num_special_tokens_to_add()
+    pieces, piece_ids = [], []
+    for sentence, tokens in zip(sentences, sentence_ids):
+        if len(tokens) <= budget:
+            pieces.append(sentence)
+            piece_ids.append(tokens)
+            continue
+        words = sentence.split()
+        for run, ids in pack_runs(words, tokenizer(words, add_special_tokens=False)["input_ids"], budget):
+            pieces.append(run)
+            piece_ids.append(ids)
+    for window, ids in pack_runs(pieces, piece_ids, budget):
+        # Only a single word longer than the whole window is still truncated
+        yield window, tokenizer.build_inputs_with_special_tokens(ids[:budget])
+
+def classify_documents(texts, batch_size=DEFAULT_BATCH_SIZE):
+    """Classify every sentence window of every text in one pass and aggregate per text.
+
+    The windows of all texts share the same length buckets, so a long statement
+    adds short, tightly padded rows rather than one row padded to 512 tokens. A
+    text's probabilities are the token-weighted mean of its windows'.
+    """
+    import torch
+    segments, owners, encodings = [], [], {"input_ids": [], "attention_mask": []}
+    with metrics.timer("tokenize"):
+        for owner, text in enumerate(texts):
+            for segment, input_ids in sentence_windows(text):
+                segments.append(segment)
+                owners.append(owner)
+                encodings["input_ids"].append(input_ids)
+                encodings["attention_mask"].append([1] * len(input_ids))
+    metrics.add("windows", len(segments))
+
+    probabilities = torch.empty(len(segments), len(LABELS))
+    embeddings = None
+    for indices, batch in iter_length_buckets(encodings, batch_size):
+        logits, batch_embeddings = compute_outputs(batch)
+        probabilities[indices] = probabilities_from_logits(logits)
+        if batch_embeddings is not None:
+            if embeddings is None:
+                embeddings = torch.empty(len(segments), batch_embeddings.shape[1])
+            embeddings[indices] = batch_embeddings
+
+    owners = torch.tensor(owners)
+    weights = torch.tensor([len(ids) for ids in encodings["input_ids"]], dtype=torch.float)
+    totals = torch.zeros(len(texts)).index_add_(0, owners, weights)
+    document_probabilities = torch.zeros(len(texts), len(LABELS)).index_add_(0, owners, probabilities * weights[:, None])
+    results = scores_from_probabilities(document_probabilities / totals[:, None])
+    if embeddings is not None:
+        document_embeddings = torch.zeros(len(texts), embeddings.shape[1]).index_add_(0, owners, embeddings * weights[:, None])
+        attach_embeddings(results, document_embeddings / totals[:, None])
+    for result in results:
+        result["segments"] = []
+    for owner, segment, score in zip(owners.tolist(), segments, scores_from_probabilities(probabilities, k=1)):
+        results[owner]["segments"].append({"text": segment, **score})
+    return results
+
+def classify_texts(texts, batch_size=DEFAULT_BATCH_SIZE):
+    # Run the model on every text, bypassing the result cache
+    ensure_model()
+    metrics.add("classified_statements", len(texts))
+    if window_tokens is not None:
+        return classify_documents(texts, batch_size)
+    results = [None] * len(texts)
+    with metrics.timer("tokenize"):
+        encodings = tokenizer(texts, truncation=True)
+    for indices, batch in iter_length_buckets(encodings, batch_size):
+        logits, embeddings = compute_outputs(batch)
+        for index, result in zip(indices, attach_embeddings(scores_from_logits(logits), embeddings)):
+            results[index] = result
+    return results
+
+def near_duplicate_result(text):
+    entry, similarity = embedding_index.search(text_vector(text))
+    if entry is None:
+        return None
+    metrics.add("near_duplicates")
+    result = {key: value for key, value in entry.items() if key != "text"}
+    result["near_duplicate"] = {"text": entry["text"], "similarity": round(similarity, 4)}
+    return result
+
+def lookup_cached_results(texts):
+    """Results available without the model: cache hits, then near-duplicates from the embedding index."""
+    if result_cache is None:
+        results = [None] * len(texts)
+    else:
+        results = [result_cache.get(cache_key(text)) for text in texts]
+    if embedding_index is not None and not emit_embeddings:
+        results = [near_duplicate_result(text) if result is None else result for text, result in zip(texts, results)]
     return results
 
+def store_results(texts, results):
+    """Store freshly classified results in the cache and the embedding index."""
+    if result_cache is not None:
+        for text, result in zip(texts, results):
+            result_cache.put(cache_key(text), result)
+    if embedding_index is not None:
+        for text, result in zip(texts, results):
+            # Per-window labels belong to this statement's own windows, so they are not reused
+            entry = {key: value for key, value in result.items() if key not in ("embedding", "segments")}
+            embedding_index.add(text_vector(text), {"text": text, **entry})
+
+def finish_predictions(texts, results):
+    metrics.add("predictions", len(texts))
+    predictions = []
+    for text, result in zip(texts, results):
+        prediction = {"text": text, **result}
+        if not emit_embeddings:
+            prediction.pop("embedding", None)
+        predictions.append(prediction)
+    return predictions
+
+def predict_batch(texts, batch_size=DEFAULT_BATCH_SIZE):
+    if not texts:
+        return []
+    ensure_model()
+    results = lookup_cached_results(texts)
+    # Only statements that missed the cache go through the model
+    missing = [index for index, result in enumerate(results) if result is None]
+    if missing:
+        missing_texts = [texts[index] for index in missing]
+        missing_results = classify_texts(missing_texts, batch_size)
+        for index, result in zip(missing, missing_results):
+            results[index] = result
+        store_results(missing_texts, missing_results)
+    return finish_predictions(texts, results)
+
+def init_worker(num_threads, worker_counter):
+    # Runs in each forked worker: the model weights are shared copy-on-write with the parent
+    import torch
+    with worker_counter.get_lock():
+        worker_index = worker_counter.value
+        worker_counter.value += 1
+    torch.set_num_threads(num_threads)
+    # Start from zero so values inherited from the parent are not merged back into it
+    metrics.drain()
+    if hasattr(os, "sched_getaffinity"):
+        cores = sorted(os.sched_getaffinity(0))
+        pinned = cores[worker_index * num_threads:(worker_index + 1) * num_threads]
+        if pinned:
+            os.sched_setaffinity(0, pinned)
+    if backend == "onnx":
+        # ONNX Runtime sessions are not fork-safe, so each worker opens its own
+        set_backend("onnx", onnx_model_path, num_threads=num_threads)
+
+def classify_in_worker(texts, batch_size):
+    # The worker's metrics travel back with its results and are merged into the parent's
+    results = classify_texts(texts, batch_size)
+    return results, metrics.drain()
+
+def predict_parallel(batches, workers, batch_size=DEFAULT_BATCH_SIZE, threads_per_worker=None):
+    """Classify batches across forked worker processes, yielding predictions in input order.
+
+    Cache lookups and writes stay in the parent; only cache misses are sent to
+    the workers. At most two batches per worker are in flight, so a streamed
+    input is never read far ahead of the output.
+    """
+    threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+    # Loaded before forking so the workers share one copy of the weights
+    ensure_model()
+    context = multiprocessing.get_context("fork")
+    worker_counter = context.Value("i", 0)
+    in_flight = collections.deque()
+    with context.Pool(workers, initializer=init_worker, initargs=(threads_per_worker, worker_counter)) as pool:
+        def drain(limit):
+            while len(in_flight) > limit:
+                texts, results, missing, pending = in_flight.popleft()
+                if pending is not None:
+                    missing_results, worker_metrics = pending.get()
+                    metrics.merge(worker_metrics)
+                    for index, result in zip(missing, missing_results):
+                        results[index] = result
+                    store_results([texts[index] for index in missing], missing_results)
+                yield finish_predictions(texts, results)
+
+        for texts in batches:
+            results = lookup_cached_results(texts)
+            missing = [index for index, result in enumerate(results) if result is None]
+            pending = None
+            if missing:
+                pending = pool.apply_async(classify_in_worker, ([texts[index] for index in missing], batch_size))
+            in_flight.append((texts, results, missing, pending))
+            yield from drain(2 * workers)
+        yield from drain(0)
+
+def iter_json_array(stream, chunk_size=1 << 16):
+    # Decode one array element at a time; the opening '[' has already been consumed
+    decoder = json.JSONDecoder()
+    buffer = ""
+    eof = False
+    while True:
+        buffer = buffer.lstrip(" \t\r\n,")
+        if buffer.startswith("]"):
+            return
+        if buffer:
+            try:
+                value, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                yield value
+                buffer = buffer[end:]
+                continue
+        elif eof:
+            raise json.JSONDecodeError("Unterminated JSON array", buffer, 0)
+        chunk = stream.read(chunk_size)
+        eof = not chunk
+        buffer += chunk
+
+def iter_input_texts(stream):
+    """Yield statements from a JSON array or from JSON Lines without reading the whole stream.
+
+    Each JSON Lines entry may be a string or an object with a "text" field.
+    """
+    first = stream.read(1)
+    while first and first.isspace():
+        first = stream.read(1)
+    if not first:
+        return
+    if first == "[":
+        items = iter_json_array(stream)
+    else:
+        lines = itertools.chain([first + stream.readline()], stream)
+        items = (json.loads(line) for line in lines if line.strip())
+    for item in items:
+        yield item["text"] if isinstance(item, dict) else item
+
+def iter_batches(items, batch_size):
+    iterator = iter(items)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+def predict_batches(batches, batch_size=DEFAULT_BATCH_SIZE, workers=1):
+    if workers > 1:
+        return predict_parallel(batches, workers, batch_size)
+    return (predict_batch(batch, batch_size=batch_size) for batch in batches)
+
+def emit_predictions(predictions):
+    for prediction in predictions:
+        print(json.dumps(prediction, ensure_ascii=False))
+    sys.stdout.flush()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Classify diplomatic statements read as a JSON array from stdin')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                       help='Number of length-bucketed statements per forward pass.')
+    parser.add_argument('--jsonl', action='store_true',
+                       help='Stream input (JSON Lines or a JSON array) and flush output after every batch.')
+    parser.add_argument('--workers', type=int, default=1,
+                       help='Number of forked worker processes sharing the model; each gets cpu_count/N threads.')
+    parser.add_argument('--backend', type=str, choices=BACKENDS, default='torch',
+                       help='Inference backend: eager fp32 torch, int8 ONNX Runtime (see export_onnx.py) or int8 torch.')
+    parser.add_argument('--top-k', type=int, default=1,
+                       help='Also return the K most likely labels with their probabilities.')
+    parser.add_argument('--no-calibration', action='store_true',
+                       help='Report raw softmax probabilities instead of applying the temperature fitted by trainer.py.')
+    parser.add_argument('--long-documents', action='store_true',
+                       help='Split statements into sentence windows, classify every window and aggregate '
+                            'to a statement label plus per-segment labels.')
+    parser.add_argument('--window-tokens', type=int, default=DEFAULT_WINDOW_TOKENS,
+                       help='Maximum tokens per sentence window with --long-documents.')
+    parser.add_argument('--embeddings', action='store_true',
+                       help='Add the mean-pooled DistilBERT embedding of each statement to its prediction.')
+    parser.add_argument('--index', action='store_true',
+                       help='Reuse the label of a near-duplicate statement found in the embedding index.')
+    parser.add_argument('--index-path', type=str, default=DEFAULT_CLASSIFIER_INDEX_PATH,
+                       help='Directory the embedding index is loaded from and saved to.')
+    parser.add_argument('--similarity-threshold', type=float, default=DEFAULT_SIMILARITY_THRESHOLD,
+                       help='Minimum cosine similarity for a statement to count as a near-duplicate.')
+    parser.add_argument('--cache-path', type=str, default=DEFAULT_CACHE_PATH,
+                       help='SQLite file caching labels for previously classified statements.')
+    parser.add_argument('--no-cache', action='store_true',
+                       help='Always run the model instead of reusing cached labels.')
+    parser.add_argument('--metrics-json', type=str, default=None, metavar='PATH',
+                       help='Write load, tokenization and forward timings, batch sizes and peak RSS as JSON '
+                            '("-" for stderr).')
+    parser.add_argument('--metrics-prometheus', type=str, default=None, metavar='PATH',
+                       help='Write the same metrics in Prometheus text format, e.g. for a node_exporter textfile collector.')
+    parser.add_argument('--profile', nargs='?', const=default_trace_path("classifier"), default=None, metavar='TRACE',
+                       help='Run classification under torch.profiler and write a Chrome trace '
+                            '(default: output/profiles/classifier_<timestamp>.json).')
+    return parser.parse_args()
+
 if __name__ == "__main__":
+    args = parse_args()
+    set_backend(args.backend)
+    configure_scores(args.top_k, calibrated=not args.no_calibration)
+    if args.long_documents:
+        enable_long_documents(args.window_tokens)
+    if args.embeddings or args.index:
+        enable_embeddings(args.embeddings, args.index_path if args.index else None, args.similarity_threshold)
+    if not args.no_cache:
+        enable_cache(args.cache_path)
     try:
-        # Read JSON input from stdin
-        input_json = sys.stdin.read()
-        
+        # Handle broken pipe error when printing predictions
         try:
-            input_texts = json.loads(input_json)
-        except json.JSONDecodeError:
-            print("Error: Invalid JSON input")
-            sys.exit(1)
+            with profiled(args.profile):
+                if args.jsonl:
+                    # Classify in rolling batches so memory stays flat and downstream starts early
+                    try:
+                        batches = iter_batches(iter_input_texts(sys.stdin), args.batch_size)
+                        for predictions in predict_batches(batches, args.batch_size, args.workers):
+                            emit_predictions(predictions)
+                    except json.JSONDecodeError:
+                        print("Error: Invalid JSON input", file=sys.stderr)
+                        sys.exit(1)
+                else:
+                    # Read JSON input from stdin
+                    input_json = sys.stdin.read()
 
-        if not isinstance(input_texts, list):
-            print("Error: Input must be a JSON array of strings")
-            sys.exit(1)
+                    try:
+                        input_texts = json.loads(input_json)
+                    except json.JSONDecodeError:
+                        print("Error: Invalid JSON input")
+                        sys.exit(1)
 
-        predictions = predict_batch(input_texts)
-        
-        # Handle broken pipe error when printing predictions
-        try:
-            for prediction in predictions:
-                print(json.dumps(prediction, ensure_ascii=False))
+                    if not isinstance(input_texts, list):
+                        print("Error: Input must be a JSON array of strings")
+                        sys.exit(1)
+
+                    if args.workers > 1:
+                        batches = iter_batches(input_texts, args.batch_size)
+                        for predictions in predict_batches(batches, args.batch_size, args.workers):
+                            emit_predictions(predictions)
+                    else:
+                        emit_predictions(predict_batch(input_texts, batch_size=args.batch_size))
         except BrokenPipeError:
             # Python flushes standard streams on exit; redirect remaining output
             # to devnull to avoid another BrokenPipeError at shutdown
@@ -142,6 +608,13 @@ if __name__ == "__main__":
         print(f"Error: {str(e)}", file=sys.stderr)
         sys.exit(1)
     finally:
+        if result_cache is not None:
+            print(result_cache.report(), file=sys.stderr)
+            result_cache.close()
+        if embedding_index is not None:
+            embedding_index.save()
+            print(embedding_index.report(), file=sys.stderr)
+        metrics.write(args.metrics_json, args.metrics_prometheus)
         # Explicitly flush and close stdout to avoid BrokenPipeError during cleanup
         try:
             sys.stdout.flush()
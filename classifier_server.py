@@ -0,0 +1,245 @@
+import sys
+import json
+import time
+import queue
+import argparse
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import classifier
+
+
+class LatencyTracker:
+    def __init__(self, window=10000):
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=window)
+        self.requests = 0
+        self.statements = 0
+        self.batches = 0
+        self.batched_statements = 0
+
+    def record_request(self, latency, statement_count):
+        with self.lock:
+            self.latencies.append(latency)
+            self.requests += 1
+            self.statements += statement_count
+
+    def record_batch(self, batch_size):
+        with self.lock:
+            self.batches += 1
+            self.batched_statements += batch_size
+
+    def percentile(self, sorted_latencies, pct):
+        if not sorted_latencies:
+            return 0.0
+        index = min(len(sorted_latencies) - 1, int(round(pct / 100 * (len(sorted_latencies) - 1))))
+        return sorted_latencies[index]
+
+    def snapshot(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            return {
+                "requests": self.requests,
+                "statements": self.statements,
+                "batches": self.batches,
+                "mean_batch_size": self.batched_statements / self.batches if self.batches else 0.0,
+                "latency_p50_ms": self.percentile(latencies, 50) * 1000,
+                "latency_p99_ms": self.percentile(latencies, 99) * 1000,
+            }
+
+
+class PendingRequest:
+    def __init__(self, texts):
+        self.texts = texts
+        self.results = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class MicroBatcher:
+    """Merges statements from concurrent requests into shared predict_batch calls.
+
+    A batch is dispatched once it holds max_batch_size statements or the oldest
+    waiting request has been queued for max_wait_ms, whichever comes first.
+    """
+
+    def __init__(self, max_batch_size, max_wait_ms, tracker):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.tracker = tracker
+        self.pending = queue.Queue()
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    def submit(self, texts):
+        request = PendingRequest(texts)
+        self.pending.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.results
+
+    def collect(self):
+        requests = [self.pending.get()]
+        size = len(requests[0].texts)
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self.pending.get(timeout=remaining)
+            except queue.Empty:
+                break
+            requests.append(request)
+            size += len(request.texts)
+        return requests
+
+    def run_separately(self, requests):
+        # Retry a failed merged batch one request at a time, so only the request that caused the error gets it
+        for request in requests:
+            try:
+                request.results = classifier.predict_batch(request.texts, batch_size=self.max_batch_size)
+                self.tracker.record_batch(len(request.texts))
+            except Exception as e:
+                request.error = e
+            request.done.set()
+
+    def run(self):
+        while True:
+            requests = self.collect()
+            texts = [text for request in requests for text in request.texts]
+            try:
+                predictions = classifier.predict_batch(texts, batch_size=self.max_batch_size)
+            except Exception as e:
+                print(f"Error classifying batch: {e}", file=sys.stderr)
+                if len(requests) > 1:
+                    self.run_separately(requests)
+                else:
+                    requests[0].error = e
+                    requests[0].done.set()
+                continue
+            self.tracker.record_batch(len(texts))
+            offset = 0
+            for request in requests:
+                request.results = predictions[offset:offset + len(request.texts)]
+                offset += len(request.texts)
+                request.done.set()
+
+
+class ClassifierHandler(BaseHTTPRequestHandler):
+    batcher = None
+    tracker = None
+
+    def send_body(self, status, body, content_type):
+        payload = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def metrics_snapshot(self):
+        # Model-side timings from the classifier plus request latencies measured here
+        snapshot = classifier.metrics.snapshot()
+        snapshot.update(self.tracker.snapshot())
+        return snapshot
+
+    def do_GET(self):
+        if self.path == "/health":
+            self.send_body(200, json.dumps({"status": "ok"}), "application/json")
+        elif self.path == "/metrics":
+            self.send_body(200, json.dumps(self.metrics_snapshot()), "application/json")
+        elif self.path == "/metrics/prometheus":
+            body = classifier.metrics.to_prometheus(self.metrics_snapshot())
+            self.send_body(200, body, "text/plain; version=0.0.4")
+        else:
+            self.send_body(404, json.dumps({"error": "Not found"}), "application/json")
+
+    def do_POST(self):
+        if self.path != "/classify":
+            self.send_body(404, json.dumps({"error": "Not found"}), "application/json")
+            return
+
+        start = time.perf_counter()
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            self.send_body(400, json.dumps({"error": "Invalid Content-Length header"}), "application/json")
+            return
+        try:
+            input_texts = json.loads(self.rfile.read(length))
+        except json.JSONDecodeError:
+            self.send_body(400, json.dumps({"error": "Invalid JSON input"}), "application/json")
+            return
+        if not isinstance(input_texts, list) or not all(isinstance(text, str) for text in input_texts):
+            self.send_body(400, json.dumps({"error": "Input must be a JSON array of strings"}), "application/json")
+            return
+
+        try:
+            predictions = self.batcher.submit(input_texts) if input_texts else []
+        except Exception as e:
+            self.send_body(500, json.dumps({"error": str(e)}), "application/json")
+            return
+
+        body = "".join(json.dumps(prediction, ensure_ascii=False) + "\n" for prediction in predictions)
+        self.send_body(200, body, "application/x-ndjson")
+        self.tracker.record_request(time.perf_counter() - start, len(input_texts))
+
+    def log_message(self, format, *args):
+        print(f"{self.address_string()} - {format % args}", file=sys.stderr)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Serve the diplomatic text classifier over HTTP')
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--max-batch-size', type=int, default=classifier.DEFAULT_BATCH_SIZE,
+                       help='Maximum number of statements merged into one forward batch.')
+    parser.add_argument('--max-wait-ms', type=float, default=10.0,
+                       help='Longest time a request waits for others to join its batch.')
+    parser.add_argument('--top-k', type=int, default=1,
+                       help='Also return the K most likely labels with their probabilities.')
+    parser.add_argument('--no-calibration', action='store_true',
+                       help='Report raw softmax probabilities instead of applying the temperature fitted by trainer.py.')
+    parser.add_argument('--long-documents', action='store_true',
+                       help='Classify sentence windows and aggregate them per statement (see classifier.py).')
+    parser.add_argument('--window-tokens', type=int, default=classifier.DEFAULT_WINDOW_TOKENS,
+                       help='Maximum tokens per sentence window with --long-documents.')
+    parser.add_argument('--cache-path', type=str, default=classifier.DEFAULT_CACHE_PATH,
+                       help='SQLite file caching labels for previously classified statements.')
+    parser.add_argument('--no-cache', action='store_true',
+                       help='Always run the model instead of reusing cached labels.')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    # Loaded once for the whole process, before the first request rather than during it
+    try:
+        classifier.load_model()
+    except Exception as e:
+        print(f"Error loading model or tokenizer: {e}", file=sys.stderr)
+        sys.exit(1)
+    classifier.configure_scores(args.top_k, calibrated=not args.no_calibration)
+    if args.long_documents:
+        classifier.enable_long_documents(args.window_tokens)
+    if not args.no_cache:
+        classifier.enable_cache(args.cache_path)
+    tracker = LatencyTracker()
+    ClassifierHandler.tracker = tracker
+    ClassifierHandler.batcher = MicroBatcher(args.max_batch_size, args.max_wait_ms, tracker)
+
+    server = ThreadingHTTPServer((args.host, args.port), ClassifierHandler)
+    print(f"Classifier server listening on http://{args.host}:{args.port}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
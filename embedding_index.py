@@ -0,0 +1,162 @@
+import os
+import sys
+import json
+import time
+import zlib
+import threading
+import collections
+import unicodedata
+import numpy as np
+
+DEFAULT_INDEX_DIR = "output/index"
+# Lowest threshold with no false matches between distinct examples/*.json statements, plus a margin;
+# see python -m benchmarks.near_duplicates
+DEFAULT_SIMILARITY_THRESHOLD = 0.9
+TEXT_VECTOR_DIMENSION = 2048
+NGRAM_SIZES = (3, 4, 5)
+# Vectors, entries and metadata in one archive
+INDEX_FILE = "index.npz"
+
+
+def normalize(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def text_vector(text, dimension=TEXT_VECTOR_DIMENSION):
+    """Hashed character 3-5-gram counts of the case- and whitespace-normalized text.
+
+    Computed without the model, so a near-duplicate can be found before any
+    forward pass. Unrelated statements share few n-grams, whereas mean-pooled
+    transformer embeddings of unrelated statements are often over 0.95 similar.
+    """
+    text = " ".join(unicodedata.normalize("NFC", text).lower().split())
+    counts = collections.Counter(text[start:start + size] for size in NGRAM_SIZES for start in range(len(text) - size + 1))
+    vector = np.zeros(dimension, dtype=np.float32)
+    for gram, count in counts.items():
+        # crc32 rather than hash(), which differs between processes
+        vector[zlib.crc32(gram.encode("utf-8")) % dimension] += 1 + np.log(count)
+    return normalize(vector)
+
+
+class EmbeddingIndex:
+    """On-disk nearest-neighbour index of statement embeddings with a payload per entry.
+
+    Vectors are L2-normalized, so inner product is cosine similarity. Search uses
+    a FAISS flat index when faiss is installed and a NumPy matrix product
+    otherwise. A lookup is a hit when the nearest stored vector is at least
+    threshold similar. The index is written to path by save().
+
+    namespace identifies what produced the stored entries; an index saved under
+    a different namespace is discarded instead of being searched.
+    """
+
+    def __init__(self, path, threshold=DEFAULT_SIMILARITY_THRESHOLD, namespace=None, use_faiss=None):
+        self.path = path
+        self.threshold = threshold
+        self.namespace = namespace
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.search_seconds = 0.0
+        self.max_search_seconds = 0.0
+        self.entries = []
+        # Grown by doubling; only the first len(entries) rows are filled
+        self.buffer = np.zeros((0, 0), dtype=np.float32)
+        self.faiss_index = None
+        if use_faiss is None:
+            try:
+                import faiss  # noqa: F401
+                use_faiss = True
+            except ImportError:
+                use_faiss = False
+        self.use_faiss = use_faiss
+        self.load()
+
+    def load(self):
+        index_path = os.path.join(self.path, INDEX_FILE)
+        if not os.path.exists(index_path):
+            return
+        with np.load(index_path) as data:
+            meta = json.loads(str(data["meta"]))
+            if meta.get("namespace") != self.namespace:
+                print(f"Ignoring embedding index {self.path}: it was built by a different model or settings",
+                      file=sys.stderr)
+                return
+            self.add_many(data["vectors"], json.loads(str(data["entries"])))
+
+    @property
+    def vectors(self):
+        return self.buffer[:len(self.entries)]
+
+    def add_many(self, vectors, entries):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.entries and vectors.shape[1] != self.buffer.shape[1]:
+            raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match the index ({self.buffer.shape[1]})")
+        count, needed = len(self.entries), len(self.entries) + len(vectors)
+        if needed > self.buffer.shape[0]:
+            buffer = np.zeros((max(needed, 2 * self.buffer.shape[0], 1024), vectors.shape[1]), dtype=np.float32)
+            if count:
+                buffer[:count] = self.buffer[:count]
+            self.buffer = buffer
+        self.buffer[count:needed] = vectors
+        self.entries.extend(entries)
+        if self.use_faiss:
+            import faiss
+            if self.faiss_index is None:
+                self.faiss_index = faiss.IndexFlatIP(vectors.shape[1])
+            self.faiss_index.add(vectors)
+
+    def add(self, vector, entry):
+        with self.lock:
+            self.add_many(normalize(vector)[None, :], [entry])
+
+    def nearest(self, vector):
+        if not self.entries:
+            return None, 0.0
+        if self.faiss_index is not None:
+            similarities, indices = self.faiss_index.search(vector[None, :], 1)
+            return int(indices[0, 0]), float(similarities[0, 0])
+        similarities = self.vectors @ vector
+        index = int(similarities.argmax())
+        return index, float(similarities[index])
+
+    def search(self, vector):
+        """Return (entry, similarity) for the nearest stored statement, or (None, similarity) on a miss."""
+        start = time.perf_counter()
+        with self.lock:
+            index, similarity = self.nearest(normalize(vector))
+            elapsed = time.perf_counter() - start
+            self.search_seconds += elapsed
+            self.max_search_seconds = max(self.max_search_seconds, elapsed)
+            if index is None or similarity < self.threshold:
+                self.misses += 1
+                return None, similarity
+            self.hits += 1
+            return self.entries[index], similarity
+
+    def save(self):
+        with self.lock:
+            if not self.entries:
+                return
+            os.makedirs(self.path, exist_ok=True)
+            # One file, replaced in a single step, so an interrupted save leaves the previous index intact
+            target = os.path.join(self.path, INDEX_FILE)
+            with open(target + ".tmp", "wb") as f:
+                np.savez(
+                    f,
+                    vectors=self.vectors,
+                    entries=np.array(json.dumps(self.entries, ensure_ascii=False)),
+                    meta=np.array(json.dumps({"namespace": self.namespace, "dimension": self.vectors.shape[1]})),
+                )
+            os.replace(target + ".tmp", target)
+
+    def report(self):
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups else 0.0
+        mean_ms = self.search_seconds / lookups * 1000 if lookups else 0.0
+        engine = "faiss" if self.use_faiss else "numpy"
+        return (f"Embedding index {self.path} ({engine}): {self.hits} near-duplicate hits, {self.misses} misses "
+                f"({hit_rate:.0%} hit rate), {len(self.entries)} entries, "
+                f"search {mean_ms:.2f} ms mean / {self.max_search_seconds * 1000:.2f} ms max")
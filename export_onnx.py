@@ -0,0 +1,61 @@
+import os
+import argparse
+import torch
+
+import classifier
+
+
+class LogitsOnly(torch.nn.Module):
+    # ONNX export traces plain tensors, so unwrap the SequenceClassifierOutput
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        return self.model(input_ids=input_ids, attention_mask=attention_mask).logits
+
+
+def export(output_path, opset):
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    classifier.ensure_model()
+    sample = classifier.tokenizer(["We propose a comprehensive trade agreement."], return_tensors="pt")
+    torch.onnx.export(
+        LogitsOnly(classifier.model.eval()),
+        (sample["input_ids"], sample["attention_mask"]),
+        output_path,
+        input_names=["input_ids", "attention_mask"],
+        output_names=["logits"],
+        dynamic_axes={
+            "input_ids": {0: "batch", 1: "sequence"},
+            "attention_mask": {0: "batch", 1: "sequence"},
+            "logits": {0: "batch"},
+        },
+        opset_version=opset,
+    )
+
+
+def quantize(input_path, output_path):
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    quantize_dynamic(input_path, output_path, weight_type=QuantType.QInt8)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the diplomatic text classifier to ONNX with dynamic int8 quantization')
+    parser.add_argument('--output', type=str, default=classifier.ONNX_MODEL_PATH,
+                       help='Path of the fp32 ONNX model.')
+    parser.add_argument('--quantized-output', type=str, default=classifier.ONNX_INT8_MODEL_PATH,
+                       help='Path of the dynamically quantized int8 ONNX model.')
+    parser.add_argument('--opset', type=int, default=14)
+    args = parser.parse_args()
+
+    print(f"Exporting {classifier.MODEL_PATH} to {args.output}...")
+    export(args.output, args.opset)
+    print(f"Quantizing weights to int8 at {args.quantized_output}...")
+    quantize(args.output, args.quantized_output)
+    for path in [args.output, args.quantized_output]:
+        print(f" - {path}: {os.path.getsize(path) / 1024 / 1024:.1f} MiB")
+    print("Run the classifier on it with: python classifier.py --backend onnx")
+
+
+if __name__ == "__main__":
+    main()
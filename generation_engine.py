@@ -0,0 +1,360 @@
+import time
+import threading
+from collections import OrderedDict
+import torch
+import torch.nn.functional as F
+from transformers import (
+    DynamicCache,
+    LogitsProcessorList,
+    NoRepeatNGramLogitsProcessor,
+    RepetitionPenaltyLogitsProcessor,
+    TemperatureLogitsWarper,
+    TopPLogitsWarper,
+)
+
+
+# Marks the end of the request iterator in GenerationEngine.run(); None means "nothing ready yet"
+EXHAUSTED = object()
+
+
+def build_logits_processors(params):
+    # Same processor/warper order as transformers' generate()
+    processors = LogitsProcessorList()
+    if params.get("repetition_penalty", 1.0) != 1.0:
+        processors.append(RepetitionPenaltyLogitsProcessor(params["repetition_penalty"]))
+    if params.get("no_repeat_ngram_size", 0) > 0:
+        processors.append(NoRepeatNGramLogitsProcessor(params["no_repeat_ngram_size"]))
+    if params.get("do_sample", False):
+        if params.get("temperature", 1.0) != 1.0:
+            processors.append(TemperatureLogitsWarper(params["temperature"]))
+        if params.get("top_p", 1.0) < 1.0:
+            processors.append(TopPLogitsWarper(params["top_p"]))
+    return processors
+
+
+def left_pad(tensor, length, dim):
+    missing = length - tensor.shape[dim]
+    if missing <= 0:
+        return tensor
+    # F.pad takes (left, right) pairs starting from the last dimension
+    padding = [0, 0] * (tensor.dim() - 1 - dim) + [missing, 0]
+    return F.pad(tensor, padding)
+
+
+class Sequence:
+    def __init__(self, request_id, input_ids, params):
+        self.request_id = request_id
+        self.input_ids = list(input_ids)
+        self.params = params
+        self.generated = []
+        self.processors = build_logits_processors(params)
+
+
+class PrefixCache:
+    """LRU map from a prompt prefix (as a tuple of token ids) to its batch-of-one KV cache."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        cache = self.entries.get(key)
+        if cache is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return cache
+
+    def put(self, key, cache):
+        self.entries[key] = cache
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+class GenerationEngine:
+    """Batched sampling loop over a causal LM with a shared, left-padded KV cache.
+
+    Each request is prefilled on its own and then merged into the running batch
+    by left-padding its cache and attention mask to the batch length. Decoding
+    advances every active sequence by one token per forward pass. With
+    continuous batching a finished sequence leaves the batch immediately and its
+    slot is refilled from the pending requests; with static batching the next
+    group is only admitted once the whole batch has finished.
+
+    Prompts are passed as a list of token segments. The KV cache of every
+    leading segment chain (e.g. the mode preamble, then preamble plus label
+    context) is kept in a PrefixCache, so only the last segment is prefilled
+    for prompts that share those prefixes.
+    """
+
+    def __init__(self, model, tokenizer, max_batch_size=8, continuous=True, prefix_cache_size=32):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+        self.continuous = continuous
+        self.prefix_cache = PrefixCache(prefix_cache_size) if prefix_cache_size > 0 else None
+        self.eos_token_ids = {tokenizer.eos_token_id}
+        self.stats = {
+            "sequences": 0,
+            "prefix_tokens_reused": 0,
+            "prefill_tokens": 0,
+            "prefill_seconds": 0.0,
+            "generated_tokens": 0,
+            "decode_steps": 0,
+            "decode_seconds": 0.0,
+            "decode_batch_rows": 0,
+            "max_decode_batch_rows": 0,
+        }
+        self.reset_batch()
+
+    def reset_batch(self):
+        self.active = []
+        self.cache = None
+        self.attention_mask = None
+        self.next_logits = None
+
+    def forward(self, input_ids, attention_mask, position_ids, cache):
+        outputs = self.model.base_model(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            past_key_values=DynamicCache.from_legacy_cache(cache),
+            use_cache=True,
+        )
+        # Only the last position is sampled from, so skip projecting the rest onto the vocabulary
+        logits = self.model.get_output_embeddings()(outputs.last_hidden_state[:, -1, :])
+        return logits.float(), outputs.past_key_values.to_legacy_cache()
+
+    def extend(self, cache, past_length, token_ids):
+        ids = torch.tensor([token_ids], dtype=torch.long)
+        mask = torch.ones(1, past_length + len(token_ids), dtype=torch.long)
+        positions = torch.arange(past_length, past_length + len(token_ids)).unsqueeze(0)
+        self.stats["prefill_tokens"] += len(token_ids)
+        return self.forward(ids, mask, positions, cache)
+
+    def prefill(self, segments):
+        cache, length, key = None, 0, ()
+        if self.prefix_cache is not None:
+            for segment in segments[:-1]:
+                key += tuple(segment)
+                cached = self.prefix_cache.get(key)
+                if cached is None:
+                    _, cached = self.extend(cache, length, segment)
+                    self.prefix_cache.put(key, cached)
+                else:
+                    self.stats["prefix_tokens_reused"] += len(segment)
+                cache = cached
+                length += len(segment)
+            segments = segments[-1:]
+        suffix = [token for segment in segments for token in segment]
+        logits, cache = self.extend(cache, length, suffix)
+        return logits, cache, torch.ones(1, length + len(suffix), dtype=torch.long)
+
+    @torch.inference_mode()
+    def admit(self, request_id, segments, params):
+        start = time.perf_counter()
+        logits, cache, mask = self.prefill(segments)
+        self.stats["prefill_seconds"] += time.perf_counter() - start
+        self.stats["sequences"] += 1
+
+        input_ids = [token for segment in segments for token in segment]
+        self.active.append(Sequence(request_id, input_ids, params))
+        if self.cache is None:
+            self.cache, self.attention_mask, self.next_logits = cache, mask, logits
+            return
+
+        length = max(self.attention_mask.shape[1], mask.shape[1])
+        self.cache = tuple(
+            tuple(torch.cat([left_pad(batch_tensor, length, 2), left_pad(new_tensor, length, 2)])
+                  for batch_tensor, new_tensor in zip(batch_layer, new_layer))
+            for batch_layer, new_layer in zip(self.cache, cache)
+        )
+        self.attention_mask = torch.cat([left_pad(self.attention_mask, length, 1), left_pad(mask, length, 1)])
+        self.next_logits = torch.cat([self.next_logits, logits])
+
+    def sample(self, sequence, logits):
+        history = torch.tensor([sequence.input_ids + sequence.generated], dtype=torch.long)
+        scores = sequence.processors(history, logits.unsqueeze(0))
+        if sequence.params.get("do_sample", False):
+            return torch.multinomial(torch.softmax(scores, dim=-1), num_samples=1).item()
+        return scores.argmax(dim=-1).item()
+
+    def is_finished(self, sequence):
+        if (sequence.generated[-1] in self.eos_token_ids
+                or len(sequence.generated) >= sequence.params["max_new_tokens"]):
+            return True
+        # Same interface as generate(): called with the prompt and everything generated so far
+        criteria = sequence.params.get("stopping_criteria")
+        return criteria is not None and bool(criteria(torch.tensor([sequence.input_ids + sequence.generated]), None)[0])
+
+    @torch.inference_mode()
+    def step(self):
+        """Sample one token for every active sequence and return the ones that finished."""
+        start = time.perf_counter()
+        for sequence, logits in zip(self.active, self.next_logits):
+            sequence.generated.append(self.sample(sequence, logits))
+        self.stats["generated_tokens"] += len(self.active)
+
+        done = [self.is_finished(sequence) for sequence in self.active]
+        finished = [sequence for sequence, is_done in zip(self.active, done) if is_done]
+        keep = [row for row, is_done in enumerate(done) if not is_done]
+        if not keep:
+            self.reset_batch()
+            return finished
+
+        if len(keep) < len(self.active):
+            rows = torch.tensor(keep)
+            self.cache = tuple(tuple(tensor.index_select(0, rows) for tensor in layer) for layer in self.cache)
+            self.attention_mask = self.attention_mask.index_select(0, rows)
+            self.active = [self.active[row] for row in keep]
+            # Drop leading columns that are padding for every remaining row
+            leading = int((self.attention_mask.sum(dim=0) == 0).long().cumprod(dim=0).sum())
+            if leading:
+                self.cache = tuple(tuple(tensor[:, :, leading:] for tensor in layer) for layer in self.cache)
+                self.attention_mask = self.attention_mask[:, leading:]
+
+        input_ids = torch.tensor([[sequence.generated[-1]] for sequence in self.active], dtype=torch.long)
+        position_ids = self.attention_mask.sum(dim=1, keepdim=True)
+        self.attention_mask = torch.cat([self.attention_mask, torch.ones_like(input_ids)], dim=1)
+        self.next_logits, self.cache = self.forward(input_ids, self.attention_mask, position_ids, self.cache)
+
+        self.stats["decode_steps"] += 1
+        self.stats["decode_batch_rows"] += len(self.active)
+        self.stats["max_decode_batch_rows"] = max(self.stats["max_decode_batch_rows"], len(self.active))
+        self.stats["decode_seconds"] += time.perf_counter() - start
+        return finished
+
+    def run(self, requests):
+        """Generate for (request_id, prompt_segments, params) tuples.
+
+        Yields (request_id, generated_ids) in completion order, which is not
+        necessarily the order the requests were submitted in. A live source may
+        yield None when no request is ready yet; the engine then keeps decoding
+        its active sequences and asks again after the next step.
+        """
+        pending = iter(requests)
+        exhausted = False
+        while True:
+            if not exhausted and (self.continuous or not self.active):
+                while len(self.active) < self.max_batch_size:
+                    request = next(pending, EXHAUSTED)
+                    if request is EXHAUSTED:
+                        exhausted = True
+                        break
+                    if request is None:
+                        break
+                    self.admit(*request)
+            if not self.active:
+                if exhausted:
+                    return
+                continue
+            for sequence in self.step():
+                yield sequence.request_id, sequence.generated
+
+    def report(self):
+        stats = self.stats
+        elapsed = stats["prefill_seconds"] + stats["decode_seconds"]
+        tokens_per_second = stats["generated_tokens"] / elapsed if elapsed else 0.0
+        mean_batch = stats["decode_batch_rows"] / stats["decode_steps"] if stats["decode_steps"] else 0.0
+        return (f"Generated {stats['generated_tokens']} tokens for {stats['sequences']} sequences "
+                f"in {elapsed:.1f}s ({tokens_per_second:.1f} tokens/sec); "
+                f"prefill {stats['prefill_tokens']} tokens in {stats['prefill_seconds']:.1f}s "
+                f"({stats['prefix_tokens_reused']} prefix tokens reused from cache), "
+                f"mean decode batch {mean_batch:.1f}")
+
+
+class AssistedEngine:
+    """Speculative decoding with a small draft model, one sequence at a time.
+
+    Wraps transformers' assisted generation: the draft model proposes up to
+    draft_tokens tokens, the target model scores them all in one forward pass
+    and keeps the longest accepted run plus one token of its own. Greedy output
+    is the same as the target model's alone; with sampling, drafted tokens are
+    accepted or resampled so the output follows the target model's distribution
+    under the same temperature, top_p and repetition_penalty.
+
+    Assisted generation only supports a batch of one, so requests are decoded
+    in submission order and the prefix cache is not used. run() takes the same
+    requests as GenerationEngine.run().
+    """
+
+    def __init__(self, model, tokenizer, draft_model, draft_tokens=5):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.draft_model = draft_model
+        # The starting candidate length; transformers' heuristic schedule adapts it to the acceptance rate
+        draft_model.generation_config.num_assistant_tokens = draft_tokens
+        self.reset_batch()
+        self.stats = {
+            "sequences": 0,
+            "generated_tokens": 0,
+            "decode_seconds": 0.0,
+            "target_forwards": 0,
+            "draft_tokens": 0,
+            "accepted_draft_tokens": 0,
+        }
+
+    def reset_batch(self):
+        # Never holds a sequence between requests; kept so callers can check whether the engine is idle
+        self.active = []
+
+    def generate(self, input_ids, params):
+        # Every draft forward pass proposes one token; every target pass verifies one batch of proposals.
+        # The models may be shared by engines on other threads, so only this thread's passes are counted.
+        passes = {"target": 0, "draft": 0}
+        thread = threading.get_ident()
+
+        def counter(name):
+            def hook(*_):
+                if threading.get_ident() == thread:
+                    passes[name] += 1
+            return hook
+
+        hooks = [self.model.register_forward_hook(counter("target")),
+                 self.draft_model.register_forward_hook(counter("draft"))]
+        start = time.perf_counter()
+        try:
+            with torch.inference_mode():
+                output = self.model.generate(
+                    torch.tensor([input_ids]),
+                    attention_mask=torch.ones(1, len(input_ids), dtype=torch.long),
+                    assistant_model=self.draft_model,
+                    pad_token_id=self.tokenizer.pad_token_id,
+                    eos_token_id=self.tokenizer.eos_token_id,
+                    **params,
+                )
+        finally:
+            for hook in hooks:
+                hook.remove()
+        generated = output[0, len(input_ids):].tolist()
+        stats = self.stats
+        stats["decode_seconds"] += time.perf_counter() - start
+        stats["sequences"] += 1
+        stats["generated_tokens"] += len(generated)
+        stats["target_forwards"] += passes["target"]
+        stats["draft_tokens"] += passes["draft"]
+        # Each target pass adds the accepted draft tokens plus one token sampled by the target itself
+        stats["accepted_draft_tokens"] += max(len(generated) - passes["target"], 0)
+        return generated
+
+    def run(self, requests):
+        """Generate for (request_id, prompt_segments, params) tuples, yielding (request_id, generated_ids)."""
+        for request in requests:
+            if request is None:
+                continue
+            request_id, segments, params = request
+            yield request_id, self.generate([token for segment in segments for token in segment], params)
+
+    def report(self):
+        stats = self.stats
+        tokens_per_second = stats["generated_tokens"] / stats["decode_seconds"] if stats["decode_seconds"] else 0.0
+        acceptance = stats["accepted_draft_tokens"] / stats["draft_tokens"] if stats["draft_tokens"] else 0.0
+        per_pass = stats["generated_tokens"] / stats["target_forwards"] if stats["target_forwards"] else 0.0
+        return (f"Generated {stats['generated_tokens']} tokens for {stats['sequences']} sequences "
+                f"in {stats['decode_seconds']:.1f}s ({tokens_per_second:.1f} tokens/sec) with a draft model; "
+                f"accepted {stats['accepted_draft_tokens']} of {stats['draft_tokens']} drafted tokens "
+                f"({acceptance:.1%}), {per_pass:.2f} tokens per target forward pass")
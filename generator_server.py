@@ -0,0 +1,416 @@
+import sys
+import json
+import time
+import uuid
+import queue
+import argparse
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import statement_generator
+from label_registry import PRIORITIES, label_priority
+from result_cache import ResultCache
+
+MODES = {'res': ['res'], 'rec': ['rec'], 'both': ['res', 'rec']}
+PRIORITY_NAMES = {value: name for name, value in PRIORITIES.items()}
+DEFAULT_AGING_SECONDS = 30.0
+
+
+class ServiceTracker:
+    def __init__(self, window=10000):
+        self.lock = threading.Lock()
+        self.latencies = {name: deque(maxlen=window) for name in PRIORITIES}
+        self.queue_waits = deque(maxlen=window)
+        self.counts = {status: 0 for status in ("submitted", "rejected", "completed", "cancelled", "expired", "failed")}
+        self.max_queue_depth = 0
+        self.queue_depth = lambda: 0
+
+    def record_submitted(self, depth):
+        with self.lock:
+            self.counts["submitted"] += 1
+            self.max_queue_depth = max(self.max_queue_depth, depth)
+
+    def record_rejected(self):
+        with self.lock:
+            self.counts["rejected"] += 1
+
+    def record_started(self, job):
+        with self.lock:
+            self.queue_waits.append(job.started - job.submitted)
+
+    def record_finished(self, job):
+        with self.lock:
+            self.counts[job.status] += 1
+            if job.status == "completed":
+                self.latencies[PRIORITY_NAMES[job.priority]].append(time.perf_counter() - job.submitted)
+
+    def percentile(self, sorted_latencies, pct):
+        if not sorted_latencies:
+            return 0.0
+        index = min(len(sorted_latencies) - 1, int(round(pct / 100 * (len(sorted_latencies) - 1))))
+        return sorted_latencies[index]
+
+    def snapshot(self):
+        with self.lock:
+            snapshot = {f"requests_{status}": count for status, count in self.counts.items()}
+            snapshot["queue_depth"] = self.queue_depth()
+            snapshot["max_queue_depth"] = self.max_queue_depth
+            waits = sorted(self.queue_waits)
+            snapshot["queue_wait_p50_ms"] = self.percentile(waits, 50) * 1000
+            snapshot["queue_wait_p99_ms"] = self.percentile(waits, 99) * 1000
+            latencies = sorted(latency for window in self.latencies.values() for latency in window)
+            snapshot["latency_p50_ms"] = self.percentile(latencies, 50) * 1000
+            snapshot["latency_p99_ms"] = self.percentile(latencies, 99) * 1000
+            for name, window in self.latencies.items():
+                latencies = sorted(window)
+                snapshot[f"latency_{name}_p50_ms"] = self.percentile(latencies, 50) * 1000
+                snapshot[f"latency_{name}_p99_ms"] = self.percentile(latencies, 99) * 1000
+            return snapshot
+
+
+class GenerationJob:
+    def __init__(self, job_id, input_data, modes, priority, deadline):
+        self.id = job_id
+        self.input_data = input_data
+        self.modes = modes
+        self.priority = priority
+        self.deadline = deadline
+        self.submitted = time.perf_counter()
+        self.started = None
+        self.record = None
+        # Sequences still in the engine; a cancelled job is forgotten once they have all stopped
+        self.remaining = 0
+        self.status = "queued"
+        self.result = None
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+
+    def expired(self):
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def finish(self, status, result=None):
+        """Settle the job once; returns False if it had already been completed, cancelled or expired."""
+        with self.lock:
+            if self.done.is_set():
+                return False
+            self.status, self.result = status, result
+            self.done.set()
+            return True
+
+
+class JobStopped:
+    """Stopping criterion that ends a job's sequences once it is cancelled or past its deadline."""
+
+    def __init__(self, job):
+        self.job = job
+
+    def __call__(self, input_ids, scores, **kwargs):
+        import torch
+        if self.job.expired():
+            self.job.finish("expired")
+        return torch.full((input_ids.shape[0],), self.job.done.is_set(), dtype=torch.bool, device=input_ids.device)
+
+
+class Scheduler:
+    """Feeds queued jobs to one generation engine, most urgent first.
+
+    Jobs wait in a bounded queue and are taken by priority, then arrival. A
+    job gains one priority level for every aging_seconds it has waited, so a
+    steady stream of urgent jobs cannot hold back low-priority ones forever.
+    The engine pulls a job whenever it has a free slot, so an urgent job
+    overtakes everything still queued, but not sequences already decoding.
+    A cancelled or expired job leaves the queue at once, freeing its slot, or
+    is stopped after the next decode step if it is already running.
+    """
+
+    def __init__(self, engine, queue_size, tracker, aging_seconds=DEFAULT_AGING_SECONDS):
+        self.engine = engine
+        self.tracker = tracker
+        self.queue_size = queue_size
+        self.aging_seconds = aging_seconds
+        self.waiting = []
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.ready = threading.Condition(self.lock)
+        tracker.queue_depth = lambda: len(self.waiting)
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    def submit(self, job):
+        """Queue a job; raises KeyError for an id already in use and queue.Full when the queue is full."""
+        with self.lock:
+            if job.id in self.jobs:
+                raise KeyError(job.id)
+            if len(self.waiting) >= self.queue_size:
+                self.prune()
+            if len(self.waiting) >= self.queue_size:
+                self.tracker.record_rejected()
+                raise queue.Full
+            self.waiting.append(job)
+            self.jobs[job.id] = job
+            depth = len(self.waiting)
+            self.ready.notify()
+        self.tracker.record_submitted(depth)
+
+    def dequeue(self, job):
+        # Called with the lock held, for a job that has just been settled while still queued
+        self.waiting.remove(job)
+        self.jobs.pop(job.id, None)
+        self.tracker.record_finished(job)
+
+    def prune(self):
+        """Drop queued jobs whose deadline has passed; called with the lock held."""
+        for job in [job for job in self.waiting if job.expired()]:
+            job.finish("expired")
+            self.dequeue(job)
+
+    def stop(self, job, status):
+        """Cancel or expire a job, taking it out of the queue if it has not started."""
+        with self.lock:
+            if not job.finish(status):
+                return False
+            if job in self.waiting:
+                self.dequeue(job)
+        return True
+
+    def cancel(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+        return job is not None and self.stop(job, "cancelled")
+
+    def rank(self, job, now):
+        waited_levels = (now - job.submitted) / self.aging_seconds if self.aging_seconds else 0.0
+        return job.priority - waited_levels, job.submitted
+
+    def take(self, block):
+        """Remove and return the job to run next, or None if none is queued and block is False."""
+        with self.lock:
+            self.prune()
+            while not self.waiting:
+                if not block:
+                    return None
+                self.ready.wait()
+                self.prune()
+            now = time.perf_counter()
+            job = min(self.waiting, key=lambda job: self.rank(job, now))
+            self.waiting.remove(job)
+            return job
+
+    def settle(self, job, status, result=None):
+        job.finish(status, result)
+        if job.remaining == 0:
+            with self.lock:
+                self.jobs.pop(job.id, None)
+            self.tracker.record_finished(job)
+
+    def params(self, job, mode, segments):
+        from transformers import StoppingCriteriaList
+        params = statement_generator.with_stopping_criteria(
+            statement_generator.get_generation_params(mode), mode, sum(len(segment) for segment in segments)
+        )
+        return {**params, "stopping_criteria": StoppingCriteriaList(list(params.get("stopping_criteria", [])) + [JobStopped(job)])}
+
+    def requests(self):
+        while True:
+            # Block only while the engine is idle; otherwise let it keep decoding
+            job = self.take(block=not self.engine.active)
+            if job is None:
+                yield None
+                continue
+            job.started = time.perf_counter()
+            self.tracker.record_started(job)
+            try:
+                job.record = statement_generator.prepare_record(job.input_data, job.modes)
+            except Exception as e:
+                print(f"Error preparing generation: {e}", file=sys.stderr)
+                self.settle(job, "failed", str(e))
+                continue
+            if not job.record["prompts"]:
+                self.settle(job, "completed", statement_generator.build_result(job.record))
+                continue
+            job.remaining = len(job.record["prompts"])
+            # All modes of a statement are submitted back to back so they share a decode batch
+            for mode, segments in job.record["prompts"].items():
+                yield (job.id, mode), segments, self.params(job, mode, segments)
+
+    def complete(self, job, mode, generated_ids):
+        job.remaining -= 1
+        if job.done.is_set():
+            # Cancelled or expired while decoding; partial output is neither returned nor cached
+            if job.remaining == 0:
+                self.settle(job, job.status)
+            return
+        try:
+            statement_generator.complete_generation(job.record, mode, generated_ids)
+        except Exception as e:
+            print(f"Error completing generation: {e}", file=sys.stderr)
+            job.finish("failed", str(e))
+        if job.remaining == 0:
+            self.settle(job, "completed", statement_generator.build_result(job.record))
+
+    def run(self):
+        while True:
+            try:
+                for (job_id, mode), generated_ids in self.engine.run(self.requests()):
+                    self.complete(self.jobs[job_id], mode, generated_ids)
+            except Exception as e:
+                print(f"Error generating: {e}", file=sys.stderr)
+                # Fail whatever was decoding and start over with an empty batch and KV cache
+                self.engine.reset_batch()
+                with self.lock:
+                    running = [job for job in self.jobs.values() if job.remaining]
+                for job in running:
+                    job.remaining = 0
+                    self.settle(job, "failed", str(e))
+
+
+class GeneratorHandler(BaseHTTPRequestHandler):
+    scheduler = None
+    default_deadline_ms = None
+
+    def send_body(self, status, body, content_type="application/json"):
+        payload = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def send_error_json(self, status, message):
+        self.send_body(status, json.dumps({"error": message}))
+
+    def do_GET(self):
+        if self.path == "/health":
+            self.send_body(200, json.dumps({"status": "ok"}))
+        elif self.path == "/metrics":
+            self.send_body(200, json.dumps(statement_generator.metrics.snapshot()))
+        elif self.path == "/metrics/prometheus":
+            self.send_body(200, statement_generator.metrics.to_prometheus(), "text/plain; version=0.0.4")
+        else:
+            self.send_error_json(404, "Not found")
+
+    def do_DELETE(self):
+        if not self.path.startswith("/generate/"):
+            self.send_error_json(404, "Not found")
+        elif self.scheduler.cancel(self.path[len("/generate/"):]):
+            self.send_body(200, json.dumps({"cancelled": True}))
+        else:
+            self.send_error_json(404, "No queued or running request with that id")
+
+    def parse_job(self, request):
+        if not isinstance(request, dict) or not isinstance(request.get('text'), str) or not isinstance(request.get('label'), str):
+            raise ValueError('Input must be a JSON object with "text" and "label" strings')
+        mode = request.get('mode', 'both')
+        if mode not in MODES:
+            raise ValueError(f'"mode" must be one of {list(MODES)}')
+        priority = request.get('priority')
+        if priority is not None and priority not in PRIORITIES:
+            raise ValueError(f'"priority" must be one of {list(PRIORITIES)}')
+        deadline_ms = request.get('deadline_ms', self.default_deadline_ms)
+        if deadline_ms is not None and (not isinstance(deadline_ms, (int, float)) or deadline_ms <= 0):
+            raise ValueError('"deadline_ms" must be a positive number')
+        input_data = {key: value for key, value in request.items() if key not in ('id', 'mode', 'priority', 'deadline_ms')}
+        return GenerationJob(
+            str(request.get('id') or uuid.uuid4().hex),
+            input_data,
+            MODES[mode],
+            PRIORITIES[priority] if priority is not None else label_priority(request['label']),
+            time.monotonic() + deadline_ms / 1000 if deadline_ms is not None else None,
+        )
+
+    def do_POST(self):
+        if self.path != "/generate":
+            self.send_error_json(404, "Not found")
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            job = self.parse_job(json.loads(self.rfile.read(length)))
+        except json.JSONDecodeError:
+            self.send_error_json(400, "Invalid JSON input")
+            return
+        except ValueError as e:
+            self.send_error_json(400, str(e))
+            return
+
+        try:
+            self.scheduler.submit(job)
+        except KeyError:
+            self.send_error_json(409, f"A request with id {job.id} is already queued or running")
+            return
+        except queue.Full:
+            self.send_error_json(503, "Request queue is full")
+            return
+
+        timeout = max(job.deadline - time.monotonic(), 0) if job.deadline is not None else None
+        if not job.done.wait(timeout):
+            self.scheduler.stop(job, "expired")
+        if job.status == "completed":
+            result = {"id": job.id, **job.result, "priority": PRIORITY_NAMES[job.priority],
+                      "queue_ms": round((job.started - job.submitted) * 1000, 1),
+                      "latency_ms": round((time.perf_counter() - job.submitted) * 1000, 1)}
+            self.send_body(200, json.dumps(result, ensure_ascii=False))
+        elif job.status == "cancelled":
+            self.send_error_json(409, "Request cancelled")
+        elif job.status == "expired":
+            self.send_error_json(504, "Deadline exceeded")
+        else:
+            self.send_error_json(500, job.result or "Generation failed")
+
+    def log_message(self, format, *args):
+        print(f"{self.address_string()} - {format % args}", file=sys.stderr)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Serve the diplomatic statement generator over HTTP')
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--queue-size', type=int, default=256,
+                       help='Requests that may wait for a decode slot; further requests get 503.')
+    parser.add_argument('--aging-seconds', type=float, default=DEFAULT_AGING_SECONDS,
+                       help='Waiting time that raises a queued request by one priority level (0: no aging).')
+    parser.add_argument('--default-deadline-ms', type=float, default=None,
+                       help='Deadline for requests that do not set "deadline_ms" (default: none).')
+    parser.add_argument('--batch-size', type=int, default=8,
+                       help='Maximum number of sequences decoded together.')
+    parser.add_argument('--prefix-cache-size', type=int, default=32,
+                       help='Number of prompt-prefix KV caches kept for reuse.')
+    parser.add_argument('--dtype', type=str, choices=statement_generator.DTYPES, default='fp32',
+                       help='Generator weights: fp32, bf16 or dynamically quantized int8.')
+    parser.add_argument('--cache-path', type=str, default=statement_generator.DEFAULT_CACHE_PATH,
+                       help='SQLite file caching generated outputs.')
+    parser.add_argument('--no-cache', action='store_true',
+                       help='Always run the model instead of reusing cached outputs.')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    # Loaded once for the whole process, before the first request rather than during it
+    try:
+        statement_generator.load_generator(dtype=args.dtype)
+    except Exception as e:
+        print(f"Error loading model or tokenizer: {e}", file=sys.stderr)
+        sys.exit(1)
+    if not args.no_cache:
+        statement_generator.result_cache = ResultCache(args.cache_path)
+    engine = statement_generator.create_engine(max_batch_size=args.batch_size, prefix_cache_size=args.prefix_cache_size)
+    tracker = ServiceTracker()
+    statement_generator.metrics.register(lambda: engine.stats)
+    statement_generator.metrics.register(tracker.snapshot)
+    GeneratorHandler.scheduler = Scheduler(engine, args.queue_size, tracker, args.aging_seconds)
+    GeneratorHandler.default_deadline_ms = args.default_deadline_ms
+
+    server = ThreadingHTTPServer((args.host, args.port), GeneratorHandler)
+    print(f"Generator server listening on http://{args.host}:{args.port}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
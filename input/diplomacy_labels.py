@@ -1,64 +0,0 @@
-id_to_label = {
-    0: "cooperation",
-    1: "negotiation",
-    2: "alliance_proposal",
-    3: "threat",
-    4: "intimidation",
-    5: "compromise",
-    6: "peace_offer",
-    7: "declaration_of_war",
-    8: "ceasefire_request",
-    9: "trade_proposal",
-    10: "intelligence_sharing",
-    11: "diplomatic_pressure",
-    12: "sanctions_threat",
-    13: "mediation_offer",
-    14: "neutrality_declaration",
-    15: "territorial_claim",
-    16: "diplomatic_protest",
-    17: "apology",
-    18: "praise_or_commendation",
-    19: "criticism",
-    20: "request_for_aid",
-    21: "offer_of_assistance",
-    22: "ultimatum",
-    23: "non_aggression_pact",
-    24: "treaty_proposal",
-    25: "diplomatic_recognition",
-    26: "severance_of_relations",
-    27: "espionage_accusation",
-    28: "denial_of_accusations",
-    29: "call_for_unity",
-    30: "appeal_to_international_law",
-    31: "economic_cooperation",
-    32: "cultural_exchange",
-    33: "military_cooperation",
-    34: "humanitarian_aid_offer",
-    35: "request_for_mediation",
-    36: "diplomatic_immunity_invocation",
-    37: "extradition_request",
-    38: "asylum_offer",
-    39: "propaganda",
-    40: "disinformation",
-    41: "confidence_building_measure",
-    42: "arms_control_proposal",
-    43: "environmental_cooperation",
-    44: "technology_transfer",
-    45: "diplomatic_demarche",
-    46: "formal_complaint",
-    47: "request_for_clarification",
-    48: "expression_of_concern",
-    49: "congratulatory_message",
-    50: "condolences",
-    51: "neutral_statement",
-    52: "procedural_communication",
-    53: "information_request",
-    54: "summit_proposal",
-    55: "arbitration_request",
-    56: "border_dispute_resolution",
-    57: "diplomatic_crisis_management",
-    58: "economic_sanctions_announcement",
-    59: "humanitarian_corridor_request",
-    60: "peacekeeping_mission_proposal",
-    61: "condemnation"
-}
@@ -0,0 +1,256 @@
+import numpy as np
+
+# The one list of diplomatic message labels; a label's position is its class id
+LABELS = (
+    "cooperation",
+    "negotiation",
+    "alliance_proposal",
+    "threat",
+    "intimidation",
+    "compromise",
+    "peace_offer",
+    "declaration_of_war",
+    "ceasefire_request",
+    "trade_proposal",
+    "intelligence_sharing",
+    "diplomatic_pressure",
+    "sanctions_threat",
+    "mediation_offer",
+    "neutrality_declaration",
+    "territorial_claim",
+    "diplomatic_protest",
+    "apology",
+    "praise_or_commendation",
+    "criticism",
+    "request_for_aid",
+    "offer_of_assistance",
+    "ultimatum",
+    "non_aggression_pact",
+    "treaty_proposal",
+    "diplomatic_recognition",
+    "severance_of_relations",
+    "espionage_accusation",
+    "denial_of_accusations",
+    "call_for_unity",
+    "appeal_to_international_law",
+    "economic_cooperation",
+    "cultural_exchange",
+    "military_cooperation",
+    "humanitarian_aid_offer",
+    "request_for_mediation",
+    "diplomatic_immunity_invocation",
+    "extradition_request",
+    "asylum_offer",
+    "propaganda",
+    "disinformation",
+    "confidence_building_measure",
+    "arms_control_proposal",
+    "environmental_cooperation",
+    "technology_transfer",
+    "diplomatic_demarche",
+    "formal_complaint",
+    "request_for_clarification",
+    "expression_of_concern",
+    "congratulatory_message",
+    "condolences",
+    "neutral_statement",
+    "procedural_communication",
+    "information_request",
+    "summit_proposal",
+    "arbitration_request",
+    "border_dispute_resolution",
+    "diplomatic_crisis_management",
+    "economic_sanctions_announcement",
+    "humanitarian_corridor_request",
+    "peacekeeping_mission_proposal",
+    "condemnation",
+)
+
+id_to_label = dict(enumerate(LABELS))
+label_to_id = {label: index for index, label in enumerate(LABELS)}
+
+# Indexing this with an array of class ids decodes a whole batch of predictions at once
+LABEL_ARRAY = np.array(LABELS, dtype=object)
+
+DEFAULT_RESPONSE_CONTEXT = "Formulate a balanced diplomatic response appropriate to the situation."
+DEFAULT_RECOMMENDATION_CONTEXT = "Provide strategic diplomatic guidance appropriate to the situation."
+
+RESPONSE_CONTEXTS = {
+    "cooperation": "Foster mutual benefit while maintaining clear operational boundaries.",
+    "negotiation": "Engage in constructive dialogue while preserving core interests.",
+    "alliance_proposal": "Show measured interest in cooperation while preserving independent decision-making.",
+    "threat": "Maintain firm positioning while emphasizing diplomatic solutions.",
+    "intimidation": "Demonstrate unwavering resolve while keeping dialogue channels open.",
+    "compromise": "Acknowledge mutual interests while ensuring balanced concessions.",
+    "peace_offer": "Consider peace initiatives while maintaining prudent deliberation.",
+    "declaration_of_war": "Maintain composure while asserting defensive readiness.",
+    "ceasefire_request": "Address humanitarian concerns while ensuring security parameters.",
+    "trade_proposal": "Evaluate economic opportunities while ensuring mutual benefit.",
+    "intelligence_sharing": "Consider security cooperation while maintaining operational discretion.",
+    "diplomatic_pressure": "Address concerns while maintaining diplomatic dignity.",
+    "sanctions_threat": "Respond to concerns while emphasizing diplomatic alternatives.",
+    "mediation_offer": "Consider third-party facilitation while maintaining sovereignty.",
+    "neutrality_declaration": "Affirm non-intervention while maintaining diplomatic relations.",
+    "territorial_claim": "Assert territorial integrity while remaining open to dialogue.",
+    "diplomatic_protest": "Address grievances while maintaining professional composure.",
+    "apology": "Express appropriate regret while maintaining diplomatic dignity.",
+    "praise_or_commendation": "Acknowledge achievements while maintaining professional distance.",
+    "criticism": "Address concerns while maintaining diplomatic discourse.",
+    "request_for_aid": "Consider assistance needs while following proper protocols.",
+    "offer_of_assistance": "Express support while establishing appropriate frameworks.",
+    "ultimatum": "Maintain resolve while preserving diplomatic options.",
+    "non_aggression_pact": "Consider security assurances while maintaining sovereignty.",
+    "treaty_proposal": "Evaluate cooperative frameworks while ensuring national interests.",
+    "diplomatic_recognition": "Acknowledge diplomatic status while following proper procedures.",
+    "severance_of_relations": "Maintain dignity while following diplomatic protocols.",
+    "espionage_accusation": "Address security concerns while maintaining diplomatic channels.",
+    "denial_of_accusations": "Present position clearly while maintaining professional tone.",
+    "call_for_unity": "Consider collective action while maintaining autonomous decision-making.",
+    "appeal_to_international_law": "Reference legal frameworks while maintaining diplomatic discourse.",
+    "economic_cooperation": "Explore mutual benefits while maintaining regulatory autonomy.",
+    "cultural_exchange": "Promote cultural understanding while following diplomatic protocols.",
+    "military_cooperation": "Consider security collaboration while maintaining operational independence.",
+    "humanitarian_aid_offer": "Coordinate assistance while ensuring proper procedures.",
+    "request_for_mediation": "Consider conflict resolution while maintaining sovereign rights.",
+    "diplomatic_immunity_invocation": "Assert diplomatic privileges while maintaining professional conduct.",
+    "extradition_request": "Process legal matters through appropriate diplomatic channels.",
+    "asylum_offer": "Handle humanitarian matters through established protocols.",
+    "propaganda": "Address information concerns while maintaining diplomatic composure.",
+    "disinformation": "Counter misrepresentation while maintaining professional standards.",
+    "confidence_building_measure": "Foster trust while maintaining appropriate boundaries.",
+    "arms_control_proposal": "Consider security measures while maintaining defense capabilities.",
+    "environmental_cooperation": "Promote ecological collaboration while ensuring sovereign interests.",
+    "technology_transfer": "Facilitate technical exchange within appropriate frameworks.",
+    "diplomatic_demarche": "Convey position firmly while maintaining diplomatic protocol.",
+    "formal_complaint": "Address grievances through proper diplomatic channels.",
+    "request_for_clarification": "Seek information while maintaining professional discourse.",
+    "expression_of_concern": "Voice concerns while maintaining diplomatic engagement.",
+    "congratulatory_message": "Express recognition while maintaining professional tone.",
+    "condolences": "Express sympathy while maintaining diplomatic propriety.",
+    "neutral_statement": "Maintain balanced position while ensuring clear communication.",
+    "procedural_communication": "Follow diplomatic protocols while ensuring clear transmission.",
+    "information_request": "Seek details through appropriate diplomatic channels.",
+    "summit_proposal": "Consider high-level dialogue while maintaining proper preparation.",
+    "arbitration_request": "Consider dispute resolution while following established procedures.",
+    "border_dispute_resolution": "Address territorial matters through diplomatic channels.",
+    "diplomatic_crisis_management": "Handle urgent matters while maintaining diplomatic protocol.",
+    "economic_sanctions_announcement": "Implement measures while maintaining diplomatic channels.",
+    "humanitarian_corridor_request": "Address humanitarian needs while ensuring security protocols.",
+    "peacekeeping_mission_proposal": "Consider stability operations while maintaining sovereignty.",
+    "condemnation": "Express strong disapproval while maintaining diplomatic language.",
+}
+
+RECOMMENDATION_CONTEXTS = {
+    "cooperation": "Analyze cooperation potential and framework requirements.",
+    "negotiation": "Evaluate negotiation positions and potential compromises.",
+    "alliance_proposal": "Assess strategic implications and commitment requirements.",
+    "threat": "Analyze threat credibility and response options.",
+    "intimidation": "Evaluate power dynamics and strategic responses.",
+    "compromise": "Assess concession balance and strategic implications.",
+    "peace_offer": "Evaluate peace terms and implementation requirements.",
+    "declaration_of_war": "Analyze conflict escalation and diplomatic options.",
+    "ceasefire_request": "Assess security implications and verification needs.",
+    "trade_proposal": "Evaluate economic benefits and regulatory requirements.",
+    "intelligence_sharing": "Assess information value and security protocols.",
+    "diplomatic_pressure": "Analyze leverage points and response strategies.",
+    "sanctions_threat": "Evaluate economic impact and mitigation options.",
+    "mediation_offer": "Assess mediator neutrality and process framework.",
+    "neutrality_declaration": "Evaluate implications and verification measures.",
+    "territorial_claim": "Analyze legal basis and strategic implications.",
+    "diplomatic_protest": "Assess grievance validity and response options.",
+    "apology": "Evaluate appropriate response and future implications.",
+    "praise_or_commendation": "Consider reciprocation and relationship building.",
+    "criticism": "Analyze validity and response strategy.",
+    "request_for_aid": "Assess needs and response capabilities.",
+    "offer_of_assistance": "Evaluate aid implications and coordination needs.",
+    "ultimatum": "Analyze demands and response options.",
+    "non_aggression_pact": "Evaluate security implications and verification needs.",
+    "treaty_proposal": "Assess terms and implementation requirements.",
+    "diplomatic_recognition": "Evaluate implications and procedural requirements.",
+    "severance_of_relations": "Analyze impact and contingency measures.",
+    "espionage_accusation": "Assess evidence and response strategy.",
+    "denial_of_accusations": "Evaluate defense strategy and evidence presentation.",
+    "call_for_unity": "Assess collective action implications.",
+    "appeal_to_international_law": "Evaluate legal basis and precedents.",
+    "economic_cooperation": "Analyze economic benefits and risks.",
+    "cultural_exchange": "Evaluate cultural impact and program requirements.",
+    "military_cooperation": "Assess security benefits and operational protocols.",
+    "humanitarian_aid_offer": "Evaluate aid coordination and distribution.",
+    "request_for_mediation": "Assess mediation framework and requirements.",
+    "diplomatic_immunity_invocation": "Evaluate legal basis and implications.",
+    "extradition_request": "Assess legal requirements and procedures.",
+    "asylum_offer": "Evaluate humanitarian and security implications.",
+    "propaganda": "Analyze messaging impact and response strategy.",
+    "disinformation": "Assess information integrity and counter-measures.",
+    "confidence_building_measure": "Evaluate trust-building potential.",
+    "arms_control_proposal": "Assess verification and compliance measures.",
+    "environmental_cooperation": "Evaluate environmental impact and resources.",
+    "technology_transfer": "Assess technical benefits and security implications.",
+    "diplomatic_demarche": "Evaluate message impact and delivery strategy.",
+    "formal_complaint": "Analyze grievance basis and response options.",
+    "request_for_clarification": "Assess information needs and response strategy.",
+    "expression_of_concern": "Evaluate situation gravity and response options.",
+    "congratulatory_message": "Consider appropriate reciprocation.",
+    "condolences": "Assess appropriate sympathy expression.",
+    "neutral_statement": "Evaluate balance and positioning strategy.",
+    "procedural_communication": "Assess protocol requirements.",
+    "information_request": "Evaluate information sharing parameters.",
+    "summit_proposal": "Assess meeting framework and preparations.",
+    "arbitration_request": "Evaluate dispute resolution process.",
+    "border_dispute_resolution": "Analyze territorial issues and solutions.",
+    "diplomatic_crisis_management": "Assess crisis severity and response options.",
+    "economic_sanctions_announcement": "Evaluate economic impact and duration.",
+    "humanitarian_corridor_request": "Assess security and logistics requirements.",
+    "peacekeeping_mission_proposal": "Evaluate mission scope and requirements.",
+    "condemnation": "Analyze situation severity and response tone.",
+}
+
+assert set(RESPONSE_CONTEXTS) == set(LABELS) and set(RECOMMENDATION_CONTEXTS) == set(LABELS)
+
+# Scheduling priority in the generator service; lower is served first
+PRIORITIES = {"urgent": 0, "normal": 1, "low": 2}
+URGENT_LABELS = (
+    "ultimatum",
+    "declaration_of_war",
+    "ceasefire_request",
+    "threat",
+    "sanctions_threat",
+    "severance_of_relations",
+    "diplomatic_crisis_management",
+    "humanitarian_corridor_request",
+)
+LOW_PRIORITY_LABELS = (
+    "congratulatory_message",
+    "condolences",
+    "praise_or_commendation",
+    "cultural_exchange",
+    "neutral_statement",
+    "procedural_communication",
+)
+LABEL_PRIORITIES = {
+    **{label: PRIORITIES["urgent"] for label in URGENT_LABELS},
+    **{label: PRIORITIES["low"] for label in LOW_PRIORITY_LABELS},
+}
+
+assert set(LABEL_PRIORITIES) <= set(LABELS)
+
+
+def label_priority(label):
+    return LABEL_PRIORITIES.get(label, PRIORITIES["normal"])
+
+
+def config_label_kwargs():
+    """from_pretrained() kwargs that size the classification head and save the names to config.json."""
+    return {"num_labels": len(LABELS), "id2label": dict(id_to_label), "label2id": dict(label_to_id)}
+
+
+def check_model_labels(config, source="model"):
+    """Refuse a checkpoint whose classification head does not match the registry."""
+    if config.num_labels != len(LABELS):
+        raise ValueError(f"{source} has a {config.num_labels}-way classification head, "
+                         f"but the label registry defines {len(LABELS)} labels")
+    names = [config.id2label[index] for index in range(config.num_labels)]
+    # Checkpoints trained before the registry existed only carry the generic LABEL_<n> names
+    if names != [f"LABEL_{index}" for index in range(len(names))] and names != list(LABELS):
+        mismatched = [f"{index}: {name} != {label}" for index, (name, label) in enumerate(zip(names, LABELS)) if name != label]
+        raise ValueError(f"{source} label names differ from the label registry: {', '.join(mismatched[:5])}")
@@ -0,0 +1,156 @@
+import os
+import sys
+import json
+import time
+import resource
+import threading
+import contextlib
+
+DEFAULT_PROFILE_DIR = "output/profiles"
+
+
+def peak_rss_bytes(who=resource.RUSAGE_SELF):
+    peak = resource.getrusage(who).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Metrics:
+    """Process-wide counters and timers, reported as JSON or Prometheus text.
+
+    timer(name) accumulates <name>_seconds and <name>_calls; add() and
+    maximum() maintain counters and high-water marks. Peak RSS, and the
+    values of callbacks passed to register(), are sampled when a snapshot is
+    taken.
+    """
+
+    def __init__(self, component):
+        self.component = component
+        self.lock = threading.Lock()
+        self.values = {}
+        # Names updated by add() and timer() only ever grow and are exported as Prometheus counters
+        self.counters = set()
+        self.sources = []
+        self.started = time.time()
+
+    def register(self, source):
+        """Add a callable returning a dict of current values, e.g. cache hit counts, to every snapshot."""
+        self.sources.append(source)
+
+    def add(self, name, value=1):
+        with self.lock:
+            self.values[name] = self.values.get(name, 0) + value
+            self.counters.add(name)
+
+    def maximum(self, name, value):
+        with self.lock:
+            self.values[name] = max(self.values.get(name, value), value)
+
+    def set(self, name, value):
+        with self.lock:
+            self.values[name] = value
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.values[f"{name}_seconds"] = self.values.get(f"{name}_seconds", 0.0) + elapsed
+                self.values[f"{name}_calls"] = self.values.get(f"{name}_calls", 0) + 1
+                self.counters.update((f"{name}_seconds", f"{name}_calls"))
+
+    def drain(self):
+        """Return the accumulated values and reset them, e.g. to ship a worker's share to its parent."""
+        with self.lock:
+            values, self.values = self.values, {}
+        return values
+
+    def merge(self, values):
+        # Values whose name marks a high-water mark are combined with max, everything else is summed
+        for name, value in values.items():
+            if name.startswith("max_"):
+                self.maximum(name, value)
+            else:
+                self.add(name, value)
+
+    def snapshot(self):
+        with self.lock:
+            values = dict(self.values)
+        for source in self.sources:
+            values.update(source())
+        snapshot = {
+            "component": self.component,
+            "timestamp": time.time(),
+            "uptime_seconds": time.time() - self.started,
+            "peak_rss_bytes": peak_rss_bytes(),
+        }
+        # Forked worker processes are only counted once they have exited
+        children = peak_rss_bytes(resource.RUSAGE_CHILDREN)
+        if children:
+            snapshot["peak_children_rss_bytes"] = children
+        snapshot.update(values)
+        return snapshot
+
+    def to_prometheus(self, snapshot=None):
+        snapshot = snapshot or self.snapshot()
+        lines = []
+        for name, value in sorted(snapshot.items()):
+            if name in ("component", "timestamp") or not isinstance(value, (int, float)):
+                continue
+            metric = f"diplomate_{name}"
+            lines.append(f"# TYPE {metric} {'counter' if name in self.counters else 'gauge'}")
+            lines.append(f'{metric}{{component="{self.component}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def write(self, json_path=None, prometheus_path=None):
+        """Write the snapshot as one JSON object ("-" for stderr) and/or a Prometheus textfile."""
+        snapshot = self.snapshot()
+        if json_path == "-":
+            print(json.dumps(snapshot), file=sys.stderr)
+        elif json_path:
+            os.makedirs(os.path.dirname(json_path) or ".", exist_ok=True)
+            with open(json_path, "w") as f:
+                json.dump(snapshot, f, indent=2)
+        if prometheus_path:
+            os.makedirs(os.path.dirname(prometheus_path) or ".", exist_ok=True)
+            # Written then renamed, so a textfile collector never reads a partial file
+            with open(prometheus_path + ".tmp", "w") as f:
+                f.write(self.to_prometheus(snapshot))
+            os.replace(prometheus_path + ".tmp", prometheus_path)
+
+
+def default_trace_path(component):
+    return os.path.join(DEFAULT_PROFILE_DIR, f"{component}_{time.strftime('%Y%m%d_%H%M%S')}.json")
+
+
+@contextlib.contextmanager
+def profiled(trace_path, active_steps=None):
+    """Run the enclosed block under torch.profiler and write a Chrome trace to trace_path.
+
+    With active_steps, only that many prof.step() intervals after one wait and
+    one warm-up step are recorded, for long loops such as training. A
+    trace_path of None disables profiling.
+    """
+    if trace_path is None:
+        yield None
+        return
+    import torch
+    from torch.profiler import ProfilerActivity, profile, schedule
+
+    os.makedirs(os.path.dirname(trace_path) or ".", exist_ok=True)
+    activities = [ProfilerActivity.CPU]
+    if torch.cuda.is_available():
+        activities.append(ProfilerActivity.CUDA)
+    options = {"activities": activities, "record_shapes": True, "profile_memory": True}
+    if active_steps:
+        options["schedule"] = schedule(wait=1, warmup=1, active=active_steps, repeat=1)
+        options["on_trace_ready"] = lambda prof: prof.export_chrome_trace(trace_path)
+    with profile(**options) as prof:
+        yield prof
+    if not active_steps:
+        prof.export_chrome_trace(trace_path)
+    print(prof.key_averages().table(sort_by="self_cpu_time_total", row_limit=15), file=sys.stderr)
+    print(f"Profiler trace written to {trace_path}", file=sys.stderr)
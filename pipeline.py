@@ -0,0 +1,351 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from structured_output import DEFAULT_SECTION_TOKENS
+
+LOG_DIR = "logs"
+DEFAULT_INPUT = "examples/long_statements.json"
+
+# Put on a queue when its producer is finished; each consumer puts it back for the next one
+DONE = object()
+
+
+class Tee:
+    """Mirror writes to a stream into a log file, like `2> >(tee -a errors.log >&2)`."""
+
+    def __init__(self, stream, path):
+        self.stream = stream
+        self.log = open(path, "a")
+
+    def write(self, data):
+        self.stream.write(data)
+        self.log.write(data)
+        self.log.flush()
+        return len(data)
+
+    def flush(self):
+        self.stream.flush()
+        self.log.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+class OrderedWriter:
+    """Write one line per item in input order, holding back items that finish early."""
+
+    def __init__(self, path, echo=False):
+        self.file = open(path, "w")
+        self.echo = echo
+        self.pending = {}
+        self.next_index = 0
+
+    def write(self, index, line):
+        # line is None for items that failed, so later items are not held back forever
+        self.pending[index] = line
+        while self.next_index in self.pending:
+            line = self.pending.pop(self.next_index)
+            if line is not None:
+                self.file.write(line + "\n")
+                if self.echo:
+                    print(line, flush=True)
+            self.next_index += 1
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+class Pipeline:
+    """Classification and generation as concurrent stages joined by bounded queues.
+
+    Classifier workers take up to one batch of whatever is queued and run
+    predict_batch in a thread. Each generation worker drives its own
+    GenerationEngine in a thread and pulls classified statements whenever it
+    has a free decode slot. The queues bound how far one stage can run ahead of
+    the next, and results are written in input order.
+    """
+
+    def __init__(self, args, classifier, generator, log_paths):
+        self.args = args
+        self.classifier = classifier
+        self.generator = generator
+        self.modes = [args.mode] if args.mode in ['res', 'rec'] else ['res', 'rec']
+        self.skip_labels = set(args.skip_label)
+        self.classify_queue = asyncio.Queue(args.queue_size)
+        self.generate_queue = asyncio.Queue(args.queue_size)
+        self.timings = {}
+        self.records = {}
+        self.failed = set()
+        self.classifier_log = OrderedWriter(log_paths["classifier"])
+        self.final_log = OrderedWriter(log_paths["final"], echo=True)
+        self.engine_reports = []
+        self.classify_seconds = None
+
+    async def read_input(self):
+        with open(self.args.input) as f:
+            for index, text in enumerate(self.classifier.iter_input_texts(f)):
+                self.timings[index] = {"queued": time.perf_counter()}
+                await self.classify_queue.put((index, text))
+        await self.classify_queue.put(DONE)
+
+    async def classify_worker(self, executor):
+        loop = asyncio.get_running_loop()
+        finished = False
+        while not finished:
+            batch = [await self.classify_queue.get()]
+            while len(batch) < self.args.batch_size and batch[-1] is not DONE and not self.classify_queue.empty():
+                batch.append(self.classify_queue.get_nowait())
+            if batch[-1] is DONE:
+                finished = True
+                batch.pop()
+                await self.classify_queue.put(DONE)
+            if not batch:
+                continue
+
+            start = time.perf_counter()
+            try:
+                predictions = await loop.run_in_executor(
+                    executor, self.classifier.predict_batch, [text for _, text in batch], self.args.batch_size
+                )
+            except Exception as e:
+                print(f"Error classifying batch: {e}", file=sys.stderr)
+                for index, _ in batch:
+                    self.fail(index)
+                continue
+            end = time.perf_counter()
+            for (index, _), prediction in zip(batch, predictions):
+                self.timings[index].update(classify_start=start, classify_end=end)
+                self.classifier_log.write(index, json.dumps(prediction, ensure_ascii=False))
+                await self.generate_queue.put((index, prediction))
+
+    async def poll_generate_queue(self):
+        return None if self.generate_queue.empty() else self.generate_queue.get_nowait()
+
+    def iter_generation_requests(self, engine, loop, running):
+        while True:
+            # Block only while the engine is idle; otherwise let it keep decoding
+            get = self.generate_queue.get() if not engine.active else self.poll_generate_queue()
+            item = asyncio.run_coroutine_threadsafe(get, loop).result()
+            if item is None:
+                yield None
+                continue
+            if item is DONE:
+                asyncio.run_coroutine_threadsafe(self.generate_queue.put(DONE), loop).result()
+                return
+            index, prediction = item
+            self.timings[index]["generate_start"] = time.perf_counter()
+            try:
+                with self.generator.tokenizer_lock:
+                    record = self.generator.prepare_record(prediction, self.modes, self.args.min_confidence, self.skip_labels)
+            except Exception as e:
+                print(f"Error preparing generation: {e}", file=sys.stderr)
+                loop.call_soon_threadsafe(self.fail, index)
+                continue
+            self.records[index] = record
+            running.add(index)
+            if not record["prompts"]:
+                running.discard(index)
+                self.finish(index, loop)
+            # All modes of a statement are submitted back to back so they share a decode batch
+            for mode, segments in record["prompts"].items():
+                params = self.generator.get_generation_params(mode)
+                prompt_length = sum(len(segment) for segment in segments)
+                yield (index, mode), segments, self.generator.with_stopping_criteria(params, mode, prompt_length)
+
+    def generate_worker(self, loop):
+        engine = self.generator.create_engine(
+            max_batch_size=self.args.generation_batch_size,
+            prefix_cache_size=self.args.prefix_cache_size,
+        )
+        # Statements this engine has taken off the queue and not yet finished
+        running = set()
+        while True:
+            try:
+                for (index, mode), generated_ids in engine.run(self.iter_generation_requests(engine, loop, running)):
+                    record = self.records[index]
+                    with self.generator.tokenizer_lock:
+                        self.generator.complete_generation(record, mode, generated_ids)
+                    if len(record["outputs"]) == len(self.modes):
+                        running.discard(index)
+                        self.finish(index, loop)
+                break
+            except Exception as e:
+                print(f"Error generating: {e}", file=sys.stderr)
+                # Fail whatever was decoding and keep draining the queue, so classification is never left blocked
+                engine.reset_batch()
+                for index in running:
+                    self.records.pop(index, None)
+                    loop.call_soon_threadsafe(self.fail, index)
+                running.clear()
+        self.engine_reports.append(engine.report())
+        self.generator.metrics.merge(engine.stats)
+
+    def finish(self, index, loop):
+        result = self.generator.build_result(self.records.pop(index))
+        self.timings[index]["generate_end"] = time.perf_counter()
+        loop.call_soon_threadsafe(self.emit, index, result)
+
+    def emit(self, index, result):
+        self.timings[index]["emitted"] = time.perf_counter()
+        self.final_log.write(index, json.dumps(result, ensure_ascii=False))
+
+    def fail(self, index):
+        self.failed.add(index)
+        self.classifier_log.write(index, None)
+        self.final_log.write(index, None)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(self.args.classify_workers, thread_name_prefix="classify") as classify_executor, \
+                ThreadPoolExecutor(self.args.generate_workers, thread_name_prefix="generate") as generate_executor:
+            generators = [loop.run_in_executor(generate_executor, self.generate_worker, loop)
+                          for _ in range(self.args.generate_workers)]
+            await asyncio.gather(
+                self.read_input(),
+                *[self.classify_worker(classify_executor) for _ in range(self.args.classify_workers)],
+            )
+            self.classify_seconds = time.perf_counter() - start
+            await self.generate_queue.put(DONE)
+            await asyncio.gather(*generators)
+        self.classifier_log.close()
+        self.final_log.close()
+        return time.perf_counter() - start
+
+    def timing_report(self, elapsed):
+        """Return (per-item lines, summary lines) for the timing log."""
+        completed = {index: t for index, t in self.timings.items() if "emitted" in t}
+        item_lines = []
+        for index, t in sorted(completed.items()):
+            item_lines.append(
+                f"item {index}: queue wait {t['classify_start'] - t['queued']:.3f}s, "
+                f"classify {t['classify_end'] - t['classify_start']:.3f}s, "
+                f"generation wait {t['generate_start'] - t['classify_end']:.3f}s, "
+                f"generate {t['generate_end'] - t['generate_start']:.3f}s, "
+                f"end-to-end {t['emitted'] - t['queued']:.3f}s"
+            )
+        stages = {
+            "classify": [t["classify_end"] - t["classify_start"] for t in completed.values()],
+            "generate": [t["generate_end"] - t["generate_start"] for t in completed.values()],
+            "end-to-end": [t["emitted"] - t["queued"] for t in completed.values()],
+        }
+        summary_lines = [f"Classification completed in {self.classify_seconds:.1f} seconds"]
+        for name, values in stages.items():
+            summary_lines.append(f"{name} latency: p50 {percentile(values, 50):.3f}s, p99 {percentile(values, 99):.3f}s")
+        throughput = len(completed) / elapsed if elapsed else 0.0
+        summary_lines.append(f"Processed {len(completed)} statements ({len(self.failed)} failed) in {elapsed:.1f}s "
+                             f"({throughput:.2f} statements/sec)")
+        early_stops = self.generator.early_stop_report()
+        return item_lines, summary_lines + self.engine_reports + ([early_stops] if early_stops else [])
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Classify statements and generate diplomatic output in one process')
+    parser.add_argument('--input', type=str, default=DEFAULT_INPUT,
+                       help='JSON array or JSON Lines file of statements.')
+    parser.add_argument('--mode', type=str, choices=['res', 'rec', 'both'], default='both',
+                       help='What statement_generator.py produces for each statement.')
+    parser.add_argument('--classify-workers', type=int, default=1,
+                       help='Number of concurrent classifier batches.')
+    parser.add_argument('--generate-workers', type=int, default=1,
+                       help='Number of generation engines decoding concurrently.')
+    parser.add_argument('--batch-size', type=int, default=32,
+                       help='Maximum number of statements per classifier batch.')
+    parser.add_argument('--generation-batch-size', type=int, default=8,
+                       help='Maximum number of sequences each generation engine decodes together.')
+    parser.add_argument('--prefix-cache-size', type=int, default=32,
+                       help='Number of prompt-prefix KV caches kept per generation engine.')
+    parser.add_argument('--dtype', type=str, choices=["fp32", "bf16", "int8"], default='fp32',
+                       help='Generator weights: fp32, bf16 or dynamically quantized int8.')
+    parser.add_argument('--draft-model', type=str, default=None, metavar='MODEL',
+                       help='Draft model for speculative decoding; each generation engine then decodes one statement at a time.')
+    parser.add_argument('--draft-tokens', type=int, default=5,
+                       help='Tokens the draft model proposes per verification step, to start with.')
+    parser.add_argument('--section-tokens', type=int, default=DEFAULT_SECTION_TOKENS,
+                       help='Stop a recommendation once one of its sections reaches this many tokens (0: no budget).')
+    parser.add_argument('--no-early-stop', action='store_true',
+                       help='Always generate recommendations up to max_new_tokens or end of text.')
+    parser.add_argument('--queue-size', type=int, default=64,
+                       help='Capacity of each queue between stages; a full queue pauses the stage feeding it.')
+    parser.add_argument('--min-confidence', type=float, default=0.0,
+                       help='Skip generation for statements classified with a lower confidence.')
+    parser.add_argument('--skip-label', action='append', default=[], metavar='LABEL',
+                       help='Skip generation for statements with this label; repeatable.')
+    parser.add_argument('--no-cache', action='store_true',
+                       help='Run both models on every statement instead of reusing cached results.')
+    parser.add_argument('--log-dir', type=str, default=LOG_DIR)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    os.makedirs(args.log_dir, exist_ok=True)
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    log_paths = {
+        "classifier": os.path.join(args.log_dir, f"classifier_{timestamp}.json"),
+        "final": os.path.join(args.log_dir, f"final_{timestamp}.json"),
+        "timing": os.path.join(args.log_dir, f"timing_{timestamp}.txt"),
+        "errors": os.path.join(args.log_dir, f"errors_{timestamp}.log"),
+        "metrics": os.path.join(args.log_dir, f"metrics_{timestamp}.json"),
+    }
+    sys.stderr = Tee(sys.stderr, log_paths["errors"])
+
+    with open(log_paths["timing"], "a") as timing_log:
+        timing_log.write(f"Starting pipeline run at {datetime.now()}\n")
+
+    # Loaded after stderr is mirrored so model initialization messages reach the error log,
+    # and before the stages start so their worker threads never race to load them
+    import classifier
+    import statement_generator
+    from result_cache import ResultCache
+    classifier.load_model()
+    statement_generator.load_generator(dtype=args.dtype)
+    if args.draft_model:
+        statement_generator.load_draft(args.draft_model, args.draft_tokens)
+    statement_generator.early_stopping = not args.no_early_stop
+    statement_generator.section_tokens = args.section_tokens
+
+    if not args.no_cache:
+        cache = ResultCache()
+        classifier.result_cache = cache
+        statement_generator.result_cache = cache
+
+    pipeline = Pipeline(args, classifier, statement_generator, log_paths)
+    elapsed = asyncio.run(pipeline.run())
+
+    item_lines, summary_lines = pipeline.timing_report(elapsed)
+    if not args.no_cache:
+        summary_lines.append(cache.report())
+        cache.close()
+    with open(log_paths["timing"], "a") as timing_log:
+        timing_log.write("\n".join(item_lines + summary_lines) + "\n")
+        timing_log.write(f"Pipeline completed at {datetime.now()}\n")
+        timing_log.write("----------------------------------------\n")
+    with open(log_paths["metrics"], "w") as metrics_log:
+        json.dump([classifier.metrics.snapshot(), statement_generator.metrics.snapshot()], metrics_log, indent=2)
+    for line in summary_lines:
+        print(line, file=sys.stderr)
+
+    print("Run completed. Check logs:", file=sys.stderr)
+    print(f"- Classifier output: {log_paths['classifier']}", file=sys.stderr)
+    print(f"- Final output: {log_paths['final']}", file=sys.stderr)
+    print(f"- Timing information: {log_paths['timing']}", file=sys.stderr)
+    print(f"- Stage metrics: {log_paths['metrics']}", file=sys.stderr)
+    print(f"- Errors log: {log_paths['errors']}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
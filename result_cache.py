@@ -0,0 +1,143 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+
+DEFAULT_CACHE_PATH = "output/cache/results.sqlite"
+
+
+def normalize_text(text):
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def weight_files(source):
+    # Local checkpoints have no commit hash; retraining rewrites the weight files
+    return [
+        (name, os.path.getsize(os.path.join(source, name)), os.path.getmtime(os.path.join(source, name)))
+        for name in sorted(os.listdir(source))
+        if name.endswith((".safetensors", ".bin"))
+    ]
+
+
+def model_identity(model):
+    """Fingerprint a loaded model by its class, source, revision and config."""
+    config = model.config
+    source = config._name_or_path
+    revision = getattr(config, "_commit_hash", None)
+    if os.path.isdir(source):
+        revision = weight_files(source)
+    payload = json.dumps([type(model).__name__, source, revision, config.to_json_string()])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def checkpoint_identity(source):
+    """Fingerprint a checkpoint without loading it, by its name or path and any local weight files."""
+    payload = json.dumps([source, weight_files(source) if os.path.isdir(source) else None])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """Persistent SQLite cache of model outputs, keyed by a hash of everything that determines them.
+
+    Entries are evicted least-recently-used once the cache holds more than
+    max_entries rows or max_bytes of stored values. Hits only record their
+    access time in memory; the times are written with the next put(), every
+    access_batch hits, or on close(), so reads never wait on a commit.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=100000, max_bytes=512 * 1024 * 1024, access_batch=256):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.access_batch = access_batch
+        self.accessed = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS results_last_access ON results (last_access)")
+        self.connection.commit()
+        self.entries, self.total_bytes = self.connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results"
+        ).fetchone()
+
+    @staticmethod
+    def make_key(model_id, text, mode, **parts):
+        payload = json.dumps(
+            {"model": model_id, "text": normalize_text(text), "mode": mode, **parts},
+            sort_keys=True,
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.accessed[key] = time.time()
+            if len(self.accessed) >= self.access_batch:
+                self.write_accesses()
+                self.connection.commit()
+            return json.loads(row[0])
+
+    def write_accesses(self):
+        self.connection.executemany(
+            "UPDATE results SET last_access = ? WHERE key = ?", [(at, key) for key, at in self.accessed.items()]
+        )
+        self.accessed.clear()
+
+    def put(self, key, value):
+        serialized = json.dumps(value, ensure_ascii=False)
+        size = len(serialized.encode("utf-8"))
+        with self.lock:
+            # Eviction below must see recent hits
+            self.write_accesses()
+            previous = self.connection.execute("SELECT size FROM results WHERE key = ?", (key,)).fetchone()
+            self.connection.execute(
+                "INSERT OR REPLACE INTO results (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, serialized, size, time.time()),
+            )
+            if previous is None:
+                self.entries += 1
+            else:
+                self.total_bytes -= previous[0]
+            self.total_bytes += size
+            self.evict()
+            self.connection.commit()
+
+    def evict(self):
+        while self.entries > self.max_entries or (self.total_bytes > self.max_bytes and self.entries > 1):
+            excess = max(1, self.entries - self.max_entries)
+            rows = self.connection.execute(
+                "SELECT key, size FROM results ORDER BY last_access LIMIT ?", (excess,)
+            ).fetchall()
+            self.connection.executemany("DELETE FROM results WHERE key = ?", [(key,) for key, _ in rows])
+            self.entries -= len(rows)
+            self.total_bytes -= sum(size for _, size in rows)
+            self.evictions += len(rows)
+
+    def report(self):
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups else 0.0
+        return (f"Result cache {self.path}: {self.hits} hits, {self.misses} misses ({hit_rate:.0%} hit rate), "
+                f"{self.entries} entries, {self.total_bytes / 1024:.0f} KiB, {self.evictions} evicted")
+
+    def close(self):
+        with self.lock:
+            self.write_accesses()
+            self.connection.commit()
+            self.connection.close()
@@ -0,0 +1,193 @@
+import os
+import sys
+import json
+import gzip
+import time
+import queue
+import threading
+
+FORMATS = ["jsonl", "jsonl.gz", "parquet"]
+EXTENSIONS = {"jsonl": ".txt", "jsonl.gz": ".jsonl.gz", "parquet": ".parquet"}
+# Parquet needs a fixed schema; any other keys of a record are kept as JSON in "extra"
+PARQUET_COLUMNS = ["text", "label", "response", "recommendation", "skipped"]
+
+# Queued by close() to stop the writer thread
+STOP = object()
+
+
+class JsonlSink:
+    def __init__(self, path, compress=False):
+        self.path = path
+        self.raw = open(path, "ab", buffering=1 << 20)
+        self.file = gzip.GzipFile(fileobj=self.raw, mode="ab") if compress else self.raw
+
+    def write(self, records):
+        self.file.write("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records).encode("utf-8"))
+
+    def flush(self, fsync=False):
+        # GzipFile.flush() ends the current deflate block, so everything written so far can be decompressed
+        self.file.flush()
+        if self.file is not self.raw:
+            self.raw.flush()
+        if fsync:
+            os.fsync(self.raw.fileno())
+
+    def size(self):
+        return self.raw.tell()
+
+    def close(self):
+        self.file.close()
+        if self.file is not self.raw:
+            self.raw.close()
+
+
+class ParquetSink:
+    """One row group per batch; the file is only readable once closed, so rotation bounds what a crash can lose."""
+
+    def __init__(self, path):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Parquet output requires pyarrow: pip install pyarrow")
+        self.pa = pa
+        self.path = path
+        self.schema = pa.schema([(name, pa.string()) for name in PARQUET_COLUMNS + ["extra"]])
+        self.raw = open(path, "wb")
+        self.writer = pq.ParquetWriter(self.raw, self.schema, compression="zstd")
+
+    def write(self, records):
+        columns = {name: [record.get(name) for record in records] for name in PARQUET_COLUMNS}
+        columns["extra"] = [
+            json.dumps({key: value for key, value in record.items() if key not in PARQUET_COLUMNS}, ensure_ascii=False)
+            for record in records
+        ]
+        self.writer.write_table(self.pa.table(columns, schema=self.schema))
+
+    def flush(self, fsync=False):
+        self.raw.flush()
+        if fsync:
+            os.fsync(self.raw.fileno())
+
+    def size(self):
+        return self.raw.tell()
+
+    def close(self):
+        self.writer.close()
+        self.raw.close()
+
+
+class ResultWriter:
+    """Append-only output sink that writes result records on a background thread.
+
+    write() only queues a record. The writer thread takes everything queued,
+    writes it as one batch to the current file and optionally echoes it to a
+    stream (dropped if it fails), flushes at most every flush_interval seconds
+    and fsyncs every fsync_interval seconds. A new file is started when the
+    current one reaches max_bytes or has been open for max_seconds. Files are named
+    <prefix>.<ext>, then <prefix>.1.<ext>, <prefix>.2.<ext>, ...
+    """
+
+    def __init__(self, prefix, output_format="jsonl", max_bytes=None, max_seconds=None,
+                 flush_interval=1.0, fsync_interval=5.0, echo=None, queue_size=10000):
+        if output_format not in FORMATS:
+            raise ValueError(f"Unknown output format {output_format!r}; expected one of {FORMATS}")
+        os.makedirs(os.path.dirname(prefix) or ".", exist_ok=True)
+        self.prefix = prefix
+        self.output_format = output_format
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self.echo = echo
+        self.queue = queue.Queue(queue_size)
+        self.paths = []
+        self.sink = None
+        self.opened = None
+        self.error = None
+        self.stats = {"records": 0, "batches": 0, "fsyncs": 0, "write_seconds": 0.0}
+        self.thread = threading.Thread(target=self.run, name="result-writer", daemon=True)
+        self.thread.start()
+
+    def write(self, record):
+        if self.error is not None:
+            raise RuntimeError(f"Result writer failed: {self.error}")
+        self.queue.put(record)
+
+    def open_part(self):
+        part = len(self.paths)
+        path = self.prefix + (f".{part}" if part else "") + EXTENSIONS[self.output_format]
+        if self.output_format == "parquet":
+            self.sink = ParquetSink(path)
+        else:
+            self.sink = JsonlSink(path, compress=self.output_format == "jsonl.gz")
+        self.paths.append(path)
+        self.opened = time.monotonic()
+
+    def rotate_due(self):
+        if self.max_bytes and self.sink.size() >= self.max_bytes:
+            return True
+        return bool(self.max_seconds) and time.monotonic() - self.opened >= self.max_seconds
+
+    def write_batch(self, records):
+        start = time.perf_counter()
+        if self.sink is None:
+            self.open_part()
+        self.sink.write(records)
+        if self.echo is not None:
+            try:
+                self.echo.write("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records))
+                self.echo.flush()
+            except Exception as e:
+                # e.g. the reader of stdout went away; the results file is still complete
+                print(f"Error echoing results, continuing without echo: {e}", file=sys.stderr)
+                self.echo = None
+        self.stats["records"] += len(records)
+        self.stats["batches"] += 1
+        self.stats["write_seconds"] += time.perf_counter() - start
+
+    def run(self):
+        last_flush = last_fsync = time.monotonic()
+        stopping = False
+        while not stopping:
+            try:
+                records = [self.queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                records = []
+            while records and not self.queue.empty():
+                records.append(self.queue.get_nowait())
+            if records and records[-1] is STOP:
+                stopping = True
+                records.pop()
+            try:
+                if records:
+                    self.write_batch(records)
+                if self.sink is None:
+                    continue
+                now = time.monotonic()
+                fsync = stopping or now - last_fsync >= self.fsync_interval
+                if fsync or now - last_flush >= self.flush_interval:
+                    self.sink.flush(fsync=fsync)
+                    last_flush = now
+                    if fsync:
+                        self.stats["fsyncs"] += 1
+                        last_fsync = now
+                if stopping or self.rotate_due():
+                    self.sink.close()
+                    self.sink = None
+            except Exception as e:
+                print(f"Error writing results: {e}", file=sys.stderr)
+                self.error = e
+                return
+
+    def close(self):
+        """Write everything queued so far, fsync and close the current file."""
+        if self.error is None:
+            self.queue.put(STOP)
+        self.thread.join()
+
+    def report(self):
+        stats = self.stats
+        return (f"Wrote {stats['records']} records in {stats['batches']} batches to {len(self.paths)} "
+                f"{self.output_format} file(s) ({stats['write_seconds']:.2f}s writing, {stats['fsyncs']} fsyncs): "
+                f"{', '.join(self.paths) or 'none'}")
@@ -1,165 +1,209 @@
 import sys
 import json
-import torch
 from datetime import datetime
 import argparse
-from transformers import AutoModelForCausalLM, AutoTokenizer
+import ctypes
 import os
+import functools
+import itertools
+import threading
+from collections import deque
+from result_cache import DEFAULT_CACHE_PATH, ResultCache, checkpoint_identity, model_identity
+from embedding_index import DEFAULT_INDEX_DIR, DEFAULT_SIMILARITY_THRESHOLD, EmbeddingIndex, text_vector
+from metrics import Metrics, default_trace_path, profiled
+from result_writer import FORMATS, ResultWriter
+from structured_output import DEFAULT_SECTION_TOKENS
+from label_registry import (
+    DEFAULT_RECOMMENDATION_CONTEXT, DEFAULT_RESPONSE_CONTEXT, RECOMMENDATION_CONTEXTS, RESPONSE_CONTEXTS,
+)
 
 def parse_args():
     parser = argparse.ArgumentParser(description='Generate diplomatic responses or recommendations')
-    parser.add_argument('--mode', type=str, choices=['res', 'rec'], required=False,
-                       help='Mode: "res" for direct response, "rec" for recommendations. If not specified, generates both.')
+    parser.add_argument('--mode', type=str, choices=['res', 'rec', 'both'], required=False,
+                       help='Mode: "res" for direct response, "rec" for recommendations. "both" (the default) generates '
+                            'the two together and writes one record with "response" and "recommendation" keys.')
+    parser.add_argument('--batch-size', type=int, default=8,
+                       help='Maximum number of sequences decoded together.')
+    parser.add_argument('--batching', type=str, choices=['static', 'continuous'], default='continuous',
+                       help='"static" waits for a whole batch to finish; "continuous" refills a slot as soon as its sequence ends.')
+    parser.add_argument('--prefix-cache-size', type=int, default=32,
+                       help='Number of prompt-prefix KV caches kept for reuse (per mode and per label); 0 disables prefix caching.')
+    parser.add_argument('--dtype', type=str, choices=DTYPES, default='fp32',
+                       help='Generator weights: fp32, bf16 (half the memory; fast on CPUs with native bf16) or int8 '
+                            '(Linear layers dynamically quantized, about a third of the fp32 memory).')
+    parser.add_argument('--draft-model', type=str, default=None, metavar='MODEL',
+                       help='Small model sharing the generator\'s tokenizer (e.g. Qwen/Qwen2-0.5B) used for '
+                            'speculative decoding. Statements are then decoded one at a time.')
+    parser.add_argument('--draft-tokens', type=int, default=5,
+                       help='Tokens the draft model proposes per verification step, to start with.')
+    parser.add_argument('--section-tokens', type=int, default=DEFAULT_SECTION_TOKENS,
+                       help='Stop a recommendation once one of its sections reaches this many tokens (0: no budget).')
+    parser.add_argument('--no-early-stop', action='store_true',
+                       help='Always generate recommendations up to max_new_tokens or end of text, as before.')
+    parser.add_argument('--min-confidence', type=float, default=0.0,
+                       help='Skip generation for statements the classifier labelled with a lower "confidence".')
+    parser.add_argument('--skip-label', action='append', default=[], metavar='LABEL',
+                       help='Skip generation for statements with this label (e.g. neutral_statement); repeatable.')
+    parser.add_argument('--index', action='store_true',
+                       help='Reuse the stored output of a near-duplicate statement with the same label.')
+    parser.add_argument('--index-path', type=str, default=os.path.join(DEFAULT_INDEX_DIR, "generator"),
+                       help='Directory the embedding index of generated statements is loaded from and saved to.')
+    parser.add_argument('--similarity-threshold', type=float, default=DEFAULT_SIMILARITY_THRESHOLD,
+                       help='Minimum cosine similarity for a statement to count as a near-duplicate.')
+    parser.add_argument('--cache-path', type=str, default=DEFAULT_CACHE_PATH,
+                       help='SQLite file caching generated content for previously seen statements.')
+    parser.add_argument('--no-cache', action='store_true',
+                       help='Always sample fresh output instead of reusing cached generations.')
+    parser.add_argument('--output-dir', type=str, default='.',
+                       help='Directory the qwen2-1.5b_results_<timestamp> files are written to.')
+    parser.add_argument('--output-format', type=str, choices=FORMATS, default='jsonl',
+                       help='Results file format: JSON Lines (.txt), gzip-compressed JSON Lines or Parquet.')
+    parser.add_argument('--rotate-mb', type=float, default=None,
+                       help='Start a new results file once the current one reaches this size.')
+    parser.add_argument('--rotate-minutes', type=float, default=None,
+                       help='Start a new results file once the current one has been open this long.')
+    parser.add_argument('--fsync-seconds', type=float, default=5.0,
+                       help='How often written results are fsynced to disk.')
+    parser.add_argument('--metrics-json', type=str, default=None, metavar='PATH',
+                       help='Write load, tokenization, prefill and decode timings, tokens generated, batch sizes '
+                            'and peak RSS as JSON ("-" for stderr).')
+    parser.add_argument('--metrics-prometheus', type=str, default=None, metavar='PATH',
+                       help='Write the same metrics in Prometheus text format, e.g. for a node_exporter textfile collector.')
+    parser.add_argument('--profile', nargs='?', const=default_trace_path("statement_generator"), default=None,
+                       metavar='TRACE',
+                       help='Run generation under torch.profiler and write a Chrome trace '
+                            '(default: output/profiles/statement_generator_<timestamp>.json).')
     return parser.parse_args()
 
-# Initialize model and tokenizer
-print("Initializing models...", file=sys.stderr)
-generator_model_name = "Qwen/Qwen2-1.5B"
-generator_tokenizer = AutoTokenizer.from_pretrained(generator_model_name)
-generator_model = AutoModelForCausalLM.from_pretrained(generator_model_name)
+metrics = Metrics("statement_generator")
+# Overridable so benchmarks can run against a small local checkpoint
+generator_model_name = os.environ.get("DIPLOMATE_GENERATOR_MODEL", "Qwen/Qwen2-1.5B")
 
-def get_response_contexts():
-    return {
-        "cooperation": "Foster mutual benefit while maintaining clear operational boundaries.",
-        "negotiation": "Engage in constructive dialogue while preserving core interests.",
-        "alliance_proposal": "Show measured interest in cooperation while preserving independent decision-making.",
-        "threat": "Maintain firm positioning while emphasizing diplomatic solutions.",
-        "intimidation": "Demonstrate unwavering resolve while keeping dialogue channels open.",
-        "compromise": "Acknowledge mutual interests while ensuring balanced concessions.",
-        "peace_offer": "Consider peace initiatives while maintaining prudent deliberation.",
-        "declaration_of_war": "Maintain composure while asserting defensive readiness.",
-        "ceasefire_request": "Address humanitarian concerns while ensuring security parameters.",
-        "trade_proposal": "Evaluate economic opportunities while ensuring mutual benefit.",
-        "intelligence_sharing": "Consider security cooperation while maintaining operational discretion.",
-        "diplomatic_pressure": "Address concerns while maintaining diplomatic dignity.",
-        "sanctions_threat": "Respond to concerns while emphasizing diplomatic alternatives.",
-        "mediation_offer": "Consider third-party facilitation while maintaining sovereignty.",
-        "neutrality_declaration": "Affirm non-intervention while maintaining diplomatic relations.",
-        "territorial_claim": "Assert territorial integrity while remaining open to dialogue.",
-        "diplomatic_protest": "Address grievances while maintaining professional composure.",
-        "apology": "Express appropriate regret while maintaining diplomatic dignity.",
-        "praise_or_commendation": "Acknowledge achievements while maintaining professional distance.",
-        "criticism": "Address concerns while maintaining diplomatic discourse.",
-        "request_for_aid": "Consider assistance needs while following proper protocols.",
-        "offer_of_assistance": "Express support while establishing appropriate frameworks.",
-        "ultimatum": "Maintain resolve while preserving diplomatic options.",
-        "non_aggression_pact": "Consider security assurances while maintaining sovereignty.",
-        "treaty_proposal": "Evaluate cooperative frameworks while ensuring national interests.",
-        "diplomatic_recognition": "Acknowledge diplomatic status while following proper procedures.",
-        "severance_of_relations": "Maintain dignity while following diplomatic protocols.",
-        "espionage_accusation": "Address security concerns while maintaining diplomatic channels.",
-        "denial_of_accusations": "Present position clearly while maintaining professional tone.",
-        "call_for_unity": "Consider collective action while maintaining autonomous decision-making.",
-        "appeal_to_international_law": "Reference legal frameworks while maintaining diplomatic discourse.",
-        "economic_cooperation": "Explore mutual benefits while maintaining regulatory autonomy.",
-        "cultural_exchange": "Promote cultural understanding while following diplomatic protocols.",
-        "military_cooperation": "Consider security collaboration while maintaining operational independence.",
-        "humanitarian_aid_offer": "Coordinate assistance while ensuring proper procedures.",
-        "request_for_mediation": "Consider conflict resolution while maintaining sovereign rights.",
-        "diplomatic_immunity_invocation": "Assert diplomatic privileges while maintaining professional conduct.",
-        "extradition_request": "Process legal matters through appropriate diplomatic channels.",
-        "asylum_offer": "Handle humanitarian matters through established protocols.",
-        "propaganda": "Address information concerns while maintaining diplomatic composure.",
-        "disinformation": "Counter misrepresentation while maintaining professional standards.",
-        "confidence_building_measure": "Foster trust while maintaining appropriate boundaries.",
-        "arms_control_proposal": "Consider security measures while maintaining defense capabilities.",
-        "environmental_cooperation": "Promote ecological collaboration while ensuring sovereign interests.",
-        "technology_transfer": "Facilitate technical exchange within appropriate frameworks.",
-        "diplomatic_demarche": "Convey position firmly while maintaining diplomatic protocol.",
-        "formal_complaint": "Address grievances through proper diplomatic channels.",
-        "request_for_clarification": "Seek information while maintaining professional discourse.",
-        "expression_of_concern": "Voice concerns while maintaining diplomatic engagement.",
-        "congratulatory_message": "Express recognition while maintaining professional tone.",
-        "condolences": "Express sympathy while maintaining diplomatic propriety.",
-        "neutral_statement": "Maintain balanced position while ensuring clear communication.",
-        "procedural_communication": "Follow diplomatic protocols while ensuring clear transmission.",
-        "information_request": "Seek details through appropriate diplomatic channels.",
-        "summit_proposal": "Consider high-level dialogue while maintaining proper preparation.",
-        "arbitration_request": "Consider dispute resolution while following established procedures.",
-        "border_dispute_resolution": "Address territorial matters through diplomatic channels.",
-        "diplomatic_crisis_management": "Handle urgent matters while maintaining diplomatic protocol.",
-        "economic_sanctions_announcement": "Implement measures while maintaining diplomatic channels.",
-        "humanitarian_corridor_request": "Address humanitarian needs while ensuring security protocols.",
-        "peacekeeping_mission_proposal": "Consider stability operations while maintaining sovereignty.",
-        "condemnation": "Express strong disapproval while maintaining diplomatic language."
-    }
+DTYPES = ["fp32", "bf16", "int8"]
+# Set in main() before the generator is loaded
+generator_dtype = "fp32"
 
-def get_recommendation_contexts():
-    return {
-        "cooperation": "Analyze cooperation potential and framework requirements.",
-        "negotiation": "Evaluate negotiation positions and potential compromises.",
-        "alliance_proposal": "Assess strategic implications and commitment requirements.",
-        "threat": "Analyze threat credibility and response options.",
-        "intimidation": "Evaluate power dynamics and strategic responses.",
-        "compromise": "Assess concession balance and strategic implications.",
-        "peace_offer": "Evaluate peace terms and implementation requirements.",
-        "declaration_of_war": "Analyze conflict escalation and diplomatic options.",
-        "ceasefire_request": "Assess security implications and verification needs.",
-        "trade_proposal": "Evaluate economic benefits and regulatory requirements.",
-        "intelligence_sharing": "Assess information value and security protocols.",
-        "diplomatic_pressure": "Analyze leverage points and response strategies.",
-        "sanctions_threat": "Evaluate economic impact and mitigation options.",
-        "mediation_offer": "Assess mediator neutrality and process framework.",
-        "neutrality_declaration": "Evaluate implications and verification measures.",
-        "territorial_claim": "Analyze legal basis and strategic implications.",
-        "diplomatic_protest": "Assess grievance validity and response options.",
-        "apology": "Evaluate appropriate response and future implications.",
-        "praise_or_commendation": "Consider reciprocation and relationship building.",
-        "criticism": "Analyze validity and response strategy.",
-        "request_for_aid": "Assess needs and response capabilities.",
-        "offer_of_assistance": "Evaluate aid implications and coordination needs.",
-        "ultimatum": "Analyze demands and response options.",
-        "non_aggression_pact": "Evaluate security implications and verification needs.",
-        "treaty_proposal": "Assess terms and implementation requirements.",
-        "diplomatic_recognition": "Evaluate implications and procedural requirements.",
-        "severance_of_relations": "Analyze impact and contingency measures.",
-        "espionage_accusation": "Assess evidence and response strategy.",
-        "denial_of_accusations": "Evaluate defense strategy and evidence presentation.",
-        "call_for_unity": "Assess collective action implications.",
-        "appeal_to_international_law": "Evaluate legal basis and precedents.",
-        "economic_cooperation": "Analyze economic benefits and risks.",
-        "cultural_exchange": "Evaluate cultural impact and program requirements.",
-        "military_cooperation": "Assess security benefits and operational protocols.",
-        "humanitarian_aid_offer": "Evaluate aid coordination and distribution.",
-        "request_for_mediation": "Assess mediation framework and requirements.",
-        "diplomatic_immunity_invocation": "Evaluate legal basis and implications.",
-        "extradition_request": "Assess legal requirements and procedures.",
-        "asylum_offer": "Evaluate humanitarian and security implications.",
-        "propaganda": "Analyze messaging impact and response strategy.",
-        "disinformation": "Assess information integrity and counter-measures.",
-        "confidence_building_measure": "Evaluate trust-building potential.",
-        "arms_control_proposal": "Assess verification and compliance measures.",
-        "environmental_cooperation": "Evaluate environmental impact and resources.",
-        "technology_transfer": "Assess technical benefits and security implications.",
-        "diplomatic_demarche": "Evaluate message impact and delivery strategy.",
-        "formal_complaint": "Analyze grievance basis and response options.",
-        "request_for_clarification": "Assess information needs and response strategy.",
-        "expression_of_concern": "Evaluate situation gravity and response options.",
-        "congratulatory_message": "Consider appropriate reciprocation.",
-        "condolences": "Assess appropriate sympathy expression.",
-        "neutral_statement": "Evaluate balance and positioning strategy.",
-        "procedural_communication": "Assess protocol requirements.",
-        "information_request": "Evaluate information sharing parameters.",
-        "summit_proposal": "Assess meeting framework and preparations.",
-        "arbitration_request": "Evaluate dispute resolution process.",
-        "border_dispute_resolution": "Analyze territorial issues and solutions.",
-        "diplomatic_crisis_management": "Assess crisis severity and response options.",
-        "economic_sanctions_announcement": "Evaluate economic impact and duration.",
-        "humanitarian_corridor_request": "Assess security and logistics requirements.",
-        "peacekeeping_mission_proposal": "Evaluate mission scope and requirements.",
-        "condemnation": "Analyze situation severity and response tone."
-    }
+# Set by load_generator(), which runs on first use so --help never waits for torch or the download
+generator_model = None
+generator_tokenizer = None
+generator_model_id = None
+generator_lock = threading.Lock()
+# Held around every use of generator_tokenizer by callers that share it between threads
+tokenizer_lock = threading.Lock()
 
-def get_response_prompt(input_text, input_label):
-    context_prompts = get_response_contexts()
-    context_prompt = context_prompts.get(input_label, "Formulate a balanced diplomatic response appropriate to the situation.")
+# Set by load_draft(); when present, create_engine() returns an AssistedEngine
+draft_model = None
+draft_tokens = 5
 
-    return f"""You are a senior diplomat representing your nation. Generate ONLY the response text.
+# Recommendations stop once their three sections are complete or a section exceeds section_tokens
+early_stopping = True
+section_tokens = DEFAULT_SECTION_TOKENS
 
-CONTEXT: {context_prompt}
+# Set in main(); None means every statement is generated fresh
+result_cache = None
+embedding_index = None
 
-INCOMING MESSAGE: {input_text}
-MESSAGE TYPE: {input_label}
+def quantize_int8(model):
+    """Swap every Linear for a dynamically quantized int8 one, one layer at a time.
+
+    Weights are quantized per output channel. Only the layer being quantized is
+    held in fp32, so a bf16-loaded model never needs a full fp32 copy. The
+    remaining weights (embeddings, norms) are cast to fp32, which the quantized
+    kernels take as input.
+    """
+    import torch
+    from torch.ao.nn.quantized.dynamic import Linear as QuantizedLinear
+    from torch.ao.quantization import per_channel_dynamic_qconfig
+    # Only parents are collected up front, so each fp32 layer is freed as soon as it is replaced
+    parents = [module for module in model.modules() if not isinstance(module, torch.nn.Linear)]
+    for module in parents:
+        for name, child in list(module.named_children()):
+            if isinstance(child, torch.nn.Linear):
+                child.float().qconfig = per_channel_dynamic_qconfig
+                setattr(module, name, QuantizedLinear.from_float(child))
+                del child
+    model = model.float()
+    try:
+        # glibc keeps the freed fp32 layers in its heap; hand them back to the OS
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+    return model
+
+def load_generator(model_name=None, dtype=None):
+    """Load the generator model and tokenizer into this module.
+
+    low_cpu_mem_usage reads the safetensors shards through a memory map instead
+    of first building a randomly initialised copy of the 1.5B-parameter model.
+    Qwen2 checkpoints are stored in bf16, so with bf16 (and int8, which is
+    quantized from bf16) the weights stay backed by the file until touched;
+    fp32 needs an upcast copy.
+    """
+    global generator_model, generator_tokenizer, generator_model_id, generator_dtype
+    model_name = model_name or generator_model_name
+    dtype = dtype or generator_dtype
+    if dtype not in DTYPES:
+        raise ValueError(f"Unknown generator dtype {dtype!r}; expected one of {DTYPES}")
+    print("Initializing models...", file=sys.stderr)
+    with metrics.timer("model_load"):
+        import torch
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+        generator_tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModelForCausalLM.from_pretrained(
+            model_name, low_cpu_mem_usage=True, torch_dtype=torch.float32 if dtype == "fp32" else torch.bfloat16
+        )
+        if dtype == "int8":
+            model = quantize_int8(model)
+    generator_dtype = dtype
+    generator_model_id = model_identity(model)
+    generator_model = model
+    return generator_model, generator_tokenizer
+
+def ensure_generator():
+    if generator_model is None:
+        with generator_lock:
+            if generator_model is None:
+                load_generator()
+
+def load_draft(model_name, num_tokens=5):
+    """Load a draft model for speculative decoding; it must use the generator's vocabulary."""
+    global draft_model, draft_tokens
+    ensure_generator()
+    print(f"Loading draft model {model_name}...", file=sys.stderr)
+    with metrics.timer("draft_model_load"):
+        from transformers import AutoModelForCausalLM
+        model = AutoModelForCausalLM.from_pretrained(model_name, low_cpu_mem_usage=True)
+    if model.config.vocab_size != generator_model.config.vocab_size:
+        raise ValueError(f"Draft model {model_name} has a vocabulary of {model.config.vocab_size} tokens, "
+                         f"the generator {generator_model.config.vocab_size}; they must share a tokenizer")
+    draft_model = model.to(generator_model.device, generator_model.dtype)
+    draft_tokens = num_tokens
+    return draft_model
+
+def create_engine(**options):
+    """A GenerationEngine over the generator model; options are passed to its constructor.
+
+    With a draft model loaded this is an AssistedEngine instead, which decodes
+    one sequence at a time and ignores the batching and prefix-cache options.
+    """
+    ensure_generator()
+    if draft_model is not None:
+        from generation_engine import AssistedEngine
+        return AssistedEngine(generator_model, generator_tokenizer, draft_model, draft_tokens)
+    from generation_engine import GenerationEngine
+    return GenerationEngine(generator_model, generator_tokenizer, **options)
+
+def cache_metrics():
+    if result_cache is None:
+        return {}
+    return {"cache_hits": result_cache.hits, "cache_misses": result_cache.misses}
+
+metrics.register(cache_metrics)
+
+def get_response_prompt(input_text, input_label):
+    context_prompt = RESPONSE_CONTEXTS.get(input_label, DEFAULT_RESPONSE_CONTEXT)
+
+    return f"""You are a senior diplomat representing your nation. Generate ONLY the response text.
 
 STRICT OUTPUT REQUIREMENTS:
 - Provide ONLY the direct diplomatic response
@@ -172,19 +216,18 @@ STRICT OUTPUT REQUIREMENTS:
 - Write in clear, formal diplomatic language
 - Keep response focused and professional
 
+CONTEXT: {context_prompt}
+
+INCOMING MESSAGE: {input_text}
+MESSAGE TYPE: {input_label}
+
 DIPLOMATIC RESPONSE:"""
 
 def get_recommendation_prompt(input_text, input_label):
-    context_prompts = get_recommendation_contexts()
-    context_prompt = context_prompts.get(input_label, "Provide strategic diplomatic guidance appropriate to the situation.")
+    context_prompt = RECOMMENDATION_CONTEXTS.get(input_label, DEFAULT_RECOMMENDATION_CONTEXT)
 
     return f"""You are a senior diplomatic advisor providing strategic guidance. Generate ONLY the recommendations content.
 
-CONTEXT: {context_prompt}
-
-RECEIVED MESSAGE: {input_text}
-MESSAGE TYPE: {input_label}
-
 STRICT OUTPUT REQUIREMENTS:
 - Provide ONLY the numbered recommendations
 - NO meta-commentary or explanations
@@ -223,108 +266,354 @@ Structure your recommendations exactly as follows:
    - Contingency preparations
    - Follow-up protocol
 
+CONTEXT: {context_prompt}
+
+RECEIVED MESSAGE: {input_text}
+MESSAGE TYPE: {input_label}
+
 DIPLOMATIC RECOMMENDATIONS:"""
 
+def build_messages(input_text, input_label, mode):
+    if mode == 'res':
+        prompt = get_response_prompt(input_text, input_label)
+        return [
+            {"role": "system", "content": "You are a senior diplomat crafting an official response."},
+            {"role": "user", "content": prompt}
+        ]
+    prompt = get_recommendation_prompt(input_text, input_label)
+    return [
+        {"role": "system", "content": "You are a senior diplomatic advisor providing strategic guidance."},
+        {"role": "user", "content": prompt}
+    ]
+
+# The fixed instructions come before the per-label context line, which comes before the
+# statement, so prompts for the same mode (and label) share a token prefix whose KV cache
+# the generation engine can reuse
+PROMPT_SEGMENT_MARKERS = {
+    'res': ("CONTEXT: ", "INCOMING MESSAGE:"),
+    'rec': ("CONTEXT: ", "RECEIVED MESSAGE:"),
+}
+
+@functools.lru_cache(maxsize=1024)
+def tokenize_prompt_segment(segment):
+    ensure_generator()
+    return tuple(generator_tokenizer(segment, add_special_tokens=False)["input_ids"])
+
+def encode_prompt_segments(input_text, input_label, mode):
+    """Tokenize a prompt as [mode preamble, label context, statement and what follows] segments.
+
+    The statement is tokenized together with the rest of the prompt, so no
+    token can be split at its end. If the segments still differ from the
+    tokenization of the whole prompt, the whole prompt is one segment.
+    """
+    ensure_generator()
+    prompt = generator_tokenizer.apply_chat_template(
+        build_messages(input_text, input_label, mode),
+        tokenize=False,
+        add_generation_prompt=True
+    )
+    context_marker, message_marker = PROMPT_SEGMENT_MARKERS[mode]
+    context_start = prompt.index(context_marker)
+    statement_start = prompt.index(message_marker, context_start) + len(message_marker)
+    segments = [
+        list(tokenize_prompt_segment(prompt[:context_start])),
+        list(tokenize_prompt_segment(prompt[context_start:statement_start])),
+        generator_tokenizer(prompt[statement_start:], add_special_tokens=False)["input_ids"],
+    ]
+    full_ids = generator_tokenizer(prompt, add_special_tokens=False)["input_ids"]
+    if [token for segment in segments for token in segment] != full_ids:
+        metrics.add("prompt_segment_fallbacks")
+        return [full_ids]
+    return segments
+
+def encode_prompt(input_text, input_label, mode):
+    return [token for segment in encode_prompt_segments(input_text, input_label, mode) for token in segment]
+
+def get_generation_params(mode):
+    return {
+        "max_new_tokens": 500 if mode == 'rec' else 250,
+        "temperature": 0.7 if mode == 'rec' else 0.6,
+        "top_p": 0.85,
+        "do_sample": True,
+        "repetition_penalty": 1.3,
+        "no_repeat_ngram_size": 3,
+    }
+
+OUTPUT_KEYS = {'res': "response", 'rec': "recommendation"}
+
+def extract_content(response, mode):
+    """Clean up the generated text (without the prompt) of one output."""
+    if mode == 'res':
+        return OUTPUT_KEYS[mode], response.split("DIPLOMATIC RESPONSE:")[-1].strip()
+    if early_stopping:
+        from structured_output import trim_recommendations
+        # Drops whatever the last step generated past the third section
+        response = trim_recommendations(response)
+    # The model sometimes restates the marker before its recommendations
+    return OUTPUT_KEYS[mode], response.split("DIPLOMATIC RECOMMENDATIONS:")[-1].strip()
+
+def stopping_settings(mode):
+    if mode != 'rec' or not early_stopping:
+        return {}
+    return {"section_tokens": section_tokens}
+
+def record_early_stop(max_new_tokens):
+    def on_stop(reason, generated_tokens):
+        metrics.add(f"early_stops_{reason}")
+        metrics.add("early_stop_tokens_saved", max_new_tokens - generated_tokens)
+    return on_stop
+
+def with_stopping_criteria(params, mode, prompt_length):
+    """params for one request, with the recommendation stopping criterion attached when early stopping is on."""
+    if not stopping_settings(mode):
+        return params
+    from transformers import StoppingCriteriaList
+    from structured_output import SectionStoppingCriteria
+    metrics.add("recommendation_requests")
+    criteria = SectionStoppingCriteria(generator_tokenizer, prompt_length, section_tokens,
+                                       on_stop=record_early_stop(params["max_new_tokens"]), lock=tokenizer_lock)
+    return {**params, "stopping_criteria": StoppingCriteriaList([criteria])}
+
+def early_stop_report():
+    values = metrics.snapshot()
+    requests = values.get("recommendation_requests", 0)
+    if not requests:
+        return None
+    structure, budget = values.get("early_stops_structure", 0), values.get("early_stops_budget", 0)
+    saved = values.get("early_stop_tokens_saved", 0)
+    return (f"Stopped {structure + budget} of {requests} recommendations early ({structure} complete, "
+            f"{budget} over the section budget), {saved / requests:.1f} tokens per call under max_new_tokens")
+
+def cache_key(input_text, input_label, mode):
+    # The stopping settings change what a recommendation contains, so they are part of the key
+    return ResultCache.make_key(
+        generator_model_id, input_text, mode,
+        label=input_label, params=get_generation_params(mode), stopping=stopping_settings(mode),
+        dtype=generator_dtype
+    )
+
+def index_namespace():
+    """Identify everything a stored output depends on besides its statement and label.
+
+    The generator is identified by its checkpoint rather than the loaded model,
+    so near-duplicates can still be served without loading it.
+    """
+    return ResultCache.make_key(
+        checkpoint_identity(generator_model_name), "", "near_duplicates",
+        dtype=generator_dtype,
+        params={mode: get_generation_params(mode) for mode in OUTPUT_KEYS},
+        stopping={mode: stopping_settings(mode) for mode in OUTPUT_KEYS},
+    )
+
 def generate_diplomatic_content(input_text, input_label, mode):
+    import torch
+    ensure_generator()
+    if result_cache is not None:
+        cached = result_cache.get(cache_key(input_text, input_label, mode))
+        if cached is not None:
+            return OUTPUT_KEYS[mode], cached
     try:
-        if mode == 'res':
-            prompt = get_response_prompt(input_text, input_label)
-            messages = [
-                {"role": "system", "content": "You are a senior diplomat crafting an official response."},
-                {"role": "user", "content": prompt}
-            ]
-        else:
-            prompt = get_recommendation_prompt(input_text, input_label)
-            messages = [
-                {"role": "system", "content": "You are a senior diplomatic advisor providing strategic guidance."},
-                {"role": "user", "content": prompt}
-            ]
-        
-        encoded = generator_tokenizer.apply_chat_template(
-            messages,
-            return_tensors="pt",
-            add_generation_prompt=True,
-            padding=True
-        )
+        with metrics.timer("tokenize"):
+            encoded = torch.tensor([encode_prompt(input_text, input_label, mode)])
+        params = with_stopping_criteria(get_generation_params(mode), mode, encoded.shape[1])
         
         # Create attention mask
         attention_mask = (encoded != generator_tokenizer.pad_token_id).long()
         
-        outputs = generator_model.generate(
-            encoded,
-            attention_mask=attention_mask,
-            max_new_tokens=500 if mode=='rec' else 250,
-            temperature=0.7 if mode=='rec' else 0.6,
-            top_p=0.85,
-            do_sample=True,
-            repetition_penalty=1.3,
-            no_repeat_ngram_size=3,
-            pad_token_id=generator_tokenizer.pad_token_id,
-            eos_token_id=generator_tokenizer.eos_token_id
-        )
-        
-        response = generator_tokenizer.decode(outputs[0], skip_special_tokens=True)
+        # generate() prefills and decodes in one call, so they are timed together here
+        with metrics.timer("generate"):
+            outputs = generator_model.generate(
+                encoded,
+                attention_mask=attention_mask,
+                pad_token_id=generator_tokenizer.pad_token_id,
+                eos_token_id=generator_tokenizer.eos_token_id,
+                assistant_model=draft_model,
+                **params
+            )
+        metrics.add("generated_tokens", outputs.shape[1] - encoded.shape[1])
         
-        if mode == 'res':
-            content = response.split("DIPLOMATIC RESPONSE:")[-1].strip()
-            output_key = "response"
-        else:
-            content = response.split("DIPLOMATIC RECOMMENDATIONS:")[-1].strip()
-            output_key = "recommendation"
-            
-        return output_key, content.strip()
+        with metrics.timer("detokenize"):
+            response = generator_tokenizer.decode(outputs[0, encoded.shape[1]:], skip_special_tokens=True)
+        output_key, content = extract_content(response, mode)
+        if result_cache is not None:
+            result_cache.put(cache_key(input_text, input_label, mode), content)
+        return output_key, content
 
     except Exception as e:
         print(f"Error generating content: {e}", file=sys.stderr)
         return ("response" if mode=='res' else "recommendation"), f"Error in {mode} generation"
 
-def main():
-    args = parse_args()
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    output_file = f"qwen2-1.5b_results_{timestamp}.txt"
-    
-    print(f"Starting generator in {args.mode if args.mode else 'both'} mode(s)...", file=sys.stderr)
-    
-    for line in sys.stdin:
+def skip_reason(input_data, min_confidence, skip_labels):
+    if input_data['label'] in skip_labels:
+        return f"label {input_data['label']}"
+    # Classifier output without a confidence score is never skipped
+    confidence = input_data.get('confidence')
+    if confidence is not None and confidence < min_confidence:
+        return f"confidence {confidence} below {min_confidence}"
+    return None
+
+def prepare_record(input_data, modes, min_confidence=0.0, skip_labels=()):
+    """Resolve what can be answered without the model and tokenize prompts for the rest.
+
+    The returned record holds the classified input, the finished "outputs" and
+    the "prompts" (token segments per mode) that still need generating.
+    """
+    record = {"input": input_data, "prompts": {}, "outputs": {}}
+    metrics.add("statements")
+    reason = skip_reason(input_data, min_confidence, skip_labels)
+    if reason is not None:
+        metrics.add("skipped_statements")
+        record["skipped"] = reason
+        record["outputs"] = {OUTPUT_KEYS[mode]: None for mode in modes}
+        return record
+    if embedding_index is not None:
+        entry, similarity = embedding_index.search(text_vector(input_data['text']))
+        if entry is not None and entry["label"] != input_data['label']:
+            # A paraphrase with a different label needs different content
+            metrics.add("near_duplicate_label_mismatches")
+            entry = None
+        if entry is not None:
+            metrics.add("near_duplicates")
+            record["near_duplicate"] = {"text": entry["text"], "similarity": round(similarity, 4)}
+            record["outputs"].update(
+                (OUTPUT_KEYS[mode], entry["outputs"][OUTPUT_KEYS[mode]])
+                for mode in modes if OUTPUT_KEYS[mode] in entry["outputs"]
+            )
+    # Skipped and near-duplicate statements are resolved without loading the model
+    if len(record["outputs"]) < len(modes):
+        ensure_generator()
+    for mode in modes:
+        if OUTPUT_KEYS[mode] in record["outputs"]:
+            continue
+        if result_cache is not None:
+            cached = result_cache.get(cache_key(input_data['text'], input_data['label'], mode))
+            if cached is not None:
+                record["outputs"][OUTPUT_KEYS[mode]] = cached
+                continue
+        with metrics.timer("tokenize"):
+            record["prompts"][mode] = encode_prompt_segments(input_data['text'], input_data['label'], mode)
+    return record
+
+def complete_generation(record, mode, generated_ids):
+    with metrics.timer("detokenize"):
+        response = generator_tokenizer.decode(generated_ids, skip_special_tokens=True)
+    output_key, content = extract_content(response, mode)
+    record["outputs"][output_key] = content
+    if result_cache is not None:
+        result_cache.put(cache_key(record["input"]['text'], record["input"]['label'], mode), content)
+
+def build_result(record):
+    """Turn a finished record into its output line and index newly generated statements."""
+    result = {
+        "text": record["input"]['text'],
+        "label": record["input"]['label'],
+        **record["outputs"]
+    }
+    if "skipped" in record:
+        result["skipped"] = record["skipped"]
+    if "near_duplicate" in record:
+        result["near_duplicate"] = record["near_duplicate"]
+    elif embedding_index is not None and "skipped" not in record:
+        embedding_index.add(text_vector(record["input"]['text']), {
+            "text": record["input"]['text'],
+            "label": record["input"]['label'],
+            "outputs": record["outputs"],
+        })
+    return result
+
+def iter_generation_requests(lines, modes, records, order, emit_ready, min_confidence=0.0, skip_labels=()):
+    # Parse classified lines lazily so the engine pulls new work only when it has free slots
+    for line_index, line in enumerate(lines):
         try:
-            input_data = json.loads(line.strip())
-            results = []
-            
-            if args.mode in ['res', None]:
-                output_key, response = generate_diplomatic_content(
-                    input_data['text'], 
-                    input_data['label'],
-                    'res'
-                )
-                results.append({
-                    "text": input_data['text'],
-                    "label": input_data['label'],
-                    output_key: response
-                })
-            
-            if args.mode in ['rec', None]:
-                output_key, recommendation = generate_diplomatic_content(
-                    input_data['text'], 
-                    input_data['label'],
-                    'rec'
-                )
-                results.append({
-                    "text": input_data['text'],
-                    "label": input_data['label'],
-                    output_key: recommendation
-                })
-            
-            # Print to terminal and write to file
-            for result in results:
-                result_json = json.dumps(result, ensure_ascii=False)
-                print(result_json)
-                with open(output_file, 'a') as f:
-                    f.write(result_json + '\n')
-            
+            record = prepare_record(json.loads(line.strip()), modes, min_confidence, skip_labels)
         except json.JSONDecodeError as e:
             print(f"Error parsing JSON: {e}", file=sys.stderr)
+            continue
         except Exception as e:
             print(f"Error in main loop: {e}", file=sys.stderr)
+            continue
+        records[line_index] = record
+        order.append(line_index)
+        if not record["prompts"]:
+            emit_ready()
+        # All modes of a line are submitted back to back so they share a decode batch
+        for mode, segments in record["prompts"].items():
+            prompt_length = sum(len(segment) for segment in segments)
+            yield (line_index, mode), segments, with_stopping_criteria(get_generation_params(mode), mode, prompt_length)
+
+def main():
+    global result_cache, embedding_index, early_stopping, section_tokens, generator_dtype
+    args = parse_args()
+    generator_dtype = args.dtype
+    early_stopping, section_tokens = not args.no_early_stop, args.section_tokens
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    # Results go to stdout and the results file from a background thread, so disk I/O never stalls decoding
+    writer = ResultWriter(
+        os.path.join(args.output_dir, f"qwen2-1.5b_results_{timestamp}"),
+        output_format=args.output_format,
+        max_bytes=int(args.rotate_mb * 1024 * 1024) if args.rotate_mb else None,
+        max_seconds=args.rotate_minutes * 60 if args.rotate_minutes else None,
+        fsync_interval=args.fsync_seconds,
+        echo=sys.stdout,
+    )
+    
+    print(f"Starting generator in {args.mode if args.mode else 'both'} mode(s)...", file=sys.stderr)
+
+    if not args.no_cache:
+        result_cache = ResultCache(args.cache_path)
+    if args.index:
+        embedding_index = EmbeddingIndex(args.index_path, args.similarity_threshold,
+                                         namespace=index_namespace())
+
+    modes = [args.mode] if args.mode in ['res', 'rec'] else ['res', 'rec']
+    engine = None
+    records = {}
+    order = deque()
+
+    def emit_ready():
+        # Emit in input order: hold back a line until it and every line before it is complete
+        while order and len(records[order[0]]["outputs"]) == len(modes):
+            writer.write(build_result(records.pop(order.popleft())))
+
+    try:
+        requests = iter_generation_requests(
+            sys.stdin, modes, records, order, emit_ready,
+            min_confidence=args.min_confidence, skip_labels=set(args.skip_label)
+        )
+        # The model is loaded by the first statement that needs generating, so the engine is created after it
+        first = next(requests, None)
+        if first is not None:
+            if args.draft_model:
+                load_draft(args.draft_model, args.draft_tokens)
+            engine = create_engine(
+                max_batch_size=args.batch_size,
+                continuous=args.batching == 'continuous',
+                prefix_cache_size=args.prefix_cache_size
+            )
+            # Prefill/decode time, tokens generated and decode batch sizes are counted by the engine
+            metrics.register(lambda: engine.stats)
+            with profiled(args.profile):
+                for (line_index, mode), generated_ids in engine.run(itertools.chain([first], requests)):
+                    complete_generation(records[line_index], mode, generated_ids)
+                    emit_ready()
+    except Exception as e:
+        print(f"Error in main loop: {e}", file=sys.stderr)
+    finally:
+        writer.close()
+
+    print(writer.report(), file=sys.stderr)
+    if engine is not None:
+        print(engine.report(), file=sys.stderr)
+    early_stops = early_stop_report()
+    if early_stops is not None:
+        print(early_stops, file=sys.stderr)
+    if result_cache is not None:
+        print(result_cache.report(), file=sys.stderr)
+        result_cache.close()
+    if embedding_index is not None:
+        embedding_index.save()
+        print(embedding_index.report(), file=sys.stderr)
+    metrics.write(args.metrics_json, args.metrics_prometheus)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,95 @@
+import re
+import contextlib
+
+# The numbered sections the recommendation prompt asks for, in order
+SECTION_TITLES = ("Initial Response Strategy", "Risk Assessment", "Action Steps")
+RECOMMENDATION_SECTIONS = len(SECTION_TITLES)
+DEFAULT_SECTION_TOKENS = 160
+# A numbered line, possibly wrapped in markdown heading or bold marks: (indent, number, rest of line)
+NUMBERED_LINE = re.compile(r"(\s*)(?:#+\s*)?(?:\*\*)?(\d+)\.(?:\*\*)?\s+(?:\*\*)?(.*)")
+# Prompt lines the model sometimes echoes once it has run out of recommendations
+SKELETON_MARKERS = (
+    "DIPLOMATIC RECOMMENDATIONS:", "CONTEXT:", "RECEIVED MESSAGE:", "MESSAGE TYPE:", "Structure your recommendations",
+)
+
+
+def scan_sections(text, titles=SECTION_TITLES):
+    """Return the last section started in text and the offset where text overruns the structure, or None.
+
+    A section starts at a numbered line carrying its title from the prompt;
+    other numbered lines, such as numbered sub-points, are content. The output
+    overruns once a section title is repeated, a prompt line is echoed after
+    the first section, or the last section is followed by a top-level line
+    numbered past it before any numbered points of its own.
+    """
+    current = 0
+    last_has_points = False
+    offset = 0
+    for line in text.splitlines(keepends=True):
+        match = NUMBERED_LINE.match(line)
+        if match:
+            indent, number, rest = len(match.group(1)), int(match.group(2)), match.group(3)
+            if 1 <= number <= len(titles) and rest.lower().startswith(titles[number - 1].lower()):
+                if number <= current:
+                    return current, offset
+                current = number
+                last_has_points = False
+            elif current == len(titles):
+                if number > len(titles) and indent <= 1 and not last_has_points:
+                    return current, offset
+                last_has_points = True
+        elif current and line.strip().startswith(SKELETON_MARKERS):
+            return current, offset
+        offset += len(line)
+    return current, None
+
+
+def trim_recommendations(text, titles=SECTION_TITLES):
+    _, overrun = scan_sections(text, titles)
+    return text if overrun is None else text[:overrun]
+
+
+class SectionStoppingCriteria:
+    """Ends a recommendation once its sections are complete or one section runs over its token budget.
+
+    Has the interface of a transformers StoppingCriteria, so it works both in
+    generate() and in GenerationEngine, which call it with the prompt plus
+    everything generated so far. on_stop is called once, with the reason
+    ("structure" or "budget") and the number of tokens generated. lock, if
+    given, is held while decoding, for tokenizers shared between threads.
+    """
+
+    def __init__(self, tokenizer, prompt_length, section_tokens=DEFAULT_SECTION_TOKENS,
+                 titles=SECTION_TITLES, on_stop=None, lock=None):
+        self.tokenizer = tokenizer
+        self.lock = lock if lock is not None else contextlib.nullcontext()
+        self.prompt_length = prompt_length
+        self.section_tokens = section_tokens
+        self.titles = titles
+        self.on_stop = on_stop
+        self.section = 0
+        self.section_start = 0
+        self.reason = None
+
+    def check(self, generated):
+        with self.lock:
+            text = self.tokenizer.decode(generated, skip_special_tokens=True)
+        section, overrun = scan_sections(text, self.titles)
+        if overrun is not None:
+            return "structure"
+        if section != self.section:
+            self.section, self.section_start = section, len(generated)
+        # Until a section title is recognised, the output may be all sections under other headings
+        budget = self.section_tokens * (len(self.titles) if section == 0 else 1)
+        if budget and len(generated) - self.section_start >= budget:
+            return "budget"
+        return None
+
+    def __call__(self, input_ids, scores, **kwargs):
+        import torch
+        if self.reason is None:
+            generated = input_ids[0, self.prompt_length:].tolist()
+            self.reason = self.check(generated)
+            if self.reason is not None and self.on_stop is not None:
+                self.on_stop(self.reason, len(generated))
+        return torch.full((input_ids.shape[0],), self.reason is not None, dtype=torch.bool, device=input_ids.device)
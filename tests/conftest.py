@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(scope="session")
+def tiny_generator(tmp_path_factory):
+    """Load the randomly initialised stand-in generator from benchmarks.tiny_generator."""
+    import statement_generator
+    from benchmarks import tiny_generator
+
+    # The stand-in's tokenizer is trained on files read relative to the repository root
+    cwd = os.getcwd()
+    os.chdir(ROOT)
+    try:
+        path = tiny_generator.build(str(tmp_path_factory.mktemp("tiny_generator")))
+    finally:
+        os.chdir(cwd)
+    statement_generator.load_generator(path)
+    return statement_generator
@@ -0,0 +1,72 @@
+import pytest
+from transformers import DistilBertConfig, DistilBertForSequenceClassification, DistilBertTokenizer
+
+import classifier
+from label_registry import LABELS
+
+WORDS = ["we", "will", "not", "accept", "these", "terms", "and", "demand", "talks", "now", "."]
+
+
+@pytest.fixture
+def windows(tmp_path, monkeypatch):
+    vocab = tmp_path / "vocab.txt"
+    vocab.write_text("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + WORDS) + "\n")
+    monkeypatch.setattr(classifier, "tokenizer", DistilBertTokenizer(str(vocab)))
+    monkeypatch.setattr(classifier, "window_tokens", 16)
+    return lambda text: list(classifier.sentence_windows(text))
+
+
+def test_sentence_longer_than_window_is_split_between_words(windows):
+    long_sentence = " ".join(["we will not accept these terms and"] * 6) + " demand talks now."
+    result = windows(long_sentence + " We demand talks now.")
+
+    assert len(result) > 1
+    assert all(len(input_ids) <= 16 for _, input_ids in result)
+    # Every word lands in exactly one window, in order
+    assert " ".join(text for text, _ in result) == long_sentence + " We demand talks now."
+    assert sum(len(input_ids) - 2 for _, input_ids in result) == len(classifier.tokenizer.tokenize(long_sentence)) + 5
+
+
+def test_short_sentences_are_packed_whole(windows):
+    result = windows("We demand talks now. We will not accept these terms. Talks now.")
+
+    assert [text for text, _ in result] == ["We demand talks now. We will not accept these terms.", "Talks now."]
+
+
+@pytest.fixture
+def tiny_classifier(tmp_path, monkeypatch):
+    path = tmp_path / "model"
+    path.mkdir()
+    vocab = tmp_path / "vocab.txt"
+    vocab.write_text("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + WORDS) + "\n")
+    DistilBertTokenizer(str(vocab)).save_pretrained(str(path))
+    config = DistilBertConfig(vocab_size=len(WORDS) + 5, dim=32, hidden_dim=64, n_layers=1, n_heads=2,
+                              num_labels=len(LABELS), id2label=dict(enumerate(LABELS)))
+    DistilBertForSequenceClassification(config).save_pretrained(str(path))
+    for name in ("model", "tokenizer", "classifier_model_id", "result_cache", "embedding_index", "emit_embeddings"):
+        monkeypatch.setattr(classifier, name, getattr(classifier, name))
+    classifier.load_model(str(path), str(path))
+    return classifier
+
+
+def test_near_duplicate_skips_the_model(tiny_classifier, tmp_path, monkeypatch):
+    tiny_classifier.enable_embeddings(emit=False, index_path=str(tmp_path / "index"))
+    [first] = tiny_classifier.predict_batch(["We will not accept these terms and demand talks now."])
+
+    def no_forward(batch):
+        raise AssertionError("a near-duplicate was run through the model")
+
+    monkeypatch.setattr(tiny_classifier, "compute_outputs", no_forward)
+    [second] = tiny_classifier.predict_batch(["We will not accept these terms, and demand talks now!"])
+
+    assert second["label"] == first["label"]
+    assert second["near_duplicate"]["text"] == first["text"]
+    assert "embedding" not in second
+
+
+def test_unrelated_statement_keeps_its_own_prediction(tiny_classifier, tmp_path):
+    tiny_classifier.enable_embeddings(emit=False, index_path=str(tmp_path / "index"))
+    tiny_classifier.predict_batch(["We will not accept these terms and demand talks now."])
+    [result] = tiny_classifier.predict_batch(["These talks."])
+
+    assert "near_duplicate" not in result
@@ -0,0 +1,72 @@
+import json
+import threading
+import http.client
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import classifier
+from classifier_server import ClassifierHandler, LatencyTracker, MicroBatcher
+
+
+def fake_predict_batch(texts, batch_size=None):
+    if "boom" in texts:
+        raise ValueError("cannot classify boom")
+    return [{"text": text, "label": "neutral_statement"} for text in texts]
+
+
+@pytest.fixture
+def batcher(monkeypatch):
+    monkeypatch.setattr(classifier, "predict_batch", fake_predict_batch)
+    # A long wait so concurrent requests are merged into one batch
+    return MicroBatcher(max_batch_size=64, max_wait_ms=200, tracker=LatencyTracker())
+
+
+def test_failing_request_does_not_fail_its_batch(batcher):
+    outcomes = {}
+
+    def submit(name, texts):
+        try:
+            outcomes[name] = batcher.submit(texts)
+        except ValueError as e:
+            outcomes[name] = e
+
+    threads = [threading.Thread(target=submit, args=(name, texts))
+               for name, texts in (("good", ["fine", "also fine"]), ("bad", ["boom"]), ("other", ["ok"]))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert [result["text"] for result in outcomes["good"]] == ["fine", "also fine"]
+    assert [result["text"] for result in outcomes["other"]] == ["ok"]
+    assert isinstance(outcomes["bad"], ValueError)
+
+
+@pytest.fixture
+def server(batcher, monkeypatch):
+    monkeypatch.setattr(ClassifierHandler, "batcher", batcher)
+    monkeypatch.setattr(ClassifierHandler, "tracker", LatencyTracker())
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ClassifierHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def post(server, body, headers):
+    connection = http.client.HTTPConnection(*server.server_address)
+    connection.request("POST", "/classify", body=body, headers=headers)
+    response = connection.getresponse()
+    return response.status, response.read()
+
+
+def test_non_string_elements_are_rejected(server):
+    body = json.dumps(["ok", 5])
+    status, _ = post(server, body, {"Content-Length": str(len(body))})
+    assert status == 400
+
+
+def test_invalid_content_length_is_rejected(server):
+    status, _ = post(server, b"[]", {"Content-Length": "two"})
+    assert status == 400
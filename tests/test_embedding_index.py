@@ -0,0 +1,16 @@
+import os
+
+from embedding_index import INDEX_FILE, EmbeddingIndex
+
+
+def test_save_writes_one_file_that_loads_back(tmp_path):
+    index = EmbeddingIndex(str(tmp_path), namespace="model-a", use_faiss=False)
+    index.add([1.0, 0.0], {"text": "first", "label": "threat"})
+    index.add([0.0, 1.0], {"text": "second", "label": "condolences"})
+    index.save()
+
+    assert os.listdir(tmp_path) == [INDEX_FILE]
+    loaded = EmbeddingIndex(str(tmp_path), namespace="model-a", use_faiss=False)
+    assert loaded.entries == index.entries
+    assert loaded.search([0.0, 2.0])[0] == {"text": "second", "label": "condolences"}
+    assert not EmbeddingIndex(str(tmp_path), namespace="model-b", use_faiss=False).entries
@@ -0,0 +1,90 @@
+import queue
+import threading
+import time
+
+import pytest
+
+from generator_server import GenerationJob, Scheduler, ServiceTracker
+from label_registry import PRIORITIES, label_priority
+
+
+def make_job(job_id, priority=None, deadline=None):
+    return GenerationJob(job_id, {"text": "We demand an answer.", "label": "ultimatum"}, ["res"],
+                         label_priority("ultimatum") if priority is None else priority, deadline)
+
+
+class IdleEngine:
+    """Engine that never pulls a request, so submitted jobs stay queued."""
+
+    active = False
+
+    def __init__(self):
+        self.stopped = threading.Event()
+
+    def run(self, requests):
+        self.stopped.wait()
+        return iter(())
+
+
+@pytest.fixture
+def short_generation(tiny_generator, monkeypatch):
+    get_generation_params = tiny_generator.get_generation_params
+    monkeypatch.setattr(tiny_generator, "get_generation_params",
+                        lambda mode: {**get_generation_params(mode), "max_new_tokens": 8})
+    return tiny_generator
+
+
+def test_scheduler_recovers_after_engine_failure(short_generation, monkeypatch):
+    engine = short_generation.create_engine(max_batch_size=2)
+    step = engine.step
+    failures = []
+
+    def failing_step():
+        finished = step()
+        if not failures:
+            # Fail after the batch holds a KV cache, as an error in the middle of decoding would
+            failures.append(True)
+            raise RuntimeError("injected failure")
+        return finished
+
+    monkeypatch.setattr(engine, "step", failing_step)
+    scheduler = Scheduler(engine, 4, ServiceTracker())
+
+    failed = make_job("failed")
+    scheduler.submit(failed)
+    assert failed.done.wait(60)
+    assert failed.status == "failed"
+
+    recovered = make_job("recovered")
+    scheduler.submit(recovered)
+    assert recovered.done.wait(60)
+    assert recovered.status == "completed"
+    assert isinstance(recovered.result["response"], str)
+
+
+def test_stopped_jobs_free_their_queue_slots():
+    scheduler = Scheduler(IdleEngine(), 2, ServiceTracker())
+    scheduler.submit(make_job("cancelled"))
+    scheduler.submit(make_job("expiring", deadline=time.monotonic() + 0.05))
+    with pytest.raises(queue.Full):
+        scheduler.submit(make_job("rejected"))
+
+    assert scheduler.cancel("cancelled")
+    time.sleep(0.1)
+    scheduler.submit(make_job("admitted"))
+    scheduler.submit(make_job("also admitted"))
+    assert [job.id for job in scheduler.waiting] == ["admitted", "also admitted"]
+    assert scheduler.tracker.snapshot()["requests_expired"] == 1
+
+
+def test_waiting_low_priority_job_overtakes_new_urgent_jobs():
+    scheduler = Scheduler(IdleEngine(), 4, ServiceTracker(), aging_seconds=1.0)
+    low = make_job("low", PRIORITIES["low"])
+    scheduler.submit(low)
+    scheduler.submit(make_job("urgent", PRIORITIES["urgent"]))
+    assert scheduler.take(block=False).id == "urgent"
+
+    # Waiting three aging periods lifts the low-priority job past a fresh urgent one
+    low.submitted -= 3.0
+    scheduler.submit(make_job("newer urgent", PRIORITIES["urgent"]))
+    assert scheduler.take(block=False) is low
@@ -0,0 +1,57 @@
+import argparse
+import asyncio
+import json
+import threading
+import types
+
+import classifier
+from pipeline import Pipeline
+
+STATEMENTS = [f"We demand an answer to note {number} by noon." for number in range(6)]
+
+
+def fake_classifier():
+    predictions = lambda texts, batch_size: [{"text": text, "label": "ultimatum", "confidence": 1.0} for text in texts]
+    return types.SimpleNamespace(iter_input_texts=classifier.iter_input_texts, predict_batch=predictions)
+
+
+def test_pipeline_finishes_after_engine_failure(tiny_generator, monkeypatch, tmp_path):
+    get_generation_params = tiny_generator.get_generation_params
+    monkeypatch.setattr(tiny_generator, "get_generation_params",
+                        lambda mode: {**get_generation_params(mode), "max_new_tokens": 8})
+    create_engine = tiny_generator.create_engine
+
+    def failing_engine(**options):
+        engine = create_engine(**options)
+        step = engine.step
+        failures = []
+
+        def failing_step():
+            finished = step()
+            if not failures:
+                failures.append(True)
+                raise RuntimeError("injected failure")
+            return finished
+
+        engine.step = failing_step
+        return engine
+
+    monkeypatch.setattr(tiny_generator, "create_engine", failing_engine)
+    input_path = tmp_path / "statements.json"
+    input_path.write_text(json.dumps(STATEMENTS))
+    args = argparse.Namespace(input=str(input_path), mode="res", skip_label=[], min_confidence=0.0,
+                              queue_size=1, batch_size=2, classify_workers=1, generate_workers=1,
+                              generation_batch_size=2, prefix_cache_size=0)
+    log_paths = {"classifier": tmp_path / "classifier.json", "final": tmp_path / "final.json"}
+    pipeline = Pipeline(args, fake_classifier(), tiny_generator, log_paths)
+
+    # Run in a thread so a deadlock fails the test instead of hanging it
+    runner = threading.Thread(target=asyncio.run, args=(pipeline.run(),), daemon=True)
+    runner.start()
+    runner.join(120)
+    assert not runner.is_alive()
+
+    results = [json.loads(line) for line in log_paths["final"].read_text().splitlines()]
+    assert pipeline.failed
+    assert len(results) + len(pipeline.failed) == len(STATEMENTS)
+    assert all(isinstance(result["response"], str) for result in results)
@@ -0,0 +1,34 @@
+import sqlite3
+
+from result_cache import ResultCache
+
+
+def last_access(path, key):
+    with sqlite3.connect(path) as connection:
+        return connection.execute("SELECT last_access FROM results WHERE key = ?", (key,)).fetchone()[0]
+
+
+def test_hits_are_written_in_batches(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = ResultCache(path, access_batch=3)
+    for key in "abc":
+        cache.put(key, key)
+    stored = last_access(path, "a")
+
+    assert cache.get("a") == "a"
+    cache.get("b")
+    assert last_access(path, "a") == stored
+    cache.get("c")
+    assert last_access(path, "a") > stored
+
+
+def test_eviction_sees_unwritten_hits(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache.sqlite"), max_entries=2)
+    cache.put("old", 1)
+    cache.put("new", 2)
+    cache.get("old")
+    cache.put("newest", 3)
+
+    assert cache.get("old") == 1
+    assert cache.get("new") is None
+    cache.close()
@@ -0,0 +1,20 @@
+import io
+import json
+
+from result_writer import ResultWriter
+
+
+class ClosedPipe(io.StringIO):
+    def write(self, text):
+        raise BrokenPipeError("stdout closed")
+
+
+def test_echo_failure_keeps_writing_the_file(tmp_path):
+    writer = ResultWriter(str(tmp_path / "results"), echo=ClosedPipe(), flush_interval=0.01)
+    for index in range(3):
+        writer.write({"text": f"statement {index}"})
+    writer.close()
+
+    assert writer.error is None
+    with open(writer.paths[0]) as f:
+        assert [json.loads(line)["text"] for line in f] == ["statement 0", "statement 1", "statement 2"]
@@ -0,0 +1,64 @@
+import pytest
+
+from embedding_index import EmbeddingIndex, text_vector
+
+STORED = {"text": "We congratulate you on your election victory.", "label": "congratulatory_message",
+          "outputs": {"response": "Thank you.", "recommendation": "Reply warmly."}}
+
+
+@pytest.fixture
+def index(tiny_generator, tmp_path, monkeypatch):
+    index = EmbeddingIndex(str(tmp_path / "index"), namespace=tiny_generator.index_namespace())
+    index.add(text_vector(STORED["text"]), STORED)
+    monkeypatch.setattr(tiny_generator, "embedding_index", index)
+    return index
+
+
+def test_near_duplicate_with_same_label_is_reused(tiny_generator, index):
+    record = tiny_generator.prepare_record(
+        {"text": "We congratulate you on your election victory!", "label": "congratulatory_message"}, ["res"])
+
+    assert record["outputs"] == {"response": "Thank you."}
+    assert record["prompts"] == {}
+
+
+def test_near_duplicate_with_other_label_is_generated(tiny_generator, index):
+    record = tiny_generator.prepare_record(
+        {"text": "We congratulate you on your election victory!", "label": "threat"}, ["res"])
+
+    assert "near_duplicate" not in record
+    assert list(record["prompts"]) == ["res"]
+
+
+def test_index_from_other_settings_is_ignored(tiny_generator, index, monkeypatch):
+    index.save()
+    assert len(EmbeddingIndex(index.path, namespace=tiny_generator.index_namespace()).entries) == 1
+    monkeypatch.setattr(tiny_generator, "generator_dtype", "int8")
+    assert not EmbeddingIndex(index.path, namespace=tiny_generator.index_namespace()).entries
+    monkeypatch.setattr(tiny_generator, "generator_dtype", "fp32")
+    monkeypatch.setattr(tiny_generator, "section_tokens", 80)
+    assert not EmbeddingIndex(index.path, namespace=tiny_generator.index_namespace()).entries
+
+
+def full_prompt_ids(generator, text, label, mode):
+    prompt = generator.generator_tokenizer.apply_chat_template(
+        generator.build_messages(text, label, mode), tokenize=False, add_generation_prompt=True)
+    return generator.generator_tokenizer(prompt, add_special_tokens=False)["input_ids"]
+
+
+@pytest.mark.parametrize("text", ["We demand an answer.", "Is this war?!", "Reply by noon...", "Respond\n", "End  "])
+@pytest.mark.parametrize("mode", ["res", "rec"])
+def test_prompt_segments_match_full_prompt(tiny_generator, text, mode):
+    segments = tiny_generator.encode_prompt_segments(text, "ultimatum", mode)
+
+    assert len(segments) == 3
+    assert [token for segment in segments for token in segment] == full_prompt_ids(tiny_generator, text, "ultimatum", mode)
+
+
+def test_prompt_segments_fall_back_to_full_prompt(tiny_generator, monkeypatch):
+    # Stands in for a tokenizer that merges tokens across a segment boundary
+    monkeypatch.setattr(tiny_generator, "tokenize_prompt_segment", lambda segment: (0,))
+
+    segments = tiny_generator.encode_prompt_segments("We demand an answer.", "ultimatum", "res")
+
+    assert segments == [full_prompt_ids(tiny_generator, "We demand an answer.", "ultimatum", "res")]
@@ -0,0 +1,54 @@
+from structured_output import SectionStoppingCriteria, scan_sections, trim_recommendations
+
+COMPLETE = (
+    " 1. Initial Response Strategy\n   - Core message\n"
+    "2. Risk Assessment\n   - Escalation triggers\n"
+    "3. Action Steps\n   - Immediate measures\n"
+)
+
+
+def test_numbered_sub_points_are_kept():
+    text = " 1. Initial Response Strategy\n 1. Core message and positioning\n 2. Tone calibration\n"
+    assert scan_sections(text) == (1, None)
+    assert trim_recommendations(text) == text
+
+
+def test_last_section_with_numbered_points_is_kept():
+    text = (" 1. Initial Response Strategy\n   - Core message\n2. Risk Assessment\n   - Triggers\n"
+            "3. Action Steps\n1. Open channels\n2. Brief allies\n3. Set milestones\n4. Verify compliance\n")
+    assert scan_sections(text) == (3, None)
+    assert trim_recommendations(text) == text
+
+
+def test_fourth_section_after_the_last_is_trimmed():
+    assert trim_recommendations(COMPLETE + "4. Additional Considerations\n   - More\n") == COMPLETE
+
+
+def test_repeated_section_title_is_trimmed():
+    assert trim_recommendations(COMPLETE + "1. Initial Response Strategy\n   - Again\n") == COMPLETE
+
+
+def test_echoed_prompt_is_trimmed():
+    assert trim_recommendations(COMPLETE + "RECEIVED MESSAGE: We demand an answer.\n") == COMPLETE
+
+
+def test_markdown_section_headers_are_recognised():
+    assert scan_sections("**1. Initial Response Strategy**\n- Core message\n### 2. Risk Assessment\n") == (2, None)
+
+
+class CharacterTokenizer:
+    def decode(self, ids, skip_special_tokens=True):
+        return "".join(map(chr, ids))
+
+
+def test_budget_counts_from_each_recognised_section():
+    criteria = SectionStoppingCriteria(CharacterTokenizer(), 0, section_tokens=50)
+    header = list(map(ord, " 1. Initial Response Strategy\n"))
+    # Called after every step, so the section starts counting when its header is first seen
+    assert criteria.check(header) is None
+    assert criteria.check(header + [ord("x")] * 40) is None
+    assert criteria.check(header + [ord("x")] * 60) == "budget"
+    # Without recognised sections the whole structure's budget applies
+    fresh = SectionStoppingCriteria(CharacterTokenizer(), 0, section_tokens=50)
+    assert fresh.check([ord("x")] * 100) is None
+    assert fresh.check([ord("x")] * 150) == "budget"
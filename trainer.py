@@ -1,111 +1,86 @@
-import pandas as pd
 import torch
 import numpy as np
-from sklearn.model_selection import train_test_split
 from sklearn.metrics import accuracy_score, precision_recall_fscore_support
-from transformers import DistilBertTokenizer, DistilBertForSequenceClassification, Trainer, TrainingArguments
-from datasets import Dataset
+from transformers import DistilBertTokenizerFast, DistilBertForSequenceClassification, Trainer, TrainingArguments, DataCollatorWithPadding, TrainerCallback
+from datasets import ClassLabel, DatasetDict, Features, Value, load_dataset
 from tqdm import tqdm
 import os
+import time
+import json
+import hashlib
+import argparse
+from label_registry import LABELS, check_model_labels, config_label_kwargs, id_to_label
+from metrics import Metrics, default_trace_path, profiled
 
-# Set device
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-print(f"Using device: {device}")
+DATA_PATH = 'input/diplomacy_data_full.csv'
+TOKENIZED_CACHE_DIR = 'output/tokenized_cache'
+DATASETS_CACHE_DIR = 'output/datasets_cache'
+MAX_LENGTH = 128
+PROFILES = ["default", "throughput"]
+# Training steps recorded by --trace, after one skipped and one warm-up step
+TRACE_STEPS = 5
 
-# Load the existing data
+metrics = Metrics("trainer")
+
+dataset_features = Features({
+    "text": Value("string"),
+    "label": ClassLabel(names=list(LABELS)),
+})
+
+# Load the existing data; the CSV is converted in chunks into a memory-mapped Arrow cache
+# and label names are encoded to ids on the way in, so memory stays flat as the file grows
 def load_data(file_path):
-    return pd.read_csv(file_path)
-
-# Prepare the data
-data = load_data('input/diplomacy_data_full.csv')
-train_data, test_data = train_test_split(data, test_size=0.2, random_state=42)
-
-# Convert to Dataset objects
-train_dataset = Dataset.from_pandas(train_data)
-test_dataset = Dataset.from_pandas(test_data)
-
-# Load tokenizer and model
-model_name = "distilbert-base-uncased"
-tokenizer = DistilBertTokenizer.from_pretrained(model_name)
-model = DistilBertForSequenceClassification.from_pretrained(model_name, num_labels=62).to(device)
-
-# Create label to id mapping
-label_to_id = {
-    "cooperation": 0,
-    "negotiation": 1,
-    "alliance_proposal": 2,
-    "threat": 3,
-    "intimidation": 4,
-    "compromise": 5,
-    "peace_offer": 6,
-    "declaration_of_war": 7,
-    "ceasefire_request": 8,
-    "trade_proposal": 9,
-    "intelligence_sharing": 10,
-    "diplomatic_pressure": 11,
-    "sanctions_threat": 12,
-    "mediation_offer": 13,
-    "neutrality_declaration": 14,
-    "territorial_claim": 15,
-    "diplomatic_protest": 16,
-    "apology": 17,
-    "praise_or_commendation": 18,
-    "criticism": 19,
-    "request_for_aid": 20,
-    "offer_of_assistance": 21,
-    "ultimatum": 22,
-    "non_aggression_pact": 23,
-    "treaty_proposal": 24,
-    "diplomatic_recognition": 25,
-    "severance_of_relations": 26,
-    "espionage_accusation": 27,
-    "denial_of_accusations": 28,
-    "call_for_unity": 29,
-    "appeal_to_international_law": 30,
-    "economic_cooperation": 31,
-    "cultural_exchange": 32,
-    "military_cooperation": 33,
-    "humanitarian_aid_offer": 34,
-    "request_for_mediation": 35,
-    "diplomatic_immunity_invocation": 36,
-    "extradition_request": 37,
-    "asylum_offer": 38,
-    "propaganda": 39,
-    "disinformation": 40,
-    "confidence_building_measure": 41,
-    "arms_control_proposal": 42,
-    "environmental_cooperation": 43,
-    "technology_transfer": 44,
-    "diplomatic_demarche": 45,
-    "formal_complaint": 46,
-    "request_for_clarification": 47,
-    "expression_of_concern": 48,
-    "congratulatory_message": 49,
-    "condolences": 50,
-    "neutral_statement": 51,
-    "procedural_communication": 52,
-    "information_request": 53,
-    "summit_proposal": 54,
-    "arbitration_request": 55,
-    "border_dispute_resolution": 56,
-    "diplomatic_crisis_management": 57,
-    "economic_sanctions_announcement": 58,
-    "humanitarian_corridor_request": 59,
-    "peacekeeping_mission_proposal": 60,
-    "condemnation": 61,
-}
-
-id_to_label = {v: k for k, v in label_to_id.items()}
-
-# Tokenize function
-def tokenize_and_encode_labels(examples):
-    tokenized = tokenizer(examples["text"], padding="max_length", truncation=True, max_length=128)
-    tokenized["label"] = [label_to_id[label] for label in examples["label"]]
-    return tokenized
+    return load_dataset("csv", data_files=file_path, split="train", features=dataset_features, cache_dir=DATASETS_CACHE_DIR)
+
+# Prepare the data; only the label column is read into memory to stratify the split
+def split_data(data):
+    return data.train_test_split(test_size=0.2, seed=42, stratify_by_column="label")
+
+def load_held_out_split(file_path=DATA_PATH):
+    """Return the evaluation split that training holds out, so other tools can score against it."""
+    return split_data(load_data(file_path))["test"]
+
+# Tokenize function; padding is left to the data collator so each batch is only as long as its longest example
+def tokenize_texts(examples, tokenizer):
+    return tokenizer(examples["text"], truncation=True, max_length=MAX_LENGTH)
 
-# Apply tokenization
-tokenized_train = train_dataset.map(tokenize_and_encode_labels, batched=True, remove_columns=train_dataset.column_names)
-tokenized_test = test_dataset.map(tokenize_and_encode_labels, batched=True, remove_columns=test_dataset.column_names)
+def file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def tokenized_cache_path(file_path, tokenizer):
+    # Any change to the CSV, the tokenizer or the truncation length invalidates the cache
+    key = json.dumps({
+        "data": file_sha256(file_path),
+        "tokenizer": tokenizer.name_or_path,
+        "tokenizer_class": type(tokenizer).__name__,
+        "vocab_size": tokenizer.vocab_size,
+        "lowercase": tokenizer.init_kwargs.get("do_lower_case"),
+        "max_length": MAX_LENGTH,
+        "split": "stratified",
+    }, sort_keys=True)
+    return os.path.join(TOKENIZED_CACHE_DIR, hashlib.sha256(key.encode('utf-8')).hexdigest()[:16])
+
+def load_tokenized_datasets(file_path, tokenizer, num_proc):
+    cache_path = tokenized_cache_path(file_path, tokenizer)
+    if os.path.exists(cache_path):
+        print(f"Loading tokenized dataset from cache: {cache_path}")
+        return DatasetDict.load_from_disk(cache_path)
+
+    datasets = split_data(load_data(file_path))
+    tokenized = datasets.map(
+        tokenize_texts,
+        batched=True,
+        num_proc=num_proc,
+        remove_columns=["text"],
+        fn_kwargs={"tokenizer": tokenizer},
+    )
+    tokenized.save_to_disk(cache_path)
+    print(f"Tokenized dataset cached at: {cache_path}")
+    return tokenized
 
 # Custom metrics function
 def compute_metrics(eval_pred):
@@ -120,58 +95,107 @@ def compute_metrics(eval_pred):
         'recall': recall
     }
 
-# Set up training arguments
-output_dir = 'output/results'
-training_args = TrainingArguments(
-    output_dir=output_dir,
-    num_train_epochs=5,
-    per_device_train_batch_size=32,
-    per_device_eval_batch_size=64,
-    warmup_steps=500,
-    weight_decay=0.01,
-    logging_dir='output/logs',
-    logging_steps=100,
-    evaluation_strategy="steps",
-    eval_steps=500,
-    save_strategy="steps",
-    save_steps=500,
-    save_total_limit=2,
-    load_best_model_at_end=True,
-    metric_for_best_model="f1",
-    report_to="tensorboard",
-)
-
-# Initialize Trainer
-trainer = Trainer(
-    model=model,
-    args=training_args,
-    train_dataset=tokenized_train,
-    eval_dataset=tokenized_test,
-    compute_metrics=compute_metrics,
-)
-
-# Train the model
-print("Starting model training...")
-trainer.train()
-print("Model training completed.")
-
-# Evaluate the model
-print("Evaluating the model...")
-eval_results = trainer.evaluate()
-print(f"Evaluation results: {eval_results}")
-
-# Find the latest checkpoint
-checkpoints = [dir for dir in os.listdir(output_dir) if dir.startswith('checkpoint-')]
-latest_checkpoint = max(checkpoints, key=lambda x: int(x.split('-')[1]))
-latest_checkpoint_path = os.path.join(output_dir, latest_checkpoint)
-
-print(f"Latest checkpoint: {latest_checkpoint_path}")
-
-# Load the best model
-best_model = DistilBertForSequenceClassification.from_pretrained(latest_checkpoint_path).to(device)
+class EpochTimer(TrainerCallback):
+    """Records wall-clock time and training samples/sec for every epoch."""
+
+    def __init__(self, samples_per_epoch):
+        self.samples_per_epoch = samples_per_epoch
+        self.epochs = []
+        self.start = None
+
+    def on_epoch_begin(self, args, state, control, **kwargs):
+        self.start = time.perf_counter()
+
+    def on_epoch_end(self, args, state, control, **kwargs):
+        # Includes any evaluation that ran during the epoch
+        seconds = time.perf_counter() - self.start
+        self.epochs.append({
+            "epoch": len(self.epochs) + 1,
+            "seconds": seconds,
+            "samples_per_second": self.samples_per_epoch / seconds if seconds else 0.0,
+        })
+        print(f"Epoch {len(self.epochs)}: {seconds:.1f}s ({self.epochs[-1]['samples_per_second']:.1f} samples/sec)")
+
+class ProfilerStep(TrainerCallback):
+    """Advances a torch.profiler schedule once per optimizer step."""
+
+    def __init__(self, profiler):
+        self.profiler = profiler
+
+    def on_step_end(self, args, state, control, **kwargs):
+        self.profiler.step()
+
+def bf16_supported(device):
+    if device.type == "cuda":
+        return torch.cuda.is_bf16_supported()
+    # CPU autocast is only fast with native bf16 instructions (AVX512-BF16 / AMX)
+    try:
+        return torch.ops.mkldnn._is_mkldnn_bf16_supported()
+    except (AttributeError, RuntimeError):
+        return False
+
+def torch_compile_supported():
+    # transformers' compiled forward relies on torch.compiler.is_compiling (torch>=2.3)
+    return hasattr(torch, "compile") and hasattr(getattr(torch, "compiler", None), "is_compiling")
+
+def profile_training_arguments(profile, device):
+    """Extra TrainingArguments for the selected profile."""
+    if profile != "throughput":
+        return {}
+    return {
+        # Batch statements of similar length together so dynamic padding stays short
+        "group_by_length": True,
+        "bf16": bf16_supported(device),
+        "torch_compile": torch_compile_supported(),
+        "dataloader_num_workers": min(4, os.cpu_count() or 1),
+        "dataloader_pin_memory": device.type == "cuda",
+        "dataloader_persistent_workers": True,
+    }
+
+def add_length_column(dataset):
+    # Precomputed lengths spare the length-grouped sampler a full pass over input_ids
+    return dataset.add_column("length", [len(ids) for ids in dataset["input_ids"]])
+
+def collect_logits(model, dataset, tokenizer, device, batch_size=64):
+    loader = torch.utils.data.DataLoader(dataset, batch_size=batch_size, collate_fn=DataCollatorWithPadding(tokenizer))
+    model.eval()
+    all_logits, all_labels = [], []
+    with torch.no_grad():
+        for batch in loader:
+            labels = batch.pop("labels")
+            batch = {k: v.to(device) for k, v in batch.items()}
+            all_logits.append(model(**batch).logits.float().cpu())
+            all_labels.append(labels)
+    return torch.cat(all_logits), torch.cat(all_labels)
+
+def fit_temperature(logits, labels, max_iter=100):
+    """Fit a single softmax temperature by minimising negative log-likelihood on held-out logits."""
+    # Optimise log(T) so the temperature stays positive
+    log_temperature = torch.zeros(1, requires_grad=True)
+    optimizer = torch.optim.LBFGS([log_temperature], lr=0.1, max_iter=max_iter)
+
+    def closure():
+        optimizer.zero_grad()
+        loss = torch.nn.functional.cross_entropy(logits / log_temperature.exp(), labels)
+        loss.backward()
+        return loss
+
+    optimizer.step(closure)
+    return log_temperature.exp().item()
+
+def calibrate(model, dataset, tokenizer, device, output_dir):
+    logits, labels = collect_logits(model, dataset, tokenizer, device)
+    temperature = fit_temperature(logits, labels)
+    nll_before = torch.nn.functional.cross_entropy(logits, labels).item()
+    nll_after = torch.nn.functional.cross_entropy(logits / temperature, labels).item()
+    calibration = {"temperature": temperature, "eval_nll": nll_before, "calibrated_eval_nll": nll_after}
+    with open(os.path.join(output_dir, "calibration.json"), "w") as f:
+        json.dump(calibration, f, indent=2)
+    print(f"Calibrated softmax temperature {temperature:.3f}: eval NLL {nll_before:.4f} -> {nll_after:.4f}")
+    return calibration
 
 # Function to classify new text
-def classify_text(text, model):
+def classify_text(text, model, tokenizer, device):
     inputs = tokenizer(text, return_tensors="pt", truncation=True, padding=True)
     inputs = {k: v.to(device) for k, v in inputs.items()}
     model.eval()
@@ -181,33 +205,154 @@ def classify_text(text, model):
         prediction = torch.argmax(logits, dim=-1)
     return id_to_label[prediction.item()]
 
-# Example usage
-try:
-    new_text = "We propose a comprehensive trade agreement to strengthen our economic ties."
-    result = classify_text(new_text, best_model)
-    print(f"The text '{new_text}' is classified as: {result}")
-except Exception as e:
-    print(f"An error occurred during classification: {e}")
-
-# Save the best model and tokenizer to the model directory
-final_output_dir = "output/diplomatic_text_classifier_model"
-best_model.save_pretrained(final_output_dir)
-tokenizer.save_pretrained(final_output_dir)
-
-print(f"\nBest model and tokenizer saved to: {final_output_dir}")
-print("\nYou can load the model and tokenizer later with:")
-print(f"model = DistilBertForSequenceClassification.from_pretrained('{final_output_dir}')")
-print(f"tokenizer = DistilBertTokenizer.from_pretrained('{final_output_dir}')")
-
-# Verify saved files
-print("\nSaved files:")
-if os.path.exists(final_output_dir):
-    print(f"\nContents of {final_output_dir}:")
-    for file in os.listdir(final_output_dir):
-        print(f" - {file}")
-else:
-    print(f"\n{final_output_dir} does not exist.")
-
-print("\nTo view training progress and metrics in TensorBoard, run:")
-print("tensorboard --logdir output/logs")
-print("Then open the provided URL in your web browser.")
\ No newline at end of file
+def parse_args():
+    parser = argparse.ArgumentParser(description='Fine-tune DistilBERT on labelled diplomatic statements')
+    parser.add_argument('--num-proc', type=int, default=os.cpu_count(),
+                       help='Number of processes used to tokenize the dataset.')
+    parser.add_argument('--profile', type=str, choices=PROFILES, default="default",
+                       help='Training profile; throughput enables length-grouped batches, bf16 where the hardware '
+                            'supports it, torch.compile and parallel data loading.')
+    parser.add_argument('--metrics-json', type=str, default=None, metavar='PATH',
+                       help='Write load, tokenization, training and evaluation timings, batch size and peak RSS '
+                            'as JSON ("-" for stderr).')
+    parser.add_argument('--metrics-prometheus', type=str, default=None, metavar='PATH',
+                       help='Write the same metrics in Prometheus text format.')
+    parser.add_argument('--trace', nargs='?', const=default_trace_path("trainer"), default=None, metavar='TRACE',
+                       help=f'Record {TRACE_STEPS} training steps with torch.profiler and write a Chrome trace '
+                            '(default: output/profiles/trainer_<timestamp>.json).')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+
+    # Set device
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    print(f"Using device: {device}")
+
+    # Load tokenizer and model
+    model_name = "distilbert-base-uncased"
+    with metrics.timer("model_load"):
+        tokenizer = DistilBertTokenizerFast.from_pretrained(model_name)
+        # id2label/label2id from the registry are written into the saved config.json
+        model = DistilBertForSequenceClassification.from_pretrained(model_name, **config_label_kwargs()).to(device)
+
+    # Apply tokenization, or reuse the cached result for this CSV and tokenizer
+    with metrics.timer("tokenize"):
+        tokenized = load_tokenized_datasets(DATA_PATH, tokenizer, args.num_proc)
+    tokenized_train = tokenized["train"]
+    tokenized_test = tokenized["test"]
+    profile_args = profile_training_arguments(args.profile, device)
+    if profile_args.get("group_by_length"):
+        tokenized_train = add_length_column(tokenized_train)
+    print(f"Training profile: {args.profile} {profile_args}")
+
+    # Set up training arguments
+    output_dir = 'output/results'
+    training_args = TrainingArguments(
+        output_dir=output_dir,
+        num_train_epochs=5,
+        per_device_train_batch_size=32,
+        per_device_eval_batch_size=64,
+        warmup_steps=500,
+        weight_decay=0.01,
+        logging_dir='output/logs',
+        logging_steps=100,
+        evaluation_strategy="steps",
+        eval_steps=500,
+        save_strategy="steps",
+        save_steps=500,
+        save_total_limit=2,
+        load_best_model_at_end=True,
+        metric_for_best_model="f1",
+        report_to="tensorboard",
+        **profile_args,
+    )
+    epoch_timer = EpochTimer(len(tokenized_train))
+
+    # Initialize Trainer
+    trainer = Trainer(
+        model=model,
+        args=training_args,
+        train_dataset=tokenized_train,
+        eval_dataset=tokenized_test,
+        data_collator=DataCollatorWithPadding(tokenizer),
+        compute_metrics=compute_metrics,
+        callbacks=[epoch_timer],
+    )
+
+    # Train the model
+    print("Starting model training...")
+    with profiled(args.trace, active_steps=TRACE_STEPS) as profiler:
+        if profiler is not None:
+            trainer.add_callback(ProfilerStep(profiler))
+        with metrics.timer("train"):
+            train_result = trainer.train()
+    print("Model training completed.")
+    print(f"Training throughput: {train_result.metrics['train_samples_per_second']:.1f} samples/sec "
+          f"over {train_result.metrics['train_runtime']:.1f}s")
+
+    # Evaluate the model
+    print("Evaluating the model...")
+    with metrics.timer("evaluate"):
+        eval_results = trainer.evaluate()
+    print(f"Evaluation results: {eval_results}")
+    print(f"Profile {args.profile}: accuracy {eval_results['eval_accuracy']:.4f}, f1 {eval_results['eval_f1']:.4f}, "
+          f"{train_result.metrics['train_samples_per_second']:.1f} samples/sec")
+    for epoch in epoch_timer.epochs:
+        print(f" - epoch {epoch['epoch']}: {epoch['seconds']:.1f}s, {epoch['samples_per_second']:.1f} samples/sec")
+    metrics.set("train_samples", len(tokenized_train))
+    metrics.set("train_batch_size", training_args.train_batch_size)
+    metrics.set("train_steps", train_result.global_step)
+    metrics.set("train_samples_per_second", train_result.metrics["train_samples_per_second"])
+    metrics.set("eval_accuracy", eval_results["eval_accuracy"])
+    metrics.set("eval_f1", eval_results["eval_f1"])
+
+    # Find the latest checkpoint
+    checkpoints = [dir for dir in os.listdir(output_dir) if dir.startswith('checkpoint-')]
+    latest_checkpoint = max(checkpoints, key=lambda x: int(x.split('-')[1]))
+    latest_checkpoint_path = os.path.join(output_dir, latest_checkpoint)
+
+    print(f"Latest checkpoint: {latest_checkpoint_path}")
+
+    # Load the best model
+    best_model = DistilBertForSequenceClassification.from_pretrained(latest_checkpoint_path).to(device)
+    check_model_labels(best_model.config, latest_checkpoint_path)
+
+    # Example usage
+    try:
+        new_text = "We propose a comprehensive trade agreement to strengthen our economic ties."
+        result = classify_text(new_text, best_model, tokenizer, device)
+        print(f"The text '{new_text}' is classified as: {result}")
+    except Exception as e:
+        print(f"An error occurred during classification: {e}")
+
+    # Save the best model and tokenizer to the model directory
+    final_output_dir = "output/diplomatic_text_classifier_model"
+    best_model.save_pretrained(final_output_dir)
+    tokenizer.save_pretrained(final_output_dir)
+
+    # Temperature scaling on the eval split makes the classifier's confidence scores match its accuracy
+    with metrics.timer("calibrate"):
+        calibrate(best_model, tokenized_test, tokenizer, device, final_output_dir)
+    metrics.write(args.metrics_json, args.metrics_prometheus)
+
+    print(f"\nBest model and tokenizer saved to: {final_output_dir}")
+    print("\nYou can load the model and tokenizer later with:")
+    print(f"model = DistilBertForSequenceClassification.from_pretrained('{final_output_dir}')")
+    print(f"tokenizer = DistilBertTokenizerFast.from_pretrained('{final_output_dir}')")
+
+    # Verify saved files
+    print("\nSaved files:")
+    if os.path.exists(final_output_dir):
+        print(f"\nContents of {final_output_dir}:")
+        for file in os.listdir(final_output_dir):
+            print(f" - {file}")
+    else:
+        print(f"\n{final_output_dir} does not exist.")
+
+    print("\nTo view training progress and metrics in TensorBoard, run:")
+    print("tensorboard --logdir output/logs")
+    print("Then open the provided URL in your web browser.")
+
+if __name__ == "__main__":
+    main()